@@ -0,0 +1,132 @@
+# Compaction and ERASE handling of RoomHistory (whiteboard_history.py)
+from whiteboard_history import MAX_STROKE_POINTS, RoomHistory
+from whiteboard_protocol import (Packet, WIRE_BINARY, WIRE_LEGACY, decode_frames, frame_end,
+                                 text_to_frame)
+
+
+def history_of(*lines, compact_every=512):
+    history = RoomHistory(compact_every)
+    for line in lines:
+        history.append(Packet(text=line))
+    return history
+
+
+def frames(data):
+    messages = []
+    start = 0
+    while start < len(data):
+        end = frame_end(data, start)
+        messages += decode_frames(data[start:end])
+        start = end
+    return messages
+
+
+def test_segments_merge_into_one_stroke():
+    history = history_of(*(f"DRAW,{i},0,{i + 1},0,red,2\n".encode() for i in range(5)))
+    history.compact()
+    assert history.replay() == b"STROKE,red,2,0,0,1,0,2,0,3,0,4,0,5,0\n"
+    assert history.replay(WIRE_LEGACY) == b"".join(
+        f"DRAW,{i},0,{i + 1},0,red,2\n".encode() for i in range(5))
+    assert history.nbytes() == len(history.replay())
+
+
+def test_other_colours_and_gaps_are_not_merged():
+    history = history_of(b"DRAW,0,0,1,0,red,2\n", b"DRAW,1,0,2,0,blue,2\n",
+                         b"DRAW,5,5,6,6,blue,2\n", b"CHAT,alice,hi\n")
+    history.compact()
+    assert len(history.ops) == 4
+
+
+def test_long_strokes_are_split():
+    count = MAX_STROKE_POINTS + 10
+    history = history_of(*(f"DRAW,{i},0,{i + 1},0,red,2\n".encode() for i in range(count)))
+    history.compact()
+    assert [len(op.points) for op in history.ops] == [MAX_STROKE_POINTS, count + 1 - MAX_STROKE_POINTS + 1]
+
+
+def test_compacts_every_n_messages():
+    history = history_of(*(f"DRAW,{i},0,{i + 1},0,red,2\n".encode() for i in range(8)), compact_every=4)
+    assert history.tail == [] and len(history.ops) == 1
+    history.append(Packet(text=b"LINE,0,0,9,9,red,2\n"))
+    assert len(history) == 2
+
+
+def test_tail_bytes_and_replay_before_compaction():
+    lines = [b"LINE,0,0,9,9,red,2\n", b"RECT,1,1,5,5,blue,3\n"]
+    history = history_of(*lines)
+    assert history.replay() == b"".join(lines)
+    assert history.nbytes() == sum(map(len, lines))
+
+
+def test_binary_tail_replays_as_text():
+    history = RoomHistory()
+    history.append(Packet(frame=text_to_frame(b"LINE,0,0,9,9,red,2\n")))
+    assert history.replay() == b"LINE,0,0,9,9,red,2\n"
+    history.compact()
+    assert history.replay() == b"LINE,0,0,9,9,red,2\n"
+
+
+def test_compressed_replay():
+    lines = [f"DRAW,{i},0,{i + 1},0,red,2\n".encode() for i in range(20)] + [b"CIRCLE,5,5,9,9,green,1\n"]
+    history = history_of(*lines[:10])
+    history.compact()
+    for line in lines[10:]:
+        history.append(Packet(text=line))
+    assert frames(history.replay(WIRE_BINARY, compressed=True)) == frames(history.replay(WIRE_BINARY))
+
+
+def test_erase_removes_touched_shapes():
+    history = history_of(b"LINE,0,0,100,0,red,2\n", b"RECT,200,200,210,210,blue,2\n",
+                         b"ERASE,40,-10,60,10\n")
+    history.compact()
+    assert history.replay() == b"RECT,200,200,210,210,blue,2\n"
+
+
+def test_erase_cuts_strokes():
+    history = history_of(b"STROKE,red,2,0,0,50,0,100,0,150,0,200,0\n", b"ERASE,120,-10,130,10\n")
+    history.compact()
+    # a two-point piece goes out as a plain segment
+    assert history.replay() == b"STROKE,red,2,0,0,50,0,100,0\nDRAW,150,0,200,0,red,2\n"
+
+
+def test_erase_only_affects_earlier_drawings():
+    history = history_of(b"ERASE,0,0,100,100\n", b"LINE,10,10,20,20,red,2\n")
+    history.compact()
+    assert history.replay() == b"LINE,10,10,20,20,red,2\n"
+
+
+def test_erase_across_compactions():
+    history = history_of(b"LINE,10,10,20,20,red,2\n")
+    history.compact()
+    history.append(Packet(text=b"ERASE,0,0,100,100\n"))
+    history.compact()
+    assert history.replay() == b"" and history.nbytes() == 0
+
+
+def test_covered_strokes_are_dropped_under_eraser():
+    history = history_of(b"DRAW,10,10,20,10,black,2\n", b"DRAW,0,10,40,10,white,20\n")
+    history.compact()
+    assert history.replay() == b"DRAW,0,10,40,10,white,20\n"
+
+
+def test_partly_covered_strokes_are_kept():
+    history = history_of(b"DRAW,10,10,80,10,black,2\n", b"DRAW,0,10,40,10,white,20\n")
+    history.compact()
+    assert history.replay() == b"DRAW,10,10,80,10,black,2\nDRAW,0,10,40,10,white,20\n"
+
+
+def test_restore_from_checkpoint():
+    history = history_of(b"DRAW,0,0,1,0,red,2\n", b"DRAW,1,0,2,0,red,2\n", b"LINE,0,0,9,9,red,2\n")
+    history.compact()
+    restored = RoomHistory()
+    restored.restore(history.replay().splitlines(keepends=True))
+    assert restored.replay() == history.replay()
+    assert restored.nbytes() == history.nbytes()
+
+
+def test_clear():
+    history = history_of(b"LINE,0,0,9,9,red,2\n")
+    history.compact()
+    history.append(Packet(text=b"LINE,1,1,9,9,red,2\n"))
+    history.clear()
+    assert len(history) == 0 and history.replay() == b"" and history.nbytes() == 0
@@ -0,0 +1,98 @@
+# Recovery of journaled rooms (whiteboard_journal.py)
+import os
+
+from whiteboard_journal import RECORD, TEXT_RECORD, Journal, room_dir_name
+from whiteboard_protocol import Packet, text_to_frame
+
+ROOM = "1234"
+
+
+def journal_in(path):
+    # a long fsync interval: the tests sync by closing
+    return Journal(str(path), fsync_interval=60)
+
+
+def segment_files(path):
+    room = os.path.join(str(path), room_dir_name(ROOM))
+    return sorted(name for name in os.listdir(room) if name.endswith(".log"))
+
+
+def test_recover_text_and_binary_records(tmp_path):
+    journal = journal_in(tmp_path)
+    journal.append(ROOM, Packet(text=b"LINE,0,0,9,9,red,2\n"))
+    journal.append(ROOM, Packet(frame=text_to_frame(b"RECT,1,1,5,5,blue,3\n")))
+    journal.close()
+    rooms = journal_in(tmp_path).recover()
+    assert rooms[ROOM].replay() == b"LINE,0,0,9,9,red,2\nRECT,1,1,5,5,blue,3\n"
+
+
+def test_recover_after_torn_write(tmp_path):
+    journal = journal_in(tmp_path)
+    journal.append(ROOM, Packet(text=b"LINE,0,0,9,9,red,2\n"))
+    journal.close()
+    room = os.path.join(str(tmp_path), room_dir_name(ROOM))
+    segment = os.path.join(room, segment_files(tmp_path)[-1])
+    data = b"RECT,1,1,5,5,blue,3\n"
+    with open(segment, 'ab') as f:
+        # the crash came halfway through the second record
+        f.write((RECORD.pack(TEXT_RECORD, len(data)) + data)[:RECORD.size + 4])
+
+    journal = journal_in(tmp_path)
+    rooms = journal.recover()
+    assert rooms[ROOM].replay() == b"LINE,0,0,9,9,red,2\n"
+    # new records go to a fresh segment, never after the torn one
+    journal.append(ROOM, Packet(text=b"CIRCLE,5,5,9,9,green,1\n"))
+    journal.close()
+    assert len(segment_files(tmp_path)) == 2
+    rooms = journal_in(tmp_path).recover()
+    assert rooms[ROOM].replay() == b"LINE,0,0,9,9,red,2\nCIRCLE,5,5,9,9,green,1\n"
+
+
+def test_recover_torn_record_header(tmp_path):
+    journal = journal_in(tmp_path)
+    journal.append(ROOM, Packet(text=b"LINE,0,0,9,9,red,2\n"))
+    journal.close()
+    segment = os.path.join(str(tmp_path), room_dir_name(ROOM), segment_files(tmp_path)[-1])
+    with open(segment, 'ab') as f:
+        f.write(TEXT_RECORD)
+    rooms = journal_in(tmp_path).recover()
+    assert rooms[ROOM].replay() == b"LINE,0,0,9,9,red,2\n"
+
+
+def test_recover_from_checkpoint_and_later_segments(tmp_path):
+    journal = journal_in(tmp_path)
+    journal.append(ROOM, Packet(text=b"LINE,0,0,9,9,red,2\n"))
+    journal.checkpoint(ROOM, b"STROKE,red,2,0,0,1,0,2,0\n")
+    journal.append(ROOM, Packet(text=b"RECT,1,1,5,5,blue,3\n"))
+    journal.close()
+    # the checkpoint replaced the first segment
+    assert len(segment_files(tmp_path)) == 1
+    rooms = journal_in(tmp_path).recover()
+    assert rooms[ROOM].replay() == b"STROKE,red,2,0,0,1,0,2,0\nRECT,1,1,5,5,blue,3\n"
+
+
+def test_recover_clear(tmp_path):
+    journal = journal_in(tmp_path)
+    journal.append(ROOM, Packet(text=b"LINE,0,0,9,9,red,2\n"))
+    journal.append(ROOM, Packet(text=b"CLEAR\n"))
+    journal.append(ROOM, Packet(text=b"RECT,1,1,5,5,blue,3\n"))
+    journal.close()
+    rooms = journal_in(tmp_path).recover()
+    assert rooms[ROOM].replay() == b"RECT,1,1,5,5,blue,3\n"
+
+
+def test_recover_only_owned_rooms(tmp_path):
+    journal = journal_in(tmp_path)
+    journal.append(ROOM, Packet(text=b"LINE,0,0,9,9,red,2\n"))
+    journal.append("5678", Packet(text=b"LINE,0,0,9,9,red,2\n"))
+    journal.close()
+    rooms = journal_in(tmp_path).recover(owns=lambda code: code == "5678")
+    assert list(rooms) == ["5678"]
+
+
+def test_drop_removes_room(tmp_path):
+    journal = journal_in(tmp_path)
+    journal.append(ROOM, Packet(text=b"LINE,0,0,9,9,red,2\n"))
+    journal.drop(ROOM)
+    journal.close()
+    assert journal_in(tmp_path).recover() == {}
@@ -0,0 +1,64 @@
+# Round trips between the text and binary wire formats (whiteboard_protocol.py)
+import pytest
+
+from whiteboard_protocol import (COORD_MAX, COORD_MIN, ProtocolError, check_drawing, decode_frame,
+                                 encode_frame, format_line, frame_to_text, parse_line, text_to_frame,
+                                 WIRE_TEXT)
+
+MESSAGES = [
+    (b"DRAW", (10, 20, 30, 40, 'red', 3)),
+    (b"LINE", (COORD_MIN, COORD_MAX, 0, -1, '#00ff00', 500)),
+    (b"RECT", (1, 2, 3, 4, '#abc', 1)),
+    (b"CIRCLE", (100, 100, 150, 150, 'blue', 2)),
+    (b"TRI", (0, 0, 10, 0, 5, 8, 'black', 4)),
+    (b"STROKE", ('purple', 6, [0, 0, 5, -5, 300, 2, -40, 7])),
+    (b"CHAT", ('alice', 'hello, world')),
+    (b"USER_LIST", ['alice', 'bob']),
+    (b"REDIRECT", ('10.0.0.2', 5001)),
+    (b"ERASE", (5, 6, 70, 80)),
+    (b"SEQ", (42, 'a1b2')),
+    (b"SLOW", (250,)),
+]
+
+
+@pytest.mark.parametrize("kind, fields", MESSAGES)
+def test_text_round_trip(kind, fields):
+    line = format_line(kind, fields)
+    assert line.endswith(b"\n")
+    assert parse_line(line[:-1]) == (kind, fields)
+
+
+@pytest.mark.parametrize("kind, fields", MESSAGES)
+def test_frame_round_trip(kind, fields):
+    assert decode_frame(encode_frame(kind, fields)) == (kind, fields)
+
+
+@pytest.mark.parametrize("kind, fields", MESSAGES)
+def test_text_frame_conversion(kind, fields):
+    line = format_line(kind, fields)
+    assert frame_to_text(text_to_frame(line)) == line
+
+
+def test_unknown_opcode():
+    with pytest.raises(ProtocolError):
+        decode_frame(b"\x01\xfa")
+
+
+@pytest.mark.parametrize("line", [
+    b"DRAW,1,2,3,4,red,2",
+    b"STROKE,#123456,3,0,0,1,1,2,2",
+])
+def test_valid_drawings_pass(line):
+    assert check_drawing(line, WIRE_TEXT)
+
+
+@pytest.mark.parametrize("line", [
+    b"DRAW,1,2,3,4,red,0",
+    b"DRAW,1,2,3,40000,red,2",
+    b"DRAW,1.5,2,3,4,red,2",
+    b"DRAW,inf,2,3,4,red,2",
+    b"DRAW,1,2,3,4,not a colour,2",
+    b"STROKE,red,2,0,0,1",
+])
+def test_invalid_drawings_rejected(line):
+    assert not check_drawing(line, WIRE_TEXT)
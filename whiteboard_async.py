@@ -0,0 +1,169 @@
+# EVENT LOOP SERVER CORE (whiteboard_async.py)
+# -----------------------------------------------------------------------------
+# Hoonhee Jang 21011676 & Ulmasov Muzaffar - 23013095
+#
+# DESCRIPTION:
+# The single-threaded asyncio core of whiteboard_server.py ("async" mode, also
+# used by every whiteboard_cluster.py worker). Rooms, broadcasting, the lobby and
+# the options all stay in whiteboard_server; this file only holds the connection
+# protocol and the listener. It is imported only when the async core is chosen,
+# so the default threaded server starts without loading asyncio.
+# -----------------------------------------------------------------------------
+import time
+import asyncio
+
+import whiteboard_server as server
+from whiteboard_framing import Framer
+from whiteboard_limits import RateLimit
+from whiteboard_protocol import ProtocolError, WIRE_TEXT
+
+
+class AsyncClient(asyncio.BufferedProtocol):
+    """A client connection served by the asyncio event loop (whiteboard_server --async).
+
+    It offers the same send()/close() calls as a socket, so rooms, broadcast()
+    and send_user_list() treat threaded and async clients alike. The loop reads
+    straight into the client's Framer (BufferedProtocol), without copies.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.framer = Framer(server.RECV_BUFFER, server.MAX_MESSAGE)
+        self.username = ""
+        self.room_code = None
+        self.queue = server.OutboundQueue()
+        self.paused = False
+        self.batch = []             # sends of the current loop iteration, written together by flush()
+        self.wire = WIRE_TEXT
+        self.wire_in = WIRE_TEXT
+        self.sequenced = False
+        self.slow = False
+        self.compressed = False
+        self.limit = RateLimit(server.CLIENT_MESSAGE_RATE, server.CLIENT_BYTE_RATE)
+        self.resume_at = 0.0
+        self.notified_at = 0.0
+        self.reserved_code = None
+        self.throttled = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(high=server.TRANSPORT_BUFFER)
+        server.connections_total.inc()
+        tls = transport.get_extra_info('ssl_object')
+        if tls is not None:
+            server.tls_handshakes.inc(1, (str(tls.session_reused).lower(),))
+
+    def get_buffer(self, sizehint):
+        return self.framer.writable()
+
+    def buffer_updated(self, nbytes):
+        self.framer.commit(nbytes)
+        self.process()
+
+    def data_received(self, data):
+        """Feeds bytes read elsewhere (e.g. by the cluster front) as if they had arrived."""
+        self.framer.feed(data)
+        self.process()
+
+    def process(self):
+        while self.room_code is None:
+            line = self.framer.next_line()
+            if line is None:
+                if self.framer.pending() > server.MAX_HANDSHAKE:
+                    server.handshakes_failed.inc()
+                    server.log("Handshake failed")
+                    self.close()
+                return
+            if not self.handshake(bytes(line)):
+                return
+        try:
+            server.process_input(self, self.username, self.room_code, self.framer)
+        except ProtocolError as e:
+            server.log(f"ERROR: {e}")
+            self.close()
+            return
+        wait = self.resume_at - time.monotonic()
+        if wait > 0 and not self.throttled:
+            # Over its rate limit: stop reading until the debt is paid back
+            self.throttled = True
+            self.transport.pause_reading()
+            asyncio.get_running_loop().call_later(wait, self.unthrottle)
+
+    def unthrottle(self):
+        self.throttled = False
+        if not self.transport.is_closing():
+            self.transport.resume_reading()
+            self.process()
+
+    def handshake(self, raw_msg):
+        if raw_msg in server.LOBBY_REQUESTS:
+            return server.answer_lobby(self, raw_msg)
+        parts = server.parse_join(raw_msg)
+        if parts is None:
+            server.handshakes_failed.inc()
+            server.log("Handshake failed")
+            self.close()
+            return False
+        self.username, self.room_code, options = parts
+        server.negotiate(self, options)
+        server.join_room(self, self.username, self.room_code, options)
+        return True
+
+    def connection_lost(self, exc):
+        if self.room_code:
+            server.leave_room(self, self.room_code)
+
+    def send(self, message, bulk=False):
+        kind, data = server.outgoing(message, self.wire)
+        if not data or self.transport.is_closing():
+            return 0
+        if not self.paused:
+            if not self.batch:
+                asyncio.get_running_loop().call_soon(self.flush)
+            self.batch.append(data)
+        elif not self.queue.put(data, kind, bulk):
+            server.evict_client(self)
+            return 0
+        return len(data)
+
+    #One transport write per loop iteration: a burst of small DRAW frames costs one
+    #syscall (and with TLS one record and one encryption) instead of one each
+    def flush(self):
+        data, self.batch = b"".join(self.batch), []
+        if data and not self.transport.is_closing():
+            self.transport.write(data)
+
+    #The event loop drains the transport; once it catches up, flush our queue into it
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        data = self.queue.take()
+        if data:
+            self.transport.write(data)
+
+    def close(self):
+        self.framer.clear()
+        self.flush()    # e.g. a REDIRECT sent just before closing
+        self.transport.close()
+
+#Single-threaded event loop core: every client is an AsyncClient on one loop
+def start_async_server():
+    server.raise_fd_limit()
+    try:
+        asyncio.run(serve_async())
+    except OSError:
+        server.log(f"Error: Port {server.PORT} is busy. Is the server already running?")
+        return False
+    return True
+
+async def serve_async():
+    loop = asyncio.get_running_loop()
+    if server.BROADCAST_TICK > 0:
+        server.start_scheduler(loop)
+    listener = await loop.create_server(AsyncClient, server.HOST, server.PORT, backlog=server.BACKLOG, reuse_address=True,
+                                        ssl=server.tls_context, ssl_handshake_timeout=server.TLS_HANDSHAKE_TIMEOUT if server.tls_context else None)
+    server.log(f"Server listening on {server.HOST}:{server.PORT} (async)")
+    async with listener:
+        await listener.serve_forever()
@@ -0,0 +1,424 @@
+# LOAD GENERATOR / BENCHMARK (whiteboard_bench.py)
+# -----------------------------------------------------------------------------
+# DESCRIPTION:
+# Measures the server without any GUI. It starts a headless server (or targets a
+# running one) and drives N rooms x M synthetic clients over the normal protocol:
+# scribbled STROKEs, shapes, chat, and clients that leave and rejoin.
+#
+# Every drawing carries a sequence id in its first point (x = low 15 bits,
+# y = high bits), so a receiver can look up when it was sent and measure the
+# end-to-end fan-out latency. Drawings a rejoining client receives that were sent
+# before it joined are its history replay, which gives the late-join replay time.
+#
+# Reported: p50/p99/p999 fan-out latency, messages sent and delivered per second,
+# replay time, connect time (TCP, plus the handshake with --tls), and the server's
+# CPU and peak RSS (Linux /proc, process tree).
+# Results can be saved as a baseline and later runs compared against it.
+#
+# Usage:
+#   python whiteboard_bench.py --rooms 20 --clients 10 --duration 15 --save base.json
+#   python whiteboard_bench.py --rooms 20 --clients 10 --duration 15 --compare base.json
+#   python whiteboard_bench.py --tls    (needs the test certificates from "make certs")
+# -----------------------------------------------------------------------------
+import os
+import sys
+import json
+import time
+import random
+import ssl
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import whiteboard_protocol as protocol
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BENCH_PORT = 8100           # port of the server the benchmark starts
+STARTUP_TIMEOUT = 15        # seconds to wait for that server to accept connections
+SAMPLE_INTERVAL = 0.5       # seconds between CPU/RSS samples
+COLORS = ['black', 'red', 'green', 'blue', 'orange', 'purple', '#336699']
+REGRESSION_TOLERANCE = 0.10
+TLS_CERT = os.path.join(HERE, "certs", "server.crt")   # --tls: server certificate, trusted by the clients
+TLS_KEY = os.path.join(HERE, "certs", "server.key")
+
+# Metrics compared against a baseline: (path in the results, True if higher is better)
+COMPARED = [
+    (("latency_ms", "p50"), False),
+    (("latency_ms", "p99"), False),
+    (("latency_ms", "p999"), False),
+    (("replay_ms", "p50"), False),
+    (("replay_ms", "p99"), False),
+    (("connect_ms", "p50"), False),
+    (("delivered_per_s",), True),
+    (("server", "cpu_percent"), False),
+    (("server", "rss_peak_mb"), False),
+]
+
+
+class Recorder:
+    """Shared by all synthetic clients: send times by sequence id, and the samples."""
+
+    def __init__(self):
+        self.next_id = 1
+        self.sent_at = {}
+        self.sent = 0
+        self.delivered = 0
+        self.latencies = []
+        self.replays = []
+        self.connects = []
+        self.errors = 0
+
+    def new_id(self):
+        seq = self.next_id
+        self.next_id += 1
+        self.sent_at[seq] = time.perf_counter()
+        self.sent += 1
+        return seq
+
+
+#The sequence id hidden in the first point of a drawing
+def tag_point(seq):
+    return seq & 0x7FFF, seq >> 15
+
+def read_tag(kind, fields):
+    if kind == b"STROKE":
+        x, y = fields[2][0], fields[2][1]
+    else:
+        x, y = fields[0], fields[1]
+    return x | (y << 15)
+
+#One scripted operation: mostly scribbles, some shapes, a little chat
+def scripted_op(rng, seq):
+    x, y = tag_point(seq)
+    color, size = rng.choice(COLORS), rng.randint(1, 8)
+    roll = rng.random()
+    if roll < 0.75:
+        coords = [x, y]
+        px, py = rng.randint(0, 1200), rng.randint(0, 800)
+        for _ in range(rng.randint(4, 24)):
+            px, py = px + rng.randint(-12, 12), py + rng.randint(-12, 12)
+            coords += (px, py)
+        return b"STROKE", (color, size, coords)
+    if roll < 0.95:
+        kind = rng.choice((b"LINE", b"RECT", b"CIRCLE", b"TRI"))
+        coords = [x, y] + [rng.randint(0, 1200) for _ in range(4 if kind == b"TRI" else 2)]
+        return kind, tuple(coords) + (color, size)
+    return b"CHAT", ("", f"message {seq}")
+
+
+class SyntheticClient:
+    """One scripted user: joins, draws at 'rate' ops/s, leaves and rejoins on churn."""
+
+    def __init__(self, bench, room, name):
+        self.bench = bench
+        self.recorder = bench.recorder
+        self.room = room
+        self.name = name
+        self.rng = random.Random(f"{room}/{name}")
+        self.writer = None
+        self.wire = protocol.WIRE_TEXT
+
+    async def run(self, stop_at):
+        while time.perf_counter() < stop_at:
+            session_end = stop_at
+            if self.bench.churn > 0:
+                session_end = min(stop_at, time.perf_counter() + self.rng.expovariate(self.bench.churn))
+            try:
+                await self.session(session_end)
+            except (OSError, asyncio.IncompleteReadError, protocol.ProtocolError):
+                self.recorder.errors += 1
+                await asyncio.sleep(0.1)
+
+    async def session(self, session_end):
+        started = time.perf_counter()
+        reader, self.writer = await asyncio.open_connection(self.bench.host, self.bench.port, ssl=self.bench.tls)
+        self.recorder.connects.append(time.perf_counter() - started)
+        self.wire = protocol.WIRE_TEXT
+        options = f",{protocol.BINARY_VERSION}" if self.bench.binary else f",{protocol.STROKE_OPTION}"
+        joined_at = time.perf_counter()
+        self.writer.write(f"JOIN,{self.name},{self.room}{options}\n".encode('utf-8'))
+        receiving = asyncio.ensure_future(self.receive(reader, joined_at))
+        try:
+            interval = 1 / self.bench.rate
+            await asyncio.sleep(self.rng.uniform(0, interval))
+            while time.perf_counter() < session_end and not receiving.done():
+                self.send(*scripted_op(self.rng, self.recorder.new_id()))
+                await self.writer.drain()
+                await asyncio.sleep(interval)
+        finally:
+            receiving.cancel()
+            self.writer.close()
+
+    def send(self, kind, fields):
+        if self.wire == protocol.WIRE_BINARY:
+            self.writer.write(protocol.encode_frame(kind, fields))
+        elif kind == b"CHAT":
+            self.writer.write(f"CHAT,{fields[1]}\n".encode('utf-8'))
+        else:
+            self.writer.write(protocol.format_line(kind, fields))
+
+    async def receive(self, reader, joined_at):
+        buffer = b""
+        wire_in = protocol.WIRE_TEXT
+        replay_end = None
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            buffer += data
+            now = time.perf_counter()
+            start = 0
+            while True:
+                if wire_in == protocol.WIRE_BINARY:
+                    frame, end = protocol.next_frame(buffer, start)
+                    if frame is None:
+                        break
+                    kind, fields = protocol.decode_frame(frame)
+                else:
+                    end = buffer.find(b'\n', start)
+                    if end < 0:
+                        break
+                    line = buffer[start:end]
+                    end += 1
+                    if line + b'\n' == protocol.PROTO_LINE:
+                        self.writer.write(protocol.PROTO_LINE)
+                        self.wire = wire_in = protocol.WIRE_BINARY
+                        start = end
+                        continue
+                    kind, fields = protocol.parse_line(line)
+                start = end
+                self.recorder.delivered += 1
+                if kind not in protocol.DRAWING_KINDS:
+                    continue
+                sent_at = self.recorder.sent_at.get(read_tag(kind, fields))
+                if sent_at is None:
+                    continue
+                if sent_at < joined_at:
+                    replay_end = now
+                else:
+                    if replay_end is not None:
+                        self.recorder.replays.append(replay_end - joined_at)
+                        replay_end = None
+                    self.recorder.latencies.append(now - sent_at)
+            buffer = buffer[start:]
+
+
+class ProcessSampler:
+    """CPU time and RSS of a process and its children, read from /proc (Linux only)."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.tick = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self.rss_peak = 0
+        self.cpu_start = self.cpu()
+        self.wall_start = time.perf_counter()
+
+    def tree(self):
+        pids, stack = [], [self.pid]
+        while stack:
+            pid = stack.pop()
+            pids.append(pid)
+            try:
+                for task in os.listdir(f"/proc/{pid}/task"):
+                    with open(f"/proc/{pid}/task/{task}/children") as f:
+                        stack += map(int, f.read().split())
+            except OSError:
+                pass
+        return pids
+
+    def cpu(self):
+        total = 0
+        for pid in self.tree():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rpartition(')')[2].split()
+                total += int(fields[11]) + int(fields[12])  # utime + stime
+            except (OSError, IndexError, ValueError):
+                pass
+        return total / self.tick
+
+    def sample(self):
+        rss = 0
+        for pid in self.tree():
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            rss += int(line.split()[1]) * 1024
+            except (OSError, ValueError):
+                pass
+        self.rss_peak = max(self.rss_peak, rss)
+
+    def result(self):
+        wall = time.perf_counter() - self.wall_start
+        return {"cpu_percent": round(100 * (self.cpu() - self.cpu_start) / wall, 1),
+                "rss_peak_mb": round(self.rss_peak / (1 << 20), 1)}
+
+
+class Bench:
+    def __init__(self, args):
+        self.host = args.host
+        self.port = args.port
+        self.rooms = args.rooms
+        self.clients = args.clients
+        self.duration = args.duration
+        self.rate = args.rate
+        self.churn = args.churn
+        self.binary = not args.text
+        self.tls = tls_client_context() if args.tls else None
+        self.recorder = Recorder()
+
+    async def run(self, server_pid=None):
+        sampler = ProcessSampler(server_pid) if server_pid and os.path.isdir("/proc") else None
+        stop_at = time.perf_counter() + self.duration
+        clients = [SyntheticClient(self, f"bench{room}", f"user{index}")
+                   for room in range(self.rooms) for index in range(self.clients)]
+        tasks = [asyncio.ensure_future(client.run(stop_at)) for client in clients]
+        started = time.perf_counter()
+        while not all(task.done() for task in tasks):
+            if sampler:
+                sampler.sample()
+            await asyncio.sleep(SAMPLE_INTERVAL)
+        elapsed = time.perf_counter() - started
+        results = self.results(elapsed)
+        if sampler:
+            results["server"] = sampler.result()
+        return results
+
+    def results(self, elapsed):
+        recorder = self.recorder
+        return {
+            "config": {"rooms": self.rooms, "clients": self.clients, "duration": self.duration,
+                       "rate": self.rate, "churn": self.churn, "binary": self.binary, "tls": self.tls is not None},
+            "latency_ms": percentiles(recorder.latencies),
+            "replay_ms": percentiles(recorder.replays),
+            "connect_ms": percentiles(recorder.connects),
+            "sent_per_s": round(recorder.sent / elapsed, 1),
+            "delivered_per_s": round(recorder.delivered / elapsed, 1),
+            "errors": recorder.errors,
+        }
+
+
+#Client side of --tls: trusts the test certificate, whichever address the server is reached at
+def tls_client_context():
+    context = ssl.create_default_context(cafile=TLS_CERT)
+    context.check_hostname = False
+    return context
+
+#p50/p99/p999/max of samples in seconds, as milliseconds
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+    def rank(q):
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 3)
+    return {"count": len(samples), "p50": rank(0.50), "p99": rank(0.99), "p999": rank(0.999),
+            "max": round(samples[-1] * 1000, 3)}
+
+#Starts a headless server for the run and waits until it accepts connections
+def launch_server(mode, port, workers, extra_args=()):
+    if mode == 'cluster':
+        admin = os.path.join(tempfile.gettempdir(), f"whiteboard-bench-{port}.sock")
+        cmd = [sys.executable, os.path.join(HERE, "whiteboard_cluster.py"), "--port", str(port),
+               "--admin", admin, "serve", "--workers", str(workers)]
+    else:
+        cmd = [sys.executable, os.path.join(HERE, "whiteboard_server.py"), "--port", str(port)]
+        if mode == 'async':
+            cmd.append("--async")
+    cmd += extra_args
+    process = subprocess.Popen(cmd, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit(f"server ({' '.join(cmd)}) did not start")
+
+def lookup(results, path):
+    for key in path:
+        if not isinstance(results, dict) or key not in results:
+            return None
+        results = results[key]
+    return results
+
+#Prints current vs baseline; returns the names of metrics that got worse than 'tolerance'
+def compare(baseline, results, tolerance):
+    regressions = []
+    print(f"{'metric':<24}{'baseline':>12}{'current':>12}{'change':>10}")
+    for path, higher_is_better in COMPARED:
+        old, new = lookup(baseline, path), lookup(results, path)
+        if old is None or new is None:
+            continue
+        name = ".".join(path)
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        print(f"{name:<24}{old:>12}{new:>12}{change:>+10.1%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+def report(results):
+    print(json.dumps(results, indent=2))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Whiteboard server load generator and benchmark")
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--clients", type=int, default=5, help="clients per room")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--rate", type=float, default=20, help="operations per second per client")
+    parser.add_argument("--churn", type=float, default=0.05, help="leave/rejoin rate per client per second")
+    parser.add_argument("--text", action="store_true", help="use the text protocol instead of binary")
+    parser.add_argument("--tls", action="store_true", help="connect with TLS (the started server gets certs/server.*)")
+    parser.add_argument("--mode", choices=("threaded", "async", "cluster"), default="async",
+                        help="server started for the run")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="cluster mode workers")
+    parser.add_argument("--server-args", default="", help="extra options for the started server, e.g. \"--tick 20\"")
+    parser.add_argument("--connect", metavar="HOST:PORT", help="benchmark a running server instead")
+    parser.add_argument("--save", metavar="FILE", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+    if args.tls and args.mode == 'cluster' and not args.connect:
+        parser.error("--tls is not supported by the cluster (the front reads JOIN in plain text)")
+
+    process = None
+    if args.connect:
+        args.host, _, port = args.connect.rpartition(':')
+        args.port = int(port)
+    else:
+        args.host, args.port = "127.0.0.1", BENCH_PORT
+        server_args = args.server_args.split()
+        if args.tls:
+            server_args += ["--tls-cert", TLS_CERT, "--tls-key", TLS_KEY]
+        process = launch_server(args.mode, args.port, args.workers, server_args)
+    try:
+        results = asyncio.run(Bench(args).run(process.pid if process else None))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+    results["config"]["mode"] = "external" if args.connect else args.mode
+    results["config"]["server_args"] = args.server_args
+    report(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,26 +6,148 @@
 # DESCRIPTION:
 # This program handles the GUI (Tkinter) and Network logic.
 # It separates networking into a background thread to prevent the GUI from freezing.
+# The network thread only parses; the Tk loop applies messages in small timed batches.
 # It implements "Interpolation" for smooth drawing lines.
+# Brush points are batched into simplified STROKE polylines before they are sent.
+# A REDIRECT from a cluster front end or a moving room makes it rejoin elsewhere.
+# It counts the room operations it has applied (SEQ markers keep the count exact);
+# after a dropped connection it rejoins with "since=<seq>" and keeps its canvas.
+# Drawings are kept as objects in a spatial index (whiteboard_scene.py): only the
+# visible ones are drawn, the view can be panned (right drag) and zoomed (wheel),
+# and the eraser deletes the objects it touches with ERASE messages.
+# With TLS_CA_FILE (or --tls FILE) it connects over TLS and offers its previous
+# TLS session when it reconnects, so a resume skips the full handshake.
+# At startup it looks for servers on the LAN (UDP DISCOVER broadcast), gets new
+# room codes from the server (NEW_ROOM) and shows the open rooms (LIST_ROOMS).
 # -----------------------------------------------------------------------------
 
+import sys
+import ssl
+import math
+import time
 import socket
+import struct
 import threading
+import collections
 import tkinter as tk
-import whiteboard_server
+import whiteboard_protocol as protocol
+from whiteboard_framing import Framer
+from whiteboard_history import simplify_polyline
+from whiteboard_scene import Scene, normalize_rect, rects_overlap
 
 from tkinter import simpledialog, colorchooser, messagebox, PanedWindow, Listbox, Entry
 import random
 
+try:
+    from PIL import Image, ImageDraw, ImageTk
+except ImportError:  # Pillow is optional: without it every stroke stays a canvas item
+    Image = None
+
 
 # --- NETWORK CONFIGURATION ---
 SERVER_HOST = '127.0.0.1'
 SERVER_PORT = 8000
+USE_BINARY = True   # offer the compact binary protocol in JOIN (falls back to text)
+USE_COMPRESSION = True  # with binary: ask for the history replay as zlib blocks
+RECV_BUFFER = 256 * 1024    # receive buffer: a history replay arrives in a few large reads
+CONNECT_TIMEOUT = 3         # seconds per reconnect attempt
+TLS_CA_FILE = None          # e.g. 'certs/server.crt': connect with TLS, trusting this certificate
+DISCOVERY_TIMEOUT = 0.5     # seconds to collect answers to the LAN discovery broadcast
+LOBBY_ROOMS_SHOWN = 10      # rooms listed in the "Join" dialog
+RECONNECT_DELAYS = (0.05, 0.25, 0.5, 1, 2, 4, 8)    # waits before each resume attempt
+
+# --- STROKE BATCHING ---
+STROKE_FLUSH_MS = 25        # send buffered brush points at least this often
+STROKE_FLUSH_POINTS = 64    # ...or as soon as this many are waiting
+STROKE_TOLERANCE = 1.0      # max deviation (px) allowed when simplifying a batch
+SLOW_FACTOR = 4             # after a SLOW from the server, batches are this many times longer...
+SLOW_HOLD = 2.0             # ...for at least this many seconds
+
+# --- INBOUND MESSAGES ---
+INBOX_POLL_MS = 15          # how often the Tk loop checks for new messages
+INBOX_BUDGET_MS = 8         # max time spent applying messages per Tk frame
+INBOX_MAX_BATCH = 2000      # max messages applied per Tk frame
+
+# --- RENDERING ---
+RASTER_LAYER = True         # flatten finished strokes into one image (needs Pillow)
+
+# --- VIEW ---
+ZOOM_STEP = 1.25            # zoom factor per mouse wheel notch
+MIN_ZOOM = 0.1
+MAX_ZOOM = 8.0
+
+class RasterLayer:
+    """Finished strokes flattened into an offscreen Pillow image, shown as one canvas item.
+
+    It offers the canvas create_* calls used for committed drawings, so
+    WhiteboardApp draws on whichever of the two is its 'surface'. Canvas cost
+    no longer grows with the number of strokes; only previews stay vector items.
+    """
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        # Screen-sized, so resizing the window never needs a bigger image
+        size = (canvas.winfo_screenwidth(), canvas.winfo_screenheight())
+        self.image = Image.new('RGB', size, 'white')
+        self.draw = ImageDraw.Draw(self.image)
+        self.photo = ImageTk.PhotoImage(self.image)
+        self.colors = {}
+        self.refresh_job = None
+        self.attach()
+
+    def attach(self):
+        """(Re)creates the canvas item, e.g. after canvas.delete("all")."""
+        item = self.canvas.create_image(0, 0, image=self.photo, anchor=tk.NW)
+        self.canvas.tag_lower(item)
+
+    def clear(self):
+        self.draw.rectangle((0, 0) + self.image.size, fill='white')
+        self.refresh()
+
+    def refresh(self):
+        # Many strokes per Tk frame, one copy into the PhotoImage
+        if self.refresh_job is None:
+            self.refresh_job = self.canvas.after_idle(self.push)
+
+    def push(self):
+        self.refresh_job = None
+        self.photo.paste(self.image)
+
+    def rgb(self, color):
+        # Ask Tk, so named colours match what the vector canvas would show
+        if color not in self.colors:
+            try:
+                r, g, b = self.canvas.winfo_rgb(color)
+            except tk.TclError:
+                r = g = b = 0
+            self.colors[color] = (r >> 8, g >> 8, b >> 8)
+        return self.colors[color]
+
+    def create_line(self, *coords, fill='black', width=1, capstyle=None, **options):
+        color, points = self.rgb(fill), list(zip(coords[0::2], coords[1::2]))
+        self.draw.line(points, fill=color, width=width, joint='curve')
+        if capstyle == tk.ROUND and width > 2:
+            r = width / 2
+            for x, y in points:
+                self.draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+        self.refresh()
+
+    def create_rectangle(self, x1, y1, x2, y2, outline='black', width=1, **options):
+        self.draw.rectangle((min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)), outline=self.rgb(outline), width=width)
+        self.refresh()
+
+    def create_oval(self, x1, y1, x2, y2, outline='black', width=1, **options):
+        self.draw.ellipse((min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)), outline=self.rgb(outline), width=width)
+        self.refresh()
+
+    def create_polygon(self, *coords, outline='black', width=1, **options):
+        self.create_line(*coords, *coords[:2], fill=outline, width=width)
 
 class WhiteboardApp:
     def __init__(self, root, client_socket, username, room_code=""):
         self.root = root
         self.client_socket = client_socket
+        self.server_address = client_socket.getpeername()[:2]
         self.username = username
         self.room_code = room_code
 
@@ -39,6 +161,36 @@ class WhiteboardApp:
         self.drag_start_pos = None
         self.temp_shape_id = None
 
+        # Brush stroke being batched: points not yet sent, their colour/size,
+        # and the local per-segment items that the sent polyline replaces
+        self.stroke_points = []
+        self.stroke_new = 0
+        self.stroke_style = None
+        self.stroke_ids = []
+        self.flush_job = None
+
+        # Wire format: text until the server confirms binary with "PROTO,bin1"
+        self.wire = protocol.WIRE_TEXT
+        self.send_lock = threading.Lock()
+
+        # Parsed (cmd, fields) from the network thread, applied by drain_inbox()
+        self.inbox = collections.deque()
+
+        # Room operations applied so far, for resuming after a dropped connection.
+        # None until the server sends its first SEQ marker (older servers never do)
+        self.last_seq = None
+        self.epoch = None
+        self.closing = False
+        self.slow_until = 0.0       # monotonic time until which strokes are batched longer (SLOW)
+
+        # Everything drawn, in world coordinates; the canvas shows the part of the
+        # world starting at 'offset', magnified by 'scale'
+        self.scene = Scene()
+        self.offset = (0, 0)
+        self.scale = 1.0
+        self.pan_start = None
+        self.redraw_job = None
+
         # 1. Build the UI
         self.setup_gui()
 
@@ -46,13 +198,15 @@ class WhiteboardApp:
         # daemon=True ensures this thread dies when the main window closes
         receive_thread = threading.Thread(target=self.receive_messages, daemon=True)
         receive_thread.start()
+        self.root.after(INBOX_POLL_MS, self.drain_inbox)
 
         # 3. Handle window close button
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
     def setup_gui(self):
         """Builds the window layout."""
-        self.root.title(f"Network Whiteboard - {self.username} (Room: {self.room_code})")
+        self.title = f"Network Whiteboard - {self.username} (Room: {self.room_code})"
+        self.root.title(self.title)
         self.root.geometry("1000x600")
         self.root.minsize(800, 500)  # Minimum size to prevent UI breaking
 
@@ -64,6 +218,9 @@ class WhiteboardApp:
         self.canvas_frame = tk.Frame(self.main_pane, bg='white')
         self.canvas = tk.Canvas(self.canvas_frame, bg='white', cursor="crosshair")
         self.canvas.pack(fill=tk.BOTH, expand=True)
+        # Finished drawings go to 'surface': the raster layer, or the canvas itself
+        self.raster = RasterLayer(self.canvas) if RASTER_LAYER and Image else None
+        self.surface = self.raster or self.canvas
         self.main_pane.add(self.canvas_frame, width=750)
 
         # --- RIGHT: SIDEBAR ---
@@ -126,30 +283,45 @@ class WhiteboardApp:
         self.canvas.bind('<Button-1>', self.on_press)
         self.canvas.bind('<B1-Motion>', self.on_drag)
         self.canvas.bind('<ButtonRelease-1>', self.on_release)
+        # Pan with the right (or middle) button, zoom with the wheel
+        for button in ('2', '3'):
+            self.canvas.bind(f'<ButtonPress-{button}>', self.on_pan_start)
+            self.canvas.bind(f'<B{button}-Motion>', self.on_pan)
+        self.canvas.bind('<MouseWheel>', lambda e: self.zoom(ZOOM_STEP if e.delta > 0 else 1 / ZOOM_STEP, e.x, e.y))
+        self.canvas.bind('<Button-4>', lambda e: self.zoom(ZOOM_STEP, e.x, e.y))
+        self.canvas.bind('<Button-5>', lambda e: self.zoom(1 / ZOOM_STEP, e.x, e.y))
+        self.canvas.bind('<Configure>', lambda e: self.request_redraw())
 
     # --- LOGIC: MOUSE & DRAWING ---
+    # Mouse positions are converted to world coordinates; previews are drawn in screen coordinates
     def on_press(self, event):
-        self.drag_start_pos = (event.x, event.y)
-        self.last_pos = (event.x, event.y)
-        if self.current_tool in ['brush', 'eraser']:
-            self.paint_segment(event.x, event.y, event.x, event.y)
+        x, y = self.to_world(event.x, event.y)
+        self.drag_start_pos = (x, y)
+        self.last_pos = (x, y)
+        if self.current_tool == 'brush':
+            self.paint_segment(x, y, x, y)
+        elif self.current_tool == 'eraser':
+            self.erase_along(x, y, x, y)
 
     def on_drag(self, event):
         # Smooth Drawing Logic:
         # Instead of drawing a dot at event.x/y, we draw a LINE from
         # the last mouse position to the current one. This fills the gaps.
-        if self.current_tool in ['brush', 'eraser']:
+        if self.current_tool in ['brush', 'eraser'] and self.last_pos:
             x1, y1 = self.last_pos
-            x2, y2 = event.x, event.y
-            self.paint_segment(x1, y1, x2, y2)
+            x2, y2 = self.to_world(event.x, event.y)
+            if self.current_tool == 'brush':
+                self.paint_segment(x1, y1, x2, y2)
+            else:
+                self.erase_along(x1, y1, x2, y2)
             self.last_pos = (x2, y2)  # Update last position
-        else:
+        elif self.drag_start_pos:
             # Shape Preview Logic (Draws temporary shape)
             if self.temp_shape_id:
                 self.canvas.delete(self.temp_shape_id)
-            x1, y1 = self.drag_start_pos
+            x1, y1 = self.to_screen(self.drag_start_pos)
             x2, y2 = event.x, event.y
-            c, s = self.current_color, self.size_slider.get()
+            c, s = self.current_color, self.screen_width(self.size_slider.get())
 
             if self.current_tool == 'line':
                 self.temp_shape_id = self.canvas.create_line(x1, y1, x2, y2, fill=c, width=s)
@@ -163,6 +335,8 @@ class WhiteboardApp:
 
     def on_release(self, event):
         self.last_pos = None
+        self.flush_stroke()
+        self.stroke_points = []
         if self.temp_shape_id:
             self.canvas.delete(self.temp_shape_id)
             self.temp_shape_id = None
@@ -170,37 +344,175 @@ class WhiteboardApp:
         # If it was a shape tool, finalize the shape and send to server
         if self.current_tool not in ['brush', 'eraser'] and self.drag_start_pos:
             x1, y1 = self.drag_start_pos
-            x2, y2 = event.x, event.y
+            x2, y2 = self.to_world(event.x, event.y)
             c, s = self.current_color, self.size_slider.get()
-            msg = ""
             if self.current_tool == 'line':
-                self.canvas.create_line(x1, y1, x2, y2, fill=c, width=s)
-                msg = f"LINE,{x1},{y1},{x2},{y2},{c},{s}\n"
+                self.add_op(b"LINE", (x1, y1, x2, y2, c, s))
             elif self.current_tool == 'rect':
-                self.canvas.create_rectangle(x1, y1, x2, y2, outline=c, width=s)
-                msg = f"RECT,{x1},{y1},{x2},{y2},{c},{s}\n"
+                self.add_op(b"RECT", (x1, y1, x2, y2, c, s))
             elif self.current_tool == 'circle':
-                self.canvas.create_oval(x1, y1, x2, y2, outline=c, width=s)
-                msg = f"CIRCLE,{x1},{y1},{x2},{y2},{c},{s}\n"
+                self.add_op(b"CIRCLE", (x1, y1, x2, y2, c, s))
             elif self.current_tool == 'tri':
-                x3 = x1 + (x2 - x1) / 2
-                self.canvas.create_polygon(x1, y2, x2, y2, x3, y1, outline=c, width=s, fill='')
-                msg = f"TRI,{x1},{y2},{x2},{y2},{x3},{y1},{c},{s}\n"
-            if msg:
-                self.send_to_server(msg)
+                x3 = x1 + (x2 - x1) // 2
+                self.add_op(b"TRI", (x1, y2, x2, y2, x3, y1, c, s))
+        self.drag_start_pos = None
 
     def paint_segment(self, x1, y1, x2, y2):
-        """Draws a line locally and notifies server."""
+        """Draws a line locally and buffers the point for the next STROKE message."""
         size = self.size_slider.get()
-        color = self.current_color if self.current_tool == 'brush' else 'white'
-        self.canvas.create_line(x1, y1, x2, y2, fill=color, width=size, capstyle=tk.ROUND, smooth=True)
-        message = f"DRAW,{x1},{y1},{x2},{y2},{color},{size}\n"
-        self.send_to_server(message)
+        color = self.current_color
+        self.stroke_ids.append(self.canvas.create_line(*self.to_screen((x1, y1, x2, y2)), fill=color,
+                                                       width=self.screen_width(size), capstyle=tk.ROUND, smooth=True))
+        if self.stroke_style != (color, size) or not self.stroke_points or self.stroke_points[-1] != (x1, y1):
+            self.flush_stroke()
+            self.stroke_points = [(x1, y1)]
+            self.stroke_new = 1
+            self.stroke_style = (color, size)
+        if (x2, y2) != self.stroke_points[-1]:
+            self.stroke_points.append((x2, y2))
+            self.stroke_new += 1
+        factor = SLOW_FACTOR if time.monotonic() < self.slow_until else 1
+        if len(self.stroke_points) >= STROKE_FLUSH_POINTS * factor:
+            self.flush_stroke()
+        elif self.flush_job is None:
+            self.flush_job = self.root.after(STROKE_FLUSH_MS * factor, self.flush_stroke)
+
+    def flush_stroke(self):
+        """Sends the buffered brush points as one simplified polyline."""
+        if self.flush_job is not None:
+            self.root.after_cancel(self.flush_job)
+            self.flush_job = None
+        if not self.stroke_new:
+            return
+        points = simplify_polyline(self.stroke_points, STROKE_TOLERANCE)
+        color, size = self.stroke_style
+        # The next batch starts where this one ends so the polylines join up
+        self.stroke_points = [self.stroke_points[-1]]
+        self.stroke_new = 0
+
+        coords = [v for point in points for v in point]
+        if len(points) == 1:
+            coords *= 2
+        # Swap the per-motion segments for the single object everyone else draws
+        for item in self.stroke_ids:
+            self.canvas.delete(item)
+        self.stroke_ids = []
+        if len(points) <= 2:
+            self.add_op(b"DRAW", tuple(coords) + (color, size))
+        else:
+            self.add_op(b"STROKE", (color, size, coords))
+
+    def erase_along(self, x1, y1, x2, y2):
+        """Eraser tool: deletes what its square passes over and sends the same ERASE regions."""
+        r = max(2, round(self.size_slider.get() / self.scale))   # half the square, in world px
+        steps = max(1, int(math.hypot(x2 - x1, y2 - y1) // r))
+        for i in range(steps + 1):
+            x = round(x1 + (x2 - x1) * i / steps)
+            y = round(y1 + (y2 - y1) * i / steps)
+            rect = (x - r, y - r, x + r, y + r)
+            if self.erase_region(rect):
+                self.send_op(b"ERASE", rect)
+
+    # --- LOGIC: SCENE & VIEW ---
+    def add_op(self, kind, fields):
+        """A drawing made here: shown at once, then sent."""
+        self.add_object(kind, fields)
+        self.send_op(kind, fields)
+
+    def add_object(self, kind, fields):
+        oid = self.scene.add(kind, fields)
+        # Culling: objects outside the view are only drawn once it moves to them
+        if rects_overlap(self.scene.objects[oid][2], self.viewport()):
+            self.draw_object(oid)
+
+    def erase_region(self, rect):
+        """Applies an ERASE; returns True if anything was removed."""
+        removed, _ = self.scene.erase(rect)
+        if removed:
+            # Pixels cannot be un-drawn: rebuild the view (coalesced per idle)
+            self.request_redraw()
+        return bool(removed)
+
+    def draw_object(self, oid):
+        kind, fields = self.scene.objects[oid][:2]
+        if kind == b'STROKE':
+            c, s, coords = fields
+            if len(coords) == 2:
+                coords = coords * 2
+            self.surface.create_line(*self.to_screen(coords), fill=c, width=self.screen_width(s),
+                                     capstyle=tk.ROUND, joinstyle=tk.ROUND, tags='scene')
+        elif kind == b'TRI':
+            self.surface.create_polygon(*self.to_screen(fields[:6]), outline=fields[6],
+                                        width=self.screen_width(fields[7]), fill='', tags='scene')
+        else:
+            coords, c, s = self.to_screen(fields[:4]), fields[4], self.screen_width(fields[5])
+            if kind == b'DRAW':
+                self.surface.create_line(*coords, fill=c, width=s, capstyle=tk.ROUND, tags='scene')
+            elif kind == b'LINE':
+                self.surface.create_line(*coords, fill=c, width=s, tags='scene')
+            elif kind == b'RECT':
+                self.surface.create_rectangle(*coords, outline=c, width=s, tags='scene')
+            elif kind == b'CIRCLE':
+                self.surface.create_oval(*coords, outline=c, width=s, tags='scene')
+
+    def request_redraw(self):
+        if self.redraw_job is None:
+            self.redraw_job = self.root.after_idle(self.redraw)
+
+    def redraw(self):
+        """Draws the objects inside the viewport again (after a pan, zoom, resize or erase)."""
+        self.redraw_job = None
+        if self.raster:
+            self.raster.clear()
+        else:
+            self.canvas.delete('scene')
+        for oid in self.scene.query(self.viewport()):
+            self.draw_object(oid)
+
+    def viewport(self):
+        """The world rectangle visible on the canvas."""
+        ox, oy = self.offset
+        width, height = max(self.canvas.winfo_width(), 1), max(self.canvas.winfo_height(), 1)
+        return (ox, oy, ox + width / self.scale, oy + height / self.scale)
+
+    def to_world(self, x, y):
+        return (round(x / self.scale + self.offset[0]), round(y / self.scale + self.offset[1]))
+
+    def to_screen(self, coords):
+        ox, oy, k = self.offset[0], self.offset[1], self.scale
+        return [(v - ox) * k if i % 2 == 0 else (v - oy) * k for i, v in enumerate(coords)]
+
+    def screen_width(self, size):
+        return max(1, round(size * self.scale))
+
+    def on_pan_start(self, event):
+        self.pan_start = (event.x, event.y)
+
+    def on_pan(self, event):
+        if self.pan_start:
+            dx, dy = event.x - self.pan_start[0], event.y - self.pan_start[1]
+            self.offset = (self.offset[0] - dx / self.scale, self.offset[1] - dy / self.scale)
+            self.pan_start = (event.x, event.y)
+            self.request_redraw()
+
+    def zoom(self, factor, x, y):
+        """Zooms around the screen point (x, y), which stays over the same world point."""
+        scale = min(MAX_ZOOM, max(MIN_ZOOM, self.scale * factor))
+        wx, wy = x / self.scale + self.offset[0], y / self.scale + self.offset[1]
+        self.scale = scale
+        self.offset = (wx - x / scale, wy - y / scale)
+        self.request_redraw()
 
     # --- LOGIC: HELPERS ---
     def clear_canvas(self):
+        self.erase_all()
+        self.send_op(b"CLEAR", ())
+    def erase_all(self):
+        self.scene.clear()
         self.canvas.delete("all")
-        self.send_to_server("CLEAR\n")
+        if self.raster:
+            self.raster.clear()
+            self.raster.attach()
     def set_color(self, c):
         self.current_color = c
     def select_tool(self, t):
@@ -212,59 +524,170 @@ class WhiteboardApp:
     def send_chat_message(self, e=None):
         txt = self.chat_entry.get()
         if txt:
-            self.send_to_server(f"CHAT,{txt}\n")
+            self.send_op(b"CHAT", ("", txt))
             self.chat_entry.delete(0, tk.END)
             self.display_chat_message("Me", txt)
     def display_chat_message(self, user, text):
         self.chat_listbox.insert(tk.END, f"{user}: {text}")
         self.chat_listbox.yview(tk.END)
+    def send_op(self, kind, fields):
+        """Sends one message in the negotiated wire format."""
+        with self.send_lock:
+            if self.wire == protocol.WIRE_BINARY:
+                self.send_to_server(protocol.encode_frame(kind, fields))
+            elif kind == b"CHAT":
+                self.send_to_server(f"CHAT,{fields[1]}\n")
+            else:
+                self.send_to_server(protocol.format_line(kind, fields))
     def send_to_server(self, msg):
+        if isinstance(msg, str):
+            msg = msg.encode('utf-8')
         try:
-            self.client_socket.send(msg.encode('utf-8'))
+            self.client_socket.sendall(msg)
         except:
             pass
 
     # --- LOGIC: NETWORKING (Background Thread) ---
     def receive_messages(self):
-        """Listens for incoming messages."""
-        buffer = ""
+        """Listens for incoming messages; resumes the session when the connection drops."""
+        framer = Framer(RECV_BUFFER)
+        wire_in = protocol.WIRE_TEXT
         while True:
             try:
-                data = self.client_socket.recv(1024).decode('utf-8')
-                if not data:
+                if not framer.fill(self.client_socket):
+                    raise ConnectionResetError
+                redirect = None
+                while redirect is None:
+                    data = framer.next_message(wire_in)
+                    if data is None:
+                        break
+                    if wire_in == protocol.WIRE_TEXT and data == protocol.PROTO_LINE[:-1]:
+                        # Server accepted binary: confirm, then both directions switch
+                        with self.send_lock:
+                            self.send_to_server(protocol.PROTO_LINE)
+                            self.wire = wire_in = protocol.WIRE_BINARY
+                        continue
+                    try:
+                        if wire_in == protocol.WIRE_BINARY:
+                            messages = protocol.decode_frames(data)  # a ZBLOCK holds many
+                        else:
+                            messages = [protocol.parse_line(data)]
+                    except (ValueError, IndexError, KeyError, struct.error):
+                        continue  # one malformed message is skipped, the connection stays up
+                    for message in messages:
+                        if message[0] == b'REDIRECT':
+                            redirect = message[1]
+                            break
+                        self.accept(message)
+                if redirect:
+                    self.reconnect(*redirect)
+                    framer.clear()
+                    wire_in = protocol.WIRE_TEXT
+            except (OSError, protocol.ProtocolError):
+                # a dropped connection, or a stream we can no longer split into messages
+                if self.closing or not self.resume():
                     break
-                buffer += data
-                while '\n' in buffer:
-                    msg, buffer = buffer.split('\n', 1)
-                    parts = msg.split(',')
-                    cmd = parts[0]
-                    if cmd == 'DRAW':
-                        x1, y1, x2, y2 = map(int, parts[1:5])
-                        c, s = parts[5], int(parts[6])
-                        self.canvas.create_line(x1, y1, x2, y2, fill=c, width=s, capstyle=tk.ROUND)
-                    elif cmd == 'LINE':
-                        self.canvas.create_line(int(parts[1]), int(parts[2]), int(parts[3]), int(parts[4]), fill=parts[5], width=int(parts[6]))
-                    elif cmd == 'RECT':
-                        self.canvas.create_rectangle(int(parts[1]), int(parts[2]), int(parts[3]), int(parts[4]), outline=parts[5], width=int(parts[6]))
-                    elif cmd == 'CIRCLE':
-                        self.canvas.create_oval(int(parts[1]), int(parts[2]), int(parts[3]), int(parts[4]), outline=parts[5], width=int(parts[6]))
-                    elif cmd == 'TRI':
-                        self.canvas.create_polygon(int(parts[1]), int(parts[2]), int(parts[3]), int(parts[4]), int(parts[5]), int(parts[6]), outline=parts[7], width=int(parts[8]), fill='')
-                    elif cmd == 'CLEAR':
-                        self.canvas.delete("all")
-                    elif cmd == 'USER_LIST':
-                        self.update_user_list(parts[1:])
-                    elif cmd == 'CHAT':
-                        if parts[1] != self.username:
-                            self.display_chat_message(parts[1], ','.join(parts[2:]))
+                framer.clear()
+                wire_in = protocol.WIRE_TEXT
             except:
                 break
-        messagebox.showinfo("Error", "Disconnected from server")
+        # Tk may only be touched from the main loop: let drain_inbox() report it
+        self.inbox.append((b'DISCONNECTED', ()))
+
+    def accept(self, message):
+        """Handles one parsed message on the network thread; the rest go to the inbox."""
+        if message[0] == b'SLOW':
+            # Over the server's rate limit: send fewer, bigger strokes for a while
+            self.slow_until = time.monotonic() + max(SLOW_HOLD, message[1][0] / 1000)
+            return
+        if message[0] == b'SEQ':
+            self.last_seq = message[1][0]
+            self.epoch = message[1][1] or self.epoch
+            return
+        if self.last_seq is not None and (message[0] in protocol.DRAWING_KINDS
+                                          or message[0] in (b'ERASE', b'CLEAR')):
+            self.last_seq += 1
+        self.inbox.append(message)
+
+    def resume(self):
+        """Rejoins the same server after a dropped connection; False once every attempt failed."""
+        self.inbox.append((b'STATUS', ("reconnecting...",)))
+        for delay in RECONNECT_DELAYS:
+            time.sleep(delay)
+            if self.closing:
+                return False
+            try:
+                self.reconnect(*self.server_address)
+            except OSError:
+                continue
+            self.inbox.append((b'STATUS', ("",)))
+            return True
+        return False
+
+    def reconnect(self, host, port):
+        """Rejoins the room at host:port ("" / 0 = the same server), after a REDIRECT or a drop.
+
+        With a sequence number the server sends only the missed operations (or CLEAR
+        and the whole room if it cannot); without one we start from an empty canvas.
+        """
+        address = (host or self.server_address[0], port or self.server_address[1])
+        new_socket = connect(address, CONNECT_TIMEOUT, getattr(self.client_socket, 'session', None))
+        if self.last_seq is None:
+            self.inbox.append((b'CLEAR', ()))
+        with self.send_lock:
+            old_socket = self.client_socket
+            self.client_socket = new_socket
+            self.wire = protocol.WIRE_TEXT
+            self.send_to_server(join_message(self.username, self.room_code, self.last_seq, self.epoch))
+        old_socket.close()
+        self.server_address = address
+
+    def drain_inbox(self):
+        """Applies queued network messages on the Tk loop, within a per-frame time budget."""
+        deadline = time.perf_counter() + INBOX_BUDGET_MS / 1000
+        for count in range(1, INBOX_MAX_BATCH + 1):
+            if not self.inbox:
+                break
+            cmd, fields = self.inbox.popleft()
+            if cmd == b'DISCONNECTED':
+                self.on_disconnected()
+                return
+            if cmd == b'STATUS':
+                self.root.title(f"{self.title} - {fields[0]}" if fields[0] else self.title)
+                continue
+            try:
+                self.apply_message(cmd, fields)
+            except Exception as e:  # e.g. a colour Tk does not know: skip it, keep draining
+                print(f"Skipped {cmd.decode('ascii', 'replace')} message: {e!r}", file=sys.stderr)
+            if count % 64 == 0 and time.perf_counter() > deadline:
+                break
+        # Come straight back while a backlog (e.g. history replay) is waiting
+        self.root.after(1 if self.inbox else INBOX_POLL_MS, self.drain_inbox)
+
+    def on_disconnected(self):
+        # Keep the window: the drawing stays visible (and can be looked at) after giving up
         self.client_socket.close()
-        self.root.destroy()
-        sys.exit(0)
-    
-    
+        if self.closing:
+            return
+        self.root.title(f"{self.title} - offline")
+        messagebox.showinfo("Error", "Disconnected from server")
+
+    def apply_message(self, cmd, fields):
+        """Draws or displays one message from the server (either wire format)."""
+        if cmd in protocol.DRAWING_KINDS:
+            # STROKE is a polyline: STROKE,color,size,x1,y1,x2,y2,...
+            if cmd != b'STROKE' or len(fields[2]) >= 2:
+                self.add_object(cmd, fields)
+        elif cmd == b'ERASE':
+            self.erase_region(normalize_rect(*fields))
+        elif cmd == b'CLEAR':
+            self.erase_all()
+        elif cmd == b'USER_LIST':
+            self.update_user_list(fields)
+        elif cmd == b'CHAT':
+            user, text = fields
+            if user != self.username:
+                self.display_chat_message(user, text)
 
     def update_user_list(self, users):
         self.user_listbox.delete(0, tk.END)
@@ -272,14 +695,87 @@ class WhiteboardApp:
             self.user_listbox.insert(tk.END, u)
 
     def on_closing(self):
+        self.closing = True
         self.client_socket.close()
         self.root.destroy()
 
+#TLS context for TLS_CA_FILE, made once so reconnects can reuse its sessions
+tls_context = None
+
+#Opens the connection to the server: TCP_NODELAY (every message is a complete
+#write), and TLS when TLS_CA_FILE is set, offering 'session' for resumption
+def connect(address, timeout=None, session=None):
+    global tls_context
+    sock = socket.create_connection(address, timeout=timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if TLS_CA_FILE:
+        if tls_context is None:
+            tls_context = ssl.create_default_context(cafile=TLS_CA_FILE)
+        sock = tls_context.wrap_socket(sock, server_hostname=address[0], session=session)
+    sock.settimeout(None)
+    return sock
+
+#Servers on the LAN answering a DISCOVER broadcast: [(host, port, rooms, users, tls)]
+def discover_servers(port=SERVER_PORT, timeout=DISCOVERY_TIMEOUT):
+    found = []
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.sendto(protocol.DISCOVER_QUERY, ('<broadcast>', port))
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            sock.settimeout(deadline - time.monotonic())
+            data, address = sock.recvfrom(256)
+            try:
+                kind, fields = protocol.parse_line(data.rstrip(b"\n"))
+            except (ValueError, UnicodeDecodeError):
+                continue
+            if kind == b'SERVER' and len(fields) == 4:
+                found.append((address[0],) + fields)
+    except (OSError, ValueError):   # timeout, or no network to broadcast on
+        pass
+    finally:
+        sock.close()
+    return found
+
+#Sends a lobby request (LIST_ROOMS / NEW_ROOM) before JOIN; returns the parsed answer or None
+def lobby(sock, request):
+    data = b""
+    sock.settimeout(CONNECT_TIMEOUT)
+    try:
+        sock.sendall(request)
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(4096)
+            if not chunk:
+                return None     # older server or cluster front: JOIN only
+            data += chunk
+        return protocol.parse_line(data.rstrip(b"\n"))
+    except (OSError, ValueError, IndexError):
+        return None
+    finally:
+        sock.settimeout(None)
+
+#JOIN line, with the binary protocol offer when enabled and the resume point when known
+def join_message(username, room_code, since=None, epoch=None):
+    options = [protocol.BINARY_VERSION] if USE_BINARY else []
+    if USE_BINARY and USE_COMPRESSION:
+        options.append(protocol.COMPRESS_VERSION)
+    options += [protocol.STROKE_OPTION, protocol.SEQ_OPTION, protocol.SLOW_OPTION]
+    if since is not None:
+        options += [f"since={since}", f"epoch={epoch or ''}"]
+    return f"JOIN,{username},{room_code}{''.join(',' + o for o in options)}\n".encode('utf-8')
+
 def main():
     root = tk.Tk()
     root.withdraw()
-    input_ip = simpledialog.askstring("IP Adress", "Enter Host IP ", parent=root)
-    
+    servers = discover_servers()
+    prompt = "Enter Host IP "
+    if servers:
+        prompt += "\n\nFound on the LAN:\n" + "\n".join(
+            f"{host}  ({rooms} rooms, {users} users{', TLS' if tls else ''})" for host, _, rooms, users, tls in servers)
+    input_ip = simpledialog.askstring("IP Adress", prompt, parent=root,
+                                      initialvalue=servers[0][0] if servers else None)
+
     if input_ip:
         SERVER_HOST = input_ip
     else:
@@ -290,19 +786,34 @@ def main():
     if not username:
         return
     try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((SERVER_HOST, SERVER_PORT))
+        s = connect((SERVER_HOST, SERVER_PORT))
         # Ask user to create or join a room
         create = messagebox.askyesno("Room", "Create a new room? (Yes = Create, No = Join)")
         if create:
-            room_code = str(random.randint(1000, 9999))
+            # The server hands out a code no other room uses
+            reply = lobby(s, protocol.NEW_ROOM_LINE)
+            if reply and reply[0] == b'ROOM' and reply[1][0]:
+                room_code = reply[1][0]
+            else:
+                s.close()
+                s = connect((SERVER_HOST, SERVER_PORT))
+                room_code = str(random.randint(1000, 9999))
             messagebox.showinfo("Room Created", f"Room code: {room_code}")
         else:
-            room_code = simpledialog.askstring("Join", "Enter Room Code:")
+            prompt = "Enter Room Code:"
+            reply = lobby(s, protocol.LIST_ROOMS_LINE)
+            if reply and reply[0] == b'ROOMS':
+                if reply[1]:
+                    prompt += "\n\nOpen rooms:\n" + "\n".join(
+                        f"{code}  ({users} users)" for code, users, _, _ in reply[1][:LOBBY_ROOMS_SHOWN])
+            else:
+                s.close()
+                s = connect((SERVER_HOST, SERVER_PORT))
+            room_code = simpledialog.askstring("Join", prompt)
             if not room_code:
                 return
-        # Send JOIN with room code
-        s.send(f"JOIN,{username},{room_code}\n".encode('utf-8'))
+        # Send JOIN with room code (and the binary protocol offer)
+        s.send(join_message(username, room_code))
         root.deiconify()
         WhiteboardApp(root, s, username, room_code)
         root.mainloop()
@@ -313,4 +824,6 @@ def main():
 
 
 if __name__ == "__main__":
+    if "--tls" in sys.argv[:-1]:
+        TLS_CA_FILE = sys.argv[sys.argv.index("--tls") + 1]
     main()
@@ -0,0 +1,485 @@
+# CLUSTER (whiteboard_cluster.py)
+# -----------------------------------------------------------------------------
+# DESCRIPTION:
+# Runs the server on every core (and optionally on several machines) by sharding
+# rooms. Rooms never share state, so each one lives in exactly one process.
+#
+#   front    - accepts TCP connections, reads the JOIN line and picks the owner of
+#              the room on a consistent-hash ring. Local owners receive the socket
+#              itself (fd passing over a Unix socket); rooms owned by another
+#              machine get "REDIRECT,host,port" and the client reconnects there.
+#   workers  - ordinary async servers (whiteboard_async.AsyncClient), one per
+#              process, fed with sockets by the front instead of accept().
+#   broker   - the Unix control socket between front and workers. It carries
+#              client hand-offs and room moves: the old owner sends the room's
+#              snapshot through the front to the new owner and redirects its
+#              clients, which rejoin through the front and land on the new owner.
+#
+# Multi-machine: start a front on each machine with the same --peers list (every
+# front, this one included, as host:port) so all of them agree on the ring.
+#
+# Usage:
+#   python whiteboard_cluster.py serve --workers 4
+#   python whiteboard_cluster.py where 1234
+#   python whiteboard_cluster.py move 1234 worker-2
+# -----------------------------------------------------------------------------
+import os
+import json
+import time
+import bisect
+import socket
+import struct
+import asyncio
+import hashlib
+import argparse
+import selectors
+import tempfile
+import threading
+import collections
+import multiprocessing
+
+import whiteboard_metrics as metrics
+import whiteboard_server as server
+import whiteboard_async as async_core
+from whiteboard_history import RoomHistory
+from whiteboard_journal import Journal
+from whiteboard_protocol import Packet, WIRE_TEXT, format_line
+
+WORKERS = os.cpu_count() or 1
+VNODES = 64                 # ring points per node, so rooms spread evenly
+HANDSHAKE_TIMEOUT = 10      # seconds the front waits for a JOIN line
+CHANNEL_CHUNK = 256 * 1024  # bytes read from the control socket at a time
+MAX_FDS = 64                # sockets accepted per control read
+HEADER = struct.Struct('!I')
+
+
+# --- consistent hashing ---
+def ring_hash(key):
+    # Stable across processes and machines (unlike hash())
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent-hash ring: adding or removing a node only moves its share of rooms."""
+
+    def __init__(self, nodes, vnodes=VNODES):
+        points = sorted((ring_hash(f"{node}#{i}"), node) for node in nodes for i in range(vnodes))
+        self.keys = [h for h, _ in points]
+        self.nodes = [node for _, node in points]
+
+    def lookup(self, key):
+        index = bisect.bisect(self.keys, ring_hash(key)) % len(self.keys)
+        return self.nodes[index]
+
+
+# --- control channel: length-prefixed JSON header followed by a payload ---
+def pack_message(header, payload=b""):
+    raw = json.dumps(dict(header, size=len(payload))).encode('utf-8')
+    return HEADER.pack(len(raw)) + raw + payload
+
+#Sends one control message; 'fds' travel with its first byte
+def send_message(channel, header, payload=b"", fds=()):
+    data = pack_message(header, payload)
+    sent = socket.send_fds(channel, [data], list(fds)) if fds else 0
+    channel.sendall(data[sent:])
+
+
+class MessageReader:
+    """Splits the control stream back into (header, payload) messages."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        while len(self.buffer) >= HEADER.size:
+            (length,) = HEADER.unpack_from(self.buffer)
+            if len(self.buffer) < HEADER.size + length:
+                break
+            header = json.loads(bytes(self.buffer[HEADER.size:HEADER.size + length]))
+            start = HEADER.size + length
+            end = start + header["size"]
+            if len(self.buffer) < end:
+                break
+            messages.append((header, bytes(self.buffer[start:end])))
+            del self.buffer[:end]
+        return messages
+
+#Reads from a blocking socket until one whole message is there
+def read_message(channel):
+    reader = MessageReader()
+    while True:
+        data = channel.recv(CHANNEL_CHUNK)
+        if not data:
+            raise ConnectionError("control channel closed")
+        messages = reader.feed(data)
+        if messages:
+            return messages[0]
+
+
+class Front:
+    """Acceptor and broker: routes each connection to the process that owns its room."""
+
+    def __init__(self, workers=WORKERS, node=None, peers=()):
+        self.names = [f"worker-{i}" for i in range(workers)]
+        self.ring = HashRing(self.names)
+        self.node = node
+        self.nodes = HashRing(peers) if peers else None
+        self.channels = {}      # worker name -> control socket
+        self.pending = {}       # client socket -> [accept time, bytes read so far]
+        self.moves = {}         # room_code -> worker, for rooms moved off their ring owner
+        self.moving = {}        # room_code -> [(socket, data)] held while the room is in transit
+        self.selector = selectors.DefaultSelector()
+
+    def owner(self, room_code):
+        return self.moves.get(room_code) or self.ring.lookup(room_code)
+
+    # --- startup ---
+    def serve(self, host, port, admin_path, journal_dir=None, keep_empty=0, metrics_port=None):
+        control_dir = tempfile.mkdtemp(prefix="whiteboard-")
+        control_path = os.path.join(control_dir, "control.sock")
+        control = unix_listener(control_path)
+        context = multiprocessing.get_context('spawn')
+        for index, name in enumerate(self.names):
+            worker_metrics = metrics_port + index if metrics_port else None
+            context.Process(target=run_worker, daemon=True,
+                            args=(name, control_path, self.names, journal_dir, keep_empty, worker_metrics,
+                                  server.BROADCAST_TICK,
+                                  (server.CLIENT_MESSAGE_RATE, server.ROOM_MESSAGE_RATE))).start()
+        # Clients are only accepted once every worker is connected
+        while len(self.channels) < len(self.names):
+            channel, _ = control.accept()
+            header, _ = read_message(channel)
+            self.channels[header["name"]] = channel
+            self.selector.register(channel, selectors.EVENT_READ, (self.read_worker, header["name"], MessageReader()))
+        control.close()
+        os.remove(control_path)
+        os.rmdir(control_dir)
+
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, port))
+        listener.listen(server.BACKLOG)
+        listener.setblocking(False)
+        self.selector.register(listener, selectors.EVENT_READ, (self.accept_client,))
+        admin = unix_listener(admin_path)
+        admin.setblocking(False)
+        self.selector.register(admin, selectors.EVENT_READ, (self.accept_admin,))
+        server.log(f"Cluster front on {host}:{port} with {len(self.names)} workers (admin: {admin_path})")
+        try:
+            self.run()
+        finally:
+            admin.close()
+            os.remove(admin_path)
+
+    def run(self):
+        while True:
+            for key, _ in self.selector.select(timeout=1):
+                handler, *args = key.data
+                handler(key.fileobj, *args)
+            self.expire_handshakes()
+
+    # --- clients ---
+    def accept_client(self, listener):
+        while True:
+            try:
+                sock, _ = listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:  # e.g. out of file descriptors: try again on the next event
+                server.log(f"ERROR: {e}")
+                return
+            sock.setblocking(False)
+            self.pending[sock] = [time.monotonic(), bytearray()]
+            self.selector.register(sock, selectors.EVENT_READ, (self.read_client,))
+
+    def read_client(self, sock):
+        try:
+            data = sock.recv(server.MAX_HANDSHAKE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        buffer = self.pending[sock][1]
+        buffer += data
+        end = buffer.find(b'\n')
+        if end < 0:
+            if not data or len(buffer) > server.MAX_HANDSHAKE:
+                self.drop_pending(sock)
+            return
+        self.selector.unregister(sock)
+        del self.pending[sock]
+        self.route(sock, bytes(buffer), server.parse_join(bytes(buffer[:end])))
+
+    def drop_pending(self, sock):
+        self.selector.unregister(sock)
+        del self.pending[sock]
+        sock.close()
+
+    def expire_handshakes(self):
+        deadline = time.monotonic() - HANDSHAKE_TIMEOUT
+        for sock in [sock for sock, (since, _) in self.pending.items() if since < deadline]:
+            self.drop_pending(sock)
+
+    #Sends a client to the machine, or local worker, that owns its room
+    def route(self, sock, data, parts):
+        if parts is None:
+            server.log("Handshake failed")
+            sock.close()
+            return
+        room_code = parts[1]
+        node = self.nodes.lookup(room_code) if self.nodes else self.node
+        if node != self.node:
+            host, _, port = node.rpartition(':')
+            self.redirect(sock, host, int(port))
+        elif room_code in self.moving:
+            self.moving[room_code].append((sock, data))
+        else:
+            self.hand_off(self.owner(room_code), sock, data)
+
+    def hand_off(self, worker, sock, data):
+        try:
+            send_message(self.channels[worker], {"op": "client"}, data, [sock.fileno()])
+        except OSError as e:
+            server.log(f"ERROR: hand-off to {worker} failed: {e}")
+        finally:
+            sock.close()    # the worker holds its own copy now
+
+    def redirect(self, sock, host, port):
+        try:
+            sock.setblocking(True)
+            sock.settimeout(1)
+            sock.sendall(format_line(b"REDIRECT", (host, port)))
+        except OSError:
+            pass
+        finally:
+            sock.close()
+
+    # --- room moves ---
+    def start_move(self, room_code, target):
+        if target not in self.channels:
+            return f"ERROR unknown worker {target}"
+        if room_code in self.moving:
+            return "ERROR room is already moving"
+        source = self.owner(room_code)
+        if source == target:
+            return "OK"
+        # New joiners wait here until the snapshot has reached the target
+        self.moving[room_code] = []
+        send_message(self.channels[source], {"op": "move", "room": room_code, "to": target})
+        return "OK"
+
+    def finish_move(self, room_code, target, state):
+        if target == self.ring.lookup(room_code):
+            self.moves.pop(room_code, None)
+        else:
+            self.moves[room_code] = target
+        send_message(self.channels[target], {"op": "adopt", "room": room_code}, state)
+        for sock, data in self.moving.pop(room_code, ()):
+            self.hand_off(target, sock, data)
+        server.log(f"Room {room_code} moved to {target}.")
+
+    def read_worker(self, channel, name, reader):
+        try:
+            data = channel.recv(CHANNEL_CHUNK)
+        except OSError:
+            data = b""
+        if not data:
+            server.log(f"ERROR: {name} exited")
+            self.selector.unregister(channel)
+            return
+        for header, payload in reader.feed(data):
+            if header["op"] == "state":
+                self.finish_move(header["room"], header["to"], payload)
+
+    # --- admin socket: one command line per connection ---
+    def accept_admin(self, admin):
+        try:
+            conn, _ = admin.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        with conn:
+            conn.settimeout(1)
+            try:
+                words = conn.recv(1024).decode('utf-8').split()
+                conn.sendall((self.admin_command(words) + "\n").encode('utf-8'))
+            except (OSError, UnicodeDecodeError):
+                pass
+
+    def admin_command(self, words):
+        if len(words) == 2 and words[0] == "WHERE":
+            return self.owner(words[1])
+        if len(words) == 3 and words[0] == "MOVE":
+            return self.start_move(words[1], words[2])
+        if words == ["WORKERS"]:
+            return " ".join(self.names)
+        return "ERROR expected WHERE <room>, MOVE <room> <worker> or WORKERS"
+
+
+def unix_listener(path):
+    if os.path.exists(path):
+        os.remove(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(server.BACKLOG)
+    return sock
+
+
+class Worker:
+    """One shard: the async server core, fed with sockets over the control channel."""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.ring = HashRing(workers)
+        self.loop = None
+        self.channel = None
+        self.done = None
+
+    async def serve(self, control_path, journal_dir=None):
+        self.loop = asyncio.get_running_loop()
+        self.done = self.loop.create_future()
+        if server.BROADCAST_TICK > 0:
+            server.start_scheduler(self.loop)
+        self.channel = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.channel.connect(control_path)
+        send_message(self.channel, {"op": "hello", "name": self.name})
+        self.restore_rooms(journal_dir)
+        threading.Thread(target=self.read_channel, daemon=True).start()
+        await self.done
+
+    #Like server.restore_rooms(), but only for the rooms this worker owns
+    def restore_rooms(self, journal_dir):
+        if server.EMPTY_ROOM_TTL > 0:
+            threading.Thread(target=server.reap_empty_rooms, daemon=True).start()
+        if not journal_dir:
+            return
+        server.journal = Journal(journal_dir)
+        for room_code, history in server.journal.recover(lambda code: self.ring.lookup(code) == self.name).items():
+            server.rooms.add(room_code, history).empty_since = time.monotonic()
+            server.log(f"{self.name}: restored room {room_code} ({len(history)} drawings).")
+
+    #Control thread: hands every message to the event loop, in order
+    def read_channel(self):
+        reader = MessageReader()
+        fds = collections.deque()
+        while True:
+            try:
+                data, received, _, _ = socket.recv_fds(self.channel, CHANNEL_CHUNK, MAX_FDS)
+            except OSError:
+                data = b""
+            if not data:
+                break
+            fds.extend(received)
+            for header, payload in reader.feed(data):
+                op = header["op"]
+                if op == "client":
+                    self.loop.call_soon_threadsafe(self.adopt_client, fds.popleft(), payload)
+                elif op == "move":
+                    self.loop.call_soon_threadsafe(self.export_room, header["room"], header["to"])
+                elif op == "adopt":
+                    self.loop.call_soon_threadsafe(self.adopt_room, header["room"], payload)
+        # The front is gone: so is the cluster
+        self.loop.call_soon_threadsafe(self.done.set_result, None)
+
+    def adopt_client(self, fd, data):
+        self.loop.create_task(self.attach(socket.socket(fileno=fd), data))
+
+    async def attach(self, sock, data):
+        try:
+            _, client = await self.loop.connect_accepted_socket(async_core.AsyncClient, sock)
+        except OSError:
+            sock.close()
+            return
+        # The front already read the JOIN line (and maybe more): replay it
+        client.data_received(data)
+
+    #Hands a room to another worker: snapshot to the front, REDIRECT to the clients
+    def export_room(self, room_code, target):
+        state, members = b"", ()
+        room = server.rooms.get(room_code)
+        if room:
+            with room.lock:
+                state = room.history.replay(WIRE_TEXT)
+                members = room.members
+                server.delete_room(room)
+        redirect = Packet(text=format_line(b"REDIRECT", ("", 0)))
+        for client in members:
+            client.send(redirect, bulk=True)
+            client.close()
+        send_message(self.channel, {"op": "state", "room": room_code, "to": target}, state)
+        server.log(f"{self.name}: room {room_code} handed to {target} ({len(members)} clients redirected).")
+
+    def adopt_room(self, room_code, state):
+        history = RoomHistory()
+        history.restore(state.splitlines(keepends=True))
+        room = server.rooms.add(room_code, history)
+        room.empty_since = time.monotonic()
+        if server.journal and state:
+            server.journal.checkpoint(room_code, state)
+
+
+def run_worker(name, control_path, workers, journal_dir=None, keep_empty=0, metrics_port=None, tick=0, rates=None):
+    server.SERVER_MODE = 'async'
+    server.EMPTY_ROOM_TTL = keep_empty
+    server.BROADCAST_TICK = tick
+    if rates:
+        server.CLIENT_MESSAGE_RATE, server.ROOM_MESSAGE_RATE = rates
+    server.start_logging()
+    if metrics_port:
+        metrics.serve_metrics(metrics_port)
+    server.raise_fd_limit()
+    asyncio.run(Worker(name, workers).serve(control_path, journal_dir))
+
+#Sends one admin command to a running front and returns its answer
+def admin_request(admin_path, command):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(5)
+        sock.connect(admin_path)
+        sock.sendall((command + "\n").encode('utf-8'))
+        return sock.recv(1024).decode('utf-8').strip()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sharded whiteboard server")
+    parser.add_argument("--admin", help="admin socket (default: a file in the temp dir named after the port)")
+    parser.add_argument("--port", type=int, default=server.PORT)
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run the front and its workers")
+    serve.add_argument("--host", default=server.HOST)
+    serve.add_argument("--workers", type=int, default=WORKERS)
+    serve.add_argument("--node", help="this front as host:port, as listed in --peers")
+    serve.add_argument("--peers", default="", help="comma separated host:port of every front")
+    serve.add_argument("--journal", default=server.JOURNAL_DIR)
+    serve.add_argument("--keep-empty", type=float, default=server.EMPTY_ROOM_TTL)
+    serve.add_argument("--metrics", type=int, help="first metrics port; worker i serves on port + i")
+    serve.add_argument("--tick", type=float, default=0, help="broadcast tick in ms (0 = send at once)")
+    serve.add_argument("--backlog", type=int, default=server.BACKLOG, help="listen() backlog")
+    serve.add_argument("--client-rate", type=float, default=server.CLIENT_MESSAGE_RATE, help="messages/s per client, 0 = off")
+    serve.add_argument("--room-rate", type=float, default=server.ROOM_MESSAGE_RATE, help="messages/s per room, 0 = off")
+    where = commands.add_parser("where", help="show the worker owning a room")
+    where.add_argument("room")
+    move = commands.add_parser("move", help="move a room to another worker")
+    move.add_argument("room")
+    move.add_argument("worker")
+    args = parser.parse_args(argv)
+    admin_path = args.admin or os.path.join(tempfile.gettempdir(), f"whiteboard-{args.port}.sock")
+
+    if args.command == "where":
+        print(admin_request(admin_path, f"WHERE {args.room}"))
+    elif args.command == "move":
+        print(admin_request(admin_path, f"MOVE {args.room} {args.worker}"))
+    else:
+        peers = [peer for peer in args.peers.split(',') if peer]
+        if peers and args.node not in peers:
+            parser.error("--node must be one of --peers")
+        server.start_logging()
+        server.BROADCAST_TICK = args.tick / 1000
+        server.BACKLOG = args.backlog
+        server.CLIENT_MESSAGE_RATE, server.ROOM_MESSAGE_RATE = args.client_rate, args.room_rate
+        front = Front(args.workers, args.node, peers)
+        front.serve(args.host, args.port, admin_path, args.journal, args.keep_empty, args.metrics)
+
+
+if __name__ == "__main__":
+    main()
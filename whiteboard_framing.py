@@ -0,0 +1,99 @@
+# FRAMING (whiteboard_framing.py)
+# -----------------------------------------------------------------------------
+# DESCRIPTION:
+# Receive buffer and message splitter shared by the server and the client.
+#
+# Data is read with recv_into() straight into a preallocated bytearray; complete
+# messages are handed out as memoryview slices of it, so nothing is copied or
+# re-concatenated per message. The buffer is a sliding window: consumed bytes
+# are skipped by moving 'start', and only the unfinished tail is moved back to
+# the front when the free space runs out. It grows (doubling) only for a message
+# bigger than itself, up to MAX_FRAME, and shrinks back once drained.
+#
+# Slices stay valid until the next fill()/writable() call: keep bytes(slice)
+# if a message must outlive that.
+# -----------------------------------------------------------------------------
+from whiteboard_protocol import WIRE_BINARY, MAX_FRAME, ProtocolError, frame_end
+
+READ_SIZE = 64 * 1024       # default buffer size (and so the largest single read)
+MIN_READ = 4096             # free space guaranteed before every read
+
+
+class Framer:
+    """Per-connection receive buffer that splits text lines or binary frames."""
+
+    def __init__(self, size=READ_SIZE, limit=MAX_FRAME):
+        self.size = size
+        self.limit = limit          # longest message accepted
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def pending(self):
+        return self.end - self.start
+
+    def clear(self):
+        self.start = self.end = 0
+
+    def writable(self, needed=MIN_READ):
+        """Free space at the end of the buffer (at least 'needed' bytes), for recv_into()."""
+        if self.start == self.end:
+            self.start = self.end = 0
+            if len(self.buffer) > 4 * self.size:
+                self.resize(self.size)   # a large message has passed: give the memory back
+        if len(self.buffer) - self.end < needed:
+            pending = self.end - self.start
+            if pending + needed > len(self.buffer):
+                self.resize(max(2 * len(self.buffer), pending + needed))
+            else:
+                self.view[:pending] = self.view[self.start:self.end]
+                self.start, self.end = 0, pending
+        return self.view[self.end:]
+
+    def resize(self, size):
+        pending = self.end - self.start
+        buffer = bytearray(size)
+        buffer[:pending] = self.view[self.start:self.end]
+        self.buffer, self.view = buffer, memoryview(buffer)
+        self.start, self.end = 0, pending
+
+    def commit(self, nbytes):
+        """Marks 'nbytes' written into writable() as received."""
+        self.end += nbytes
+
+    def fill(self, sock):
+        """One recv_into() from 'sock'; returns the byte count (0 = connection closed)."""
+        nbytes = sock.recv_into(self.writable())
+        self.end += nbytes
+        return nbytes
+
+    def feed(self, data):
+        """Appends bytes that were received elsewhere."""
+        self.writable(len(data))[:len(data)] = data
+        self.end += len(data)
+
+    def next_line(self):
+        """The next text line without its newline, or None until one is complete."""
+        index = self.buffer.find(b'\n', self.start, self.end)
+        if index < 0:
+            if self.end - self.start > self.limit:
+                raise ProtocolError("line too long")
+            return None
+        if index - self.start > self.limit:
+            raise ProtocolError("line too long")   # arrived complete, in one read
+        line = self.view[self.start:index]
+        self.start = index + 1
+        return line
+
+    def next_frame(self):
+        """The next binary frame (length prefix included), or None until one is complete."""
+        end = frame_end(self.view[:self.end], self.start, self.limit)
+        if end is None:
+            return None
+        frame = self.view[self.start:end]
+        self.start = end
+        return frame
+
+    def next_message(self, wire):
+        return self.next_frame() if wire == WIRE_BINARY else self.next_line()
@@ -0,0 +1,365 @@
+# ROOM HISTORY (whiteboard_history.py)
+# -----------------------------------------------------------------------------
+# DESCRIPTION:
+# Keeps the drawing history of a room as a compacted snapshot plus a short tail of
+# recent messages, so late joiners receive the canvas in one bulk write instead of
+# one send() per brush segment.
+#
+# Compaction (every COMPACT_EVERY messages):
+#   - consecutive DRAW segments with the same colour/size are merged into one
+#     STROKE polyline: STROKE,color,size,x1,y1,x2,y2,... (clients that did not
+#     offer STROKE support get it back as DRAW segments, the "legacy" wire), of at
+#     most MAX_STROKE_POINTS points
+#   - strokes that later eraser strokes cover completely are dropped
+#   - a CLEAR throws away everything before it
+#   - an ERASE cuts the drawings before it (whiteboard_scene.erase_op) and is dropped
+#
+# The tail holds Packets as received (text or binary); snapshots are encoded once
+# per wire format (and compressed once for "zlib1" clients) and reused for every joiner.
+# nbytes() is the size of the history as sent (text snapshot plus the tail as
+# received); the server caps rooms by it.
+# -----------------------------------------------------------------------------
+import math
+
+from whiteboard_protocol import (WIRE_TEXT, WIRE_BINARY, WIRE_LEGACY, DRAWING_KINDS, compress_frames, convert,
+                                 encode_frame, parse_line, text_to_frame, text_to_legacy)
+from whiteboard_scene import erase_op, normalize_rect
+
+COMPACT_EVERY = 512     # messages in the tail before a new snapshot is taken
+ERASER_COLOR = 'white'  # older clients erase by painting with the canvas colour
+GRID_CELL = 64          # cell size (px) of the eraser lookup grid
+MAX_SEGMENT_CELLS = 64  # eraser segments covering more grid cells go in one list checked for every point
+MAX_STROKE_POINTS = 1024    # a merged polyline is split after this many points
+
+
+class Stroke:
+    """A freehand polyline: the merged form of consecutive DRAW segments."""
+
+    __slots__ = ("color", "size", "points", "text", "frame", "segments", "box")
+
+    def __init__(self, color, size, points):
+        self.color = color
+        self.size = size
+        self.points = points
+        self.text = None
+        self.frame = None
+        self.segments = None
+        self.box = None
+
+    def extend(self, points):
+        self.points.extend(points)
+        self.text = self.frame = self.segments = self.box = None
+
+    def encode(self, wire=WIRE_TEXT):
+        if wire == WIRE_BINARY:
+            if self.frame is None:
+                self.frame = encode_frame(*self.fields())
+            return self.frame
+        if wire == WIRE_LEGACY:
+            # clients without STROKE support get the polyline as DRAW segments
+            if self.segments is None:
+                points = self.points if len(self.points) > 1 else self.points * 2
+                self.segments = b"".join(f"DRAW,{x1},{y1},{x2},{y2},{self.color},{self.size}\n".encode('utf-8')
+                                         for (x1, y1), (x2, y2) in zip(points, points[1:]))
+            return self.segments
+        if self.text is None:
+            if len(self.points) <= 2:
+                (x1, y1), (x2, y2) = self.points[0], self.points[-1]
+                self.text = f"DRAW,{x1},{y1},{x2},{y2},{self.color},{self.size}\n".encode('utf-8')
+            else:
+                coords = ",".join(f"{x},{y}" for x, y in self.points)
+                self.text = f"STROKE,{self.color},{self.size},{coords}\n".encode('utf-8')
+        return self.text
+
+    def fields(self):
+        """(kind, fields) as used by whiteboard_protocol."""
+        if len(self.points) <= 2:
+            (x1, y1), (x2, y2) = self.points[0], self.points[-1]
+            return b"DRAW", (x1, y1, x2, y2, self.color, self.size)
+        return b"STROKE", (self.color, self.size, [v for point in self.points for v in point])
+
+    def bbox(self):
+        """Bounding box including the pen radius."""
+        if self.box is None:
+            r = self.size / 2
+            xs = [x for x, _ in self.points]
+            ys = [y for _, y in self.points]
+            self.box = (min(xs) - r, min(ys) - r, max(xs) + r, max(ys) + r)
+        return self.box
+
+
+def boxes_overlap(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+#Parses DRAW and STROKE lines into Strokes; anything else stays an encoded line
+def parse_entry(entry):
+    parts = entry.rstrip(b'\n').split(b',')
+    try:
+        if parts[0] == b"DRAW" and len(parts) == 7:
+            x1, y1, x2, y2 = map(int, parts[1:5])
+            points = [(x1, y1)] if (x1, y1) == (x2, y2) else [(x1, y1), (x2, y2)]
+            return Stroke(parts[5].decode('utf-8'), int(parts[6]), points)
+        if parts[0] == b"STROKE" and len(parts) >= 5 and len(parts) % 2 == 1:
+            coords = list(map(int, parts[3:]))
+            points = list(zip(coords[0::2], coords[1::2]))
+            return Stroke(parts[1].decode('utf-8'), int(parts[2]), points)
+    except (ValueError, UnicodeDecodeError):
+        pass
+    return entry
+
+
+#Merges consecutive brush segments into polylines
+def merge_strokes(ops, entries):
+    for entry in entries:
+        if not entry:
+            continue
+        op = parse_entry(entry)
+        last = ops[-1] if ops else None
+        if (isinstance(op, Stroke) and isinstance(last, Stroke)
+                and (op.color, op.size) == (last.color, last.size)
+                and last.points[-1] == op.points[0]
+                and len(last.points) + len(op.points) - 1 <= MAX_STROKE_POINTS):
+            last.extend(op.points[1:])
+            continue
+        ops.append(op)
+    return ops
+
+
+def segment_distance(px, py, x1, y1, x2, y2):
+    dx, dy = x2 - x1, y2 - y1
+    length_sq = dx * dx + dy * dy
+    if length_sq == 0:
+        return math.hypot(px - x1, py - y1)
+    t = max(0.0, min(1.0, ((px - x1) * dx + (py - y1) * dy) / length_sq))
+    return math.hypot(px - (x1 + t * dx), py - (y1 + t * dy))
+
+
+#Ramer-Douglas-Peucker: drops points while staying within 'tolerance' px of the original line
+def simplify_polyline(points, tolerance):
+    if len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = points[first], points[last]
+        worst, index = tolerance, None
+        for i in range(first + 1, last):
+            d = segment_distance(points[i][0], points[i][1], x1, y1, x2, y2)
+            if d > worst:
+                worst, index = d, i
+        if index is not None:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for p, k in zip(points, keep) if k]
+
+
+class EraserGrid:
+    """Uniform grid over eraser segments for "is this point erased?" queries."""
+
+    def __init__(self):
+        self.cells = {}
+        self.large = []     # segments spanning more than MAX_SEGMENT_CELLS cells
+        self.max_size = 0
+
+    def add(self, stroke):
+        radius = stroke.size / 2
+        self.max_size = max(self.max_size, stroke.size)
+        points = stroke.points if len(stroke.points) > 1 else stroke.points * 2
+        for (x1, y1), (x2, y2) in zip(points, points[1:]):
+            segment = (x1, y1, x2, y2, radius)
+            xs = range(int((min(x1, x2) - radius) // GRID_CELL), int((max(x1, x2) + radius) // GRID_CELL) + 1)
+            ys = range(int((min(y1, y2) - radius) // GRID_CELL), int((max(y1, y2) + radius) // GRID_CELL) + 1)
+            # A long diagonal would fill a square of cells: keep it out of the grid instead
+            if len(xs) * len(ys) > MAX_SEGMENT_CELLS:
+                self.large.append(segment)
+                continue
+            for cx in xs:
+                for cy in ys:
+                    self.cells.setdefault((cx, cy), []).append(segment)
+
+    def covering_segment(self, x, y, radius, hint):
+        # 0.5 px slack: samples along the stroke are 1 px apart
+        if hint and segment_distance(x, y, *hint[:4]) + radius + 0.5 <= hint[4]:
+            return hint
+        for segments in (self.cells.get((int(x // GRID_CELL), int(y // GRID_CELL)), ()), self.large):
+            for segment in segments:
+                if segment_distance(x, y, *segment[:4]) + radius + 0.5 <= segment[4]:
+                    return segment
+        return None
+
+    def covers(self, stroke):
+        if stroke.size >= self.max_size:
+            return False
+        radius = stroke.size / 2
+        hint = None  # neighbouring samples are usually under the same eraser segment
+        points = stroke.points if len(stroke.points) > 1 else stroke.points * 2
+        for (x1, y1), (x2, y2) in zip(points, points[1:]):
+            steps = max(1, int(math.hypot(x2 - x1, y2 - y1)))
+            for i in range(steps + 1):
+                t = i / steps
+                hint = self.covering_segment(x1 + (x2 - x1) * t, y1 + (y2 - y1) * t, radius, hint)
+                if hint is None:
+                    return False
+        return True
+
+
+#Drops strokes that are completely painted over by erasers drawn after them.
+#Only strokes inside 'region' (the area touched by new erasers) can have changed.
+def drop_erased(ops, region):
+    grid = EraserGrid()
+    kept = []
+    for op in reversed(ops):
+        if isinstance(op, Stroke) and boxes_overlap(op.bbox(), region):
+            if op.color == ERASER_COLOR:
+                grid.add(op)
+            elif (grid.cells or grid.large) and grid.covers(op):
+                continue
+        kept.append(op)
+    kept.reverse()
+    return kept
+
+
+#Bounding box of all eraser strokes in a list of ops, or None
+def eraser_region(ops):
+    boxes = [op.bbox() for op in ops if isinstance(op, Stroke) and op.color == ERASER_COLOR]
+    if not boxes:
+        return None
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+#Cuts what an ERASE of 'rect' removes out of a list of ops
+def erase_ops(ops, rect):
+    kept = []
+    for op in ops:
+        if isinstance(op, Stroke):
+            if not boxes_overlap(op.bbox(), rect):
+                kept.append(op)
+                continue
+            kind, fields = op.fields()
+        else:
+            try:
+                kind, fields = parse_line(op.rstrip(b'\n'))
+            except (ValueError, IndexError):
+                kind = None
+            if kind not in DRAWING_KINDS:
+                kept.append(op)
+                continue
+        pieces = erase_op(kind, fields, rect)
+        if pieces is None:
+            kept.append(op)
+            continue
+        for _, (color, size, coords) in pieces:
+            kept.append(Stroke(color, size, list(zip(coords[0::2], coords[1::2]))))
+    return kept
+
+
+#Applies every ERASE line in a list of ops to the ops before it; the ERASE lines are dropped
+def apply_erases(ops):
+    kept = []
+    for op in ops:
+        if isinstance(op, bytes) and op.startswith(b"ERASE,"):
+            try:
+                _, rect = parse_line(op.rstrip(b'\n'))
+                kept = erase_ops(kept, normalize_rect(*rect))
+            except (ValueError, IndexError, TypeError):
+                pass
+            continue
+        kept.append(op)
+    return kept
+
+
+def has_erase(ops):
+    return any(isinstance(op, bytes) and op.startswith(b"ERASE,") for op in ops)
+
+
+#Encodes one snapshot op for a wire format
+def encode_op(op, wire):
+    if isinstance(op, Stroke):
+        return op.encode(wire)
+    if wire == WIRE_BINARY:
+        return convert(text_to_frame, op)
+    return convert(text_to_legacy, op) if wire == WIRE_LEGACY else op
+
+
+class RoomHistory:
+    """Drawing history of one room: compacted snapshot + tail of recent Packets."""
+
+    def __init__(self, compact_every=COMPACT_EVERY):
+        self.compact_every = compact_every
+        self.ops = []               # snapshot as Strokes / encoded text lines
+        self.snapshots = {}         # wire format (or 'zlib') -> encoded snapshot, built on first use
+        self.tail = []              # Packets received since the snapshot
+        self.ops_bytes = 0          # text size of the snapshot
+        self.tail_bytes = 0         # size of the tail as received
+
+    def __len__(self):
+        return len(self.ops) + len(self.tail)
+
+    def nbytes(self):
+        return self.ops_bytes + self.tail_bytes
+
+    def append(self, packet):
+        self.tail.append(packet)
+        self.tail_bytes += len(packet.frame if packet.text is None else packet.text)
+        if len(self.tail) >= self.compact_every:
+            self.compact()
+
+    def clear(self):
+        self.ops = []
+        self.snapshots = {}
+        self.tail = []
+        self.ops_bytes = self.tail_bytes = 0
+
+    def restore(self, lines):
+        """Loads a checkpoint: text lines as written from replay(WIRE_TEXT)."""
+        self.clear()
+        self.ops = merge_strokes([], lines)
+        if has_erase(self.ops):
+            self.ops = apply_erases(self.ops)
+        self.ops_bytes = sum(len(encode_op(op, WIRE_TEXT)) for op in self.ops)
+
+    def compact(self):
+        if not self.tail:
+            return
+        start = max(len(self.ops) - 1, 0)  # the last stroke may grow while merging
+        kept_bytes = self.ops_bytes - sum(len(encode_op(op, WIRE_TEXT)) for op in self.ops[start:])
+        self.ops = merge_strokes(self.ops, [packet.encode(WIRE_TEXT) for packet in self.tail])
+        changed = has_erase(self.ops[start:])
+        if changed:
+            self.ops = apply_erases(self.ops)
+        region = eraser_region(self.ops[start:])
+        if region:
+            self.ops = drop_erased(self.ops, region)
+            changed = True
+        if changed:
+            # erasing can touch any op: count them all again
+            self.ops_bytes = sum(len(encode_op(op, WIRE_TEXT)) for op in self.ops)
+        else:
+            self.ops_bytes = kept_bytes + sum(len(encode_op(op, WIRE_TEXT)) for op in self.ops[start:])
+        self.snapshots = {}
+        self.tail = []
+        self.tail_bytes = 0
+
+    def snapshot(self, wire=WIRE_TEXT):
+        data = self.snapshots.get(wire)
+        if data is None:
+            data = self.snapshots[wire] = b"".join(encode_op(op, wire) for op in self.ops)
+        return data
+
+    def replay(self, wire=WIRE_TEXT, compressed=False):
+        """The whole canvas as one buffer: snapshot followed by the tail.
+
+        'compressed' (binary wire only) wraps both in ZBLOCK frames.
+        """
+        tail = b"".join(packet.encode(wire) for packet in self.tail)
+        if not compressed:
+            return self.snapshot(wire) + tail
+        data = self.snapshots.get('zlib')
+        if data is None:
+            data = self.snapshots['zlib'] = compress_frames(self.snapshot(WIRE_BINARY))
+        return data + compress_frames(tail)
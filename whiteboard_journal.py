@@ -0,0 +1,270 @@
+# ROOM JOURNAL (whiteboard_journal.py)
+# -----------------------------------------------------------------------------
+# DESCRIPTION:
+# Optional on-disk journal so rooms survive a server restart or crash.
+#
+# Every room gets a directory (named by the hex of its code) holding:
+#   segment-<n>.log     append-only records: tag byte ('T' text / 'B' binary),
+#                       4-byte length, then the message exactly as received
+#   checkpoint-<n>.snap the compacted canvas as text lines, covering everything
+#                       written before segment-<n>.log
+#
+# Appends only go to the OS buffer; a background thread fsyncs dirty segments
+# every FSYNC_INTERVAL seconds and writes checkpoints. After a checkpoint is on
+# disk the older segments and checkpoints are deleted. Recovery memory-maps the
+# newest checkpoint and replays only the segments that follow it.
+# -----------------------------------------------------------------------------
+import os
+import mmap
+import queue
+import struct
+import threading
+
+from whiteboard_history import RoomHistory
+from whiteboard_protocol import Packet
+
+FSYNC_INTERVAL = 0.2        # seconds between fsync batches
+CHECKPOINT_EVERY = 4096     # records in a segment before the room is checkpointed
+RECORD = struct.Struct('!cI')
+TEXT_RECORD = b'T'
+FRAME_RECORD = b'B'
+
+
+def room_dir_name(room_code):
+    # Room codes come from clients: never use them as path components directly
+    return room_code.encode('utf-8').hex()
+
+
+def file_number(name, prefix, suffix):
+    if name.startswith(prefix) and name.endswith(suffix):
+        try:
+            return int(name[len(prefix):-len(suffix)])
+        except ValueError:
+            pass
+    return None
+
+
+class RoomJournal:
+    """The open segment of one room."""
+
+    def __init__(self, path, number):
+        self.path = path
+        self.lock = threading.Lock()
+        self.number = number
+        self.file = open(self.segment_path(number), 'ab')
+        self.records = 0
+        self.dirty = False
+        self.dropped = False
+
+    def segment_path(self, number):
+        return os.path.join(self.path, f"segment-{number:08d}.log")
+
+    def checkpoint_path(self, number):
+        return os.path.join(self.path, f"checkpoint-{number:08d}.snap")
+
+
+class Journal:
+    """Append-only per-room journal with batched fsync and compacted checkpoints."""
+
+    def __init__(self, directory, fsync_interval=FSYNC_INTERVAL, checkpoint_every=CHECKPOINT_EVERY):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.checkpoint_every = checkpoint_every
+        self.rooms = {}
+        self.lock = threading.Lock()
+        self.jobs = queue.Queue()
+        self.stopped = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        self.writer = threading.Thread(target=self.run, daemon=True)
+        self.writer.start()
+
+    # --- write path (called with the room locked) ---
+    def room(self, room_code, number=0):
+        journal = self.rooms.get(room_code)
+        if journal is not None:
+            return journal
+        with self.lock:
+            journal = self.rooms.get(room_code)
+            if journal is None:
+                path = os.path.join(self.directory, room_dir_name(room_code))
+                os.makedirs(path, exist_ok=True)
+                journal = self.rooms[room_code] = RoomJournal(path, number)
+            return journal
+
+    def append(self, room_code, packet):
+        """Records one drawing, ERASE or CLEAR; returns True when the room is due for a checkpoint."""
+        if packet.frame is not None:
+            tag, data = FRAME_RECORD, packet.frame
+        else:
+            tag, data = TEXT_RECORD, packet.text
+        journal = self.room(room_code)
+        with journal.lock:
+            journal.file.write(RECORD.pack(tag, len(data)) + data)
+            journal.records += 1
+            journal.dirty = True
+            return journal.records >= self.checkpoint_every
+
+    def checkpoint(self, room_code, state):
+        """Starts a new segment; 'state' (text lines) replaces everything before it."""
+        journal = self.room(room_code)
+        with journal.lock:
+            old_file = journal.file
+            old_file.flush()    # hand the last records (e.g. a CLEAR) to the OS before the swap
+            journal.number += 1
+            journal.file = open(journal.segment_path(journal.number), 'ab')
+            journal.records = 0
+            number = journal.number
+        self.jobs.put((journal, number, state, old_file))
+
+    def drop(self, room_code):
+        """Forgets a room and deletes its files."""
+        with self.lock:
+            journal = self.rooms.pop(room_code, None)
+            if journal is None:
+                return
+            with journal.lock:
+                journal.dropped = True
+                journal.file.close()
+                for name in os.listdir(journal.path):
+                    os.remove(os.path.join(journal.path, name))
+                os.rmdir(journal.path)
+
+    # --- background writer ---
+    def run(self):
+        while not self.stopped.wait(self.fsync_interval):
+            self.sync()
+
+    def sync(self):
+        with self.lock:
+            journals = list(self.rooms.values())
+        for journal in journals:
+            with journal.lock:
+                if journal.dropped or not journal.dirty:
+                    continue
+                journal.dirty = False
+                journal.file.flush()
+                fd = os.dup(journal.file.fileno())
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                self.write_checkpoint(*job)
+            except OSError:
+                pass  # room dropped meanwhile, or disk trouble: the segments stay valid
+
+    def write_checkpoint(self, journal, number, state, old_file):
+        if journal.dropped:
+            old_file.close()
+            return
+        old_file.flush()
+        os.fsync(old_file.fileno())
+        old_file.close()
+        path = journal.checkpoint_path(number)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(state)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        fsync_dir(journal.path)
+        # Only now is it safe to forget what the checkpoint replaces
+        for name in os.listdir(journal.path):
+            n = file_number(name, "segment-", ".log")
+            if n is None:
+                n = file_number(name, "checkpoint-", ".snap")
+            if n is not None and n < number:
+                os.remove(os.path.join(journal.path, name))
+
+    def close(self):
+        self.stopped.set()
+        self.writer.join()
+        self.sync()
+        with self.lock:
+            for journal in self.rooms.values():
+                journal.file.close()
+
+    # --- recovery ---
+    def recover(self, owns=None):
+        """Rebuilds every journaled room: {room_code: RoomHistory}.
+
+        'owns' (room_code -> bool) limits recovery to some rooms, e.g. those a
+        cluster worker is responsible for when several share one directory.
+        """
+        rooms = {}
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            try:
+                room_code = bytes.fromhex(name).decode('utf-8')
+            except ValueError:
+                continue
+            if owns is not None and not owns(room_code):
+                continue
+            if os.path.isdir(path):
+                history, next_number = recover_room(path)
+                rooms[room_code] = history
+                self.room(room_code, next_number)
+        return rooms
+
+
+def recover_room(path):
+    names = os.listdir(path)
+    checkpoints = sorted(n for n in (file_number(name, "checkpoint-", ".snap") for name in names) if n is not None)
+    segments = sorted(n for n in (file_number(name, "segment-", ".log") for name in names) if n is not None)
+    history = RoomHistory()
+    base = checkpoints[-1] if checkpoints else 0
+    if checkpoints:
+        history.restore(read_lines(os.path.join(path, f"checkpoint-{base:08d}.snap")))
+    for number in segments:
+        if number >= base:
+            for packet in read_segment(os.path.join(path, f"segment-{number:08d}.log")):
+                if packet.kind == b"CLEAR":
+                    history.clear()
+                else:
+                    history.append(packet)
+    history.compact()
+    # Never append after a possibly torn record: continue in a fresh segment
+    return history, max(segments + checkpoints + [0]) + 1
+
+
+def read_lines(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return list(iter(mm.readline, b""))
+
+
+def read_segment(path):
+    packets = []
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return packets
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = 0
+            while pos + RECORD.size <= len(mm):
+                tag, length = RECORD.unpack_from(mm, pos)
+                start = pos + RECORD.size
+                if start + length > len(mm):
+                    break  # torn write at crash time
+                data = mm[start:start + length]
+                packets.append(Packet(frame=data) if tag == FRAME_RECORD else Packet(text=data))
+                pos = start + length
+    return packets
+
+
+def fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:  # e.g. Windows
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,57 @@
+# FLOOD CONTROL (whiteboard_limits.py)
+# -----------------------------------------------------------------------------
+# DESCRIPTION:
+# Token buckets for the server's per-connection and per-room rate limits
+# (messages/s and bytes/s).
+#
+# A bucket may go into debt: a drawing over the limit is still applied (dropping
+# it would leave the sender's canvas different from everyone else's), but the
+# server then stops reading from that client until the debt is paid back. TCP
+# flow control carries the delay back to the sender. Chat is cheaper to lose:
+# over the limit it is dropped (allows() checks without taking).
+# -----------------------------------------------------------------------------
+import time
+import threading
+
+BURST_SECONDS = 2.0     # a bucket holds this many seconds' worth of tokens
+
+
+class TokenBucket:
+    """'rate' tokens per second, holding at most rate * BURST_SECONDS."""
+
+    def __init__(self, rate, burst_seconds=BURST_SECONDS):
+        self.rate = rate
+        self.burst = rate * burst_seconds
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()    # room buckets are shared by the members' threads
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def allows(self, amount, now):
+        with self.lock:
+            self.refill(now)
+            return self.tokens >= amount
+
+    def take(self, amount, now):
+        """Spends 'amount'; returns how long (s) until the bucket is out of debt again."""
+        with self.lock:
+            self.refill(now)
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class RateLimit:
+    """A messages/s and a bytes/s bucket; a rate of 0 leaves that one unlimited."""
+
+    def __init__(self, messages_per_s, bytes_per_s):
+        self.buckets = [(TokenBucket(rate), per_byte)
+                        for rate, per_byte in ((messages_per_s, False), (bytes_per_s, True)) if rate > 0]
+
+    def allows(self, nbytes, now):
+        return all(bucket.allows(nbytes if per_byte else 1, now) for bucket, per_byte in self.buckets)
+
+    def take(self, nbytes, now):
+        return max((bucket.take(nbytes if per_byte else 1, now) for bucket, per_byte in self.buckets), default=0.0)
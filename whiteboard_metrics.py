@@ -0,0 +1,194 @@
+# METRICS (whiteboard_metrics.py)
+# -----------------------------------------------------------------------------
+# DESCRIPTION:
+# Counters, histograms and gauges for the server, served as Prometheus text on a
+# local HTTP port:
+#
+#   GET /metrics               every registered metric
+#   GET /profile?seconds=5     sampling profiler: stacks of all threads, sampled
+#                              every few ms, in "collapsed" form (one line per
+#                              stack: frame;frame;frame count) for flame graphs
+#   anything in ROUTES         added by the server, e.g. /render (room PNGs)
+#
+# Counters and histograms take a small lock per update; gauges are computed by a
+# function only when scraped, so they cost nothing on the I/O path.
+# -----------------------------------------------------------------------------
+import sys
+import time
+import bisect
+import threading
+import collections
+
+PROFILE_INTERVAL = 0.005    # seconds between profiler samples
+PROFILE_MAX_SECONDS = 60
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+REGISTRY = []
+ROUTES = {}     # extra GET paths: path -> func(query dict) returning (bytes, content type), or None for 404
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    """Monotonic count, optionally split by labels, e.g. messages per opcode."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values = collections.defaultdict(float)
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, labels=()):
+        with self.lock:
+            self.values[labels] += amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for labels, value in sorted(values.items()):
+            yield self.name + format_labels(self.labels, labels), value
+
+
+class Histogram:
+    """Distribution over fixed buckets (cumulative on output, as Prometheus expects)."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        running = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            running += count
+            le = "+Inf" if bound == float('inf') else repr(bound)
+            yield f'{self.name}_bucket{{le="{le}"}}', running
+        yield f"{self.name}_sum", total
+        yield f"{self.name}_count", running
+
+
+class Gauge:
+    """Current value computed at scrape time by 'func' (a number, or {label values: number})."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, func, labels=()):
+        self.name = name
+        self.help = help_text
+        self.func = func
+        self.labels = labels
+        REGISTRY.append(self)
+
+    def samples(self):
+        value = self.func()
+        if isinstance(value, dict):
+            for labels, v in sorted(value.items()):
+                yield self.name + format_labels(self.labels, labels), v
+        else:
+            yield self.name, value
+
+
+#Prometheus text exposition of every registered metric
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        try:
+            for name, value in metric.samples():
+                lines.append(f"{name} {value:g}")
+        except Exception as e:  # a broken gauge must not break the scrape
+            lines.append(f"# error: {e}")
+    return "\n".join(lines) + "\n"
+
+
+#Samples the stacks of all other threads for 'seconds'; returns collapsed stacks
+def sample_stacks(seconds, interval=PROFILE_INTERVAL):
+    own = threading.get_ident()
+    stacks = collections.Counter()
+    deadline = time.monotonic() + min(seconds, PROFILE_MAX_SECONDS)
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({code.co_filename.rpartition('/')[2]}:{frame.f_lineno})")
+                frame = frame.f_back
+            stacks[";".join(reversed(names))] += 1
+        time.sleep(interval)
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+#Answers one GET: (body, content type), or None for a 404
+def respond(path):
+    import urllib.parse
+    url = urllib.parse.urlparse(path)
+    if url.path == "/metrics":
+        return render(), "text/plain; version=0.0.4"
+    if url.path == "/profile":
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            seconds = float(query.get("seconds", ["5"])[0])
+        except ValueError:
+            seconds = 5
+        return sample_stacks(seconds), "text/plain"
+    if url.path in ROUTES:
+        return ROUTES[url.path](urllib.parse.parse_qs(url.query))
+    return None
+
+
+#Starts the HTTP endpoint in a background thread (localhost only by default).
+#http.server is imported here, so a server without --metrics does not load it.
+def serve_metrics(port, host='127.0.0.1'):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            result = respond(self.path)
+            if result is None:
+                self.send_error(404)
+                return
+            body, content_type = result
+            data = body.encode('utf-8') if isinstance(body, str) else body
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass  # scrapes are not worth a log line
+
+    httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
@@ -0,0 +1,456 @@
+# WIRE PROTOCOL (whiteboard_protocol.py)
+# -----------------------------------------------------------------------------
+# DESCRIPTION:
+# Shared by the server and the client. Messages travel in one of two formats:
+#
+#   text   - the original CSV lines, e.g. "DRAW,x1,y1,x2,y2,color,size\n"
+#   binary - length-prefixed frames: varint(len) | opcode byte | payload
+#            shape coordinates are int16, STROKE points are zigzag varint deltas,
+#            common colours are a one-byte palette index.
+#
+# Negotiation: the client appends "bin1" to its JOIN line. A server that supports
+# it answers "PROTO,bin1\n" and sends binary from then on; the client replies
+# with the same line and sends binary after it. Old clients never ask and old
+# servers never answer, so both sides stay on text.
+#
+# Clients that add "seq" to JOIN also get SEQ markers: the sequence number of
+# the room operation they are up to. After a dropped connection they rejoin with
+# "since=<seq>,epoch=<room epoch>" and receive only the operations they missed.
+#
+# Text clients receive STROKE polylines only if they add "stroke" to JOIN. Older
+# clients (which skip unknown commands) get each polyline as the DRAW segments it
+# stands for: the "legacy" wire, text without STROKE.
+#
+# Binary clients that add "zlib1" get bulk transfers (history replay) as ZBLOCK
+# frames: raw deflate, primed with ZDICT, of a run of ordinary frames.
+#
+# Lobby: before JOIN a client may send "LIST_ROOMS" (answered with one ROOMS
+# line) or "NEW_ROOM" (answered with "ROOM,<code>", a code no room uses), then
+# JOIN on the same connection. Servers also answer a "DISCOVER" UDP datagram on
+# their port with "SERVER,<tcp port>,<rooms>,<users>,<tls>" (LAN discovery).
+#
+# The server forwards frames as received; a Packet only converts a message when
+# a peer in the other format needs it, and then only once.
+# -----------------------------------------------------------------------------
+import zlib
+import struct
+
+WIRE_TEXT = 'text'
+WIRE_BINARY = 'binary'
+WIRE_LEGACY = 'legacy'  # text without STROKE, for clients that did not offer STROKE_OPTION
+BINARY_VERSION = 'bin1'
+PROTO_LINE = b"PROTO," + BINARY_VERSION.encode('ascii') + b"\n"
+SEQ_OPTION = 'seq'      # JOIN option: send SEQ markers (needed to resume)
+SLOW_OPTION = 'slow'    # JOIN option: send SLOW when the client hits its rate limit
+COMPRESS_VERSION = 'zlib1'  # JOIN option: compress bulk transfers (binary wire only)
+STROKE_OPTION = 'stroke'    # JOIN option: text client understands STROKE polylines
+ZBLOCK_CHUNK = 256 * 1024   # uncompressed bytes per ZBLOCK (keeps every block far below MAX_FRAME)
+ZLIB_LEVEL = 6
+MAX_FRAME = 1 << 20     # largest frame accepted from a peer
+MAX_PEN_SIZE = 500      # thickest line a drawing may ask for
+COORD_MIN = -32768      # drawings must stay in the int16 range the binary wire carries
+COORD_MAX = 32767
+LIST_ROOMS_LINE = b"LIST_ROOMS\n"
+NEW_ROOM_LINE = b"NEW_ROOM\n"
+DISCOVER_QUERY = b"DISCOVER\n"     # UDP broadcast; servers answer with a SERVER line
+
+DRAWING_KINDS = (b"DRAW", b"STROKE", b"LINE", b"RECT", b"CIRCLE", b"TRI")
+OPCODES = {b"DRAW": 1, b"STROKE": 2, b"LINE": 3, b"RECT": 4, b"CIRCLE": 5,
+           b"TRI": 6, b"CLEAR": 7, b"CHAT": 8, b"USER_LIST": 9, b"REDIRECT": 10, b"ERASE": 11,
+           b"SEQ": 12, b"SLOW": 13, b"ZBLOCK": 14}
+KINDS = {op: kind for kind, op in OPCODES.items()}
+
+# Colour table: palette index, 0xFE + name, or 0xFF + RGB
+PALETTE = ['black', 'white', 'red', 'green', 'blue', 'orange', 'yellow', 'purple', 'gray']
+PALETTE_INDEX = {name: i for i, name in enumerate(PALETTE)}
+COLOR_NAME = 0xFE
+COLOR_RGB = 0xFF
+
+SHAPE = struct.Struct('!4h')
+TRIANGLE = struct.Struct('!6h')
+SHAPE_KINDS = (b"DRAW", b"LINE", b"RECT", b"CIRCLE")
+
+
+class ProtocolError(ValueError):
+    """Raised for malformed or oversized binary frames."""
+
+
+# --- varints ---
+def write_varint(out, n):
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def read_varint(buf, pos):
+    shift = result = 0
+    while True:
+        if pos >= len(buf):
+            raise IndexError("truncated varint")
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+        if shift > 63:
+            raise ProtocolError("varint too long")
+
+def zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+def unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+def clamp16(v):
+    return max(COORD_MIN, min(COORD_MAX, int(v)))
+
+
+# --- colours ---
+def write_color(out, color):
+    index = PALETTE_INDEX.get(color)
+    if index is not None:
+        out.append(index)
+    elif len(color) == 7 and color[0] == '#':
+        out.append(COLOR_RGB)
+        out += bytes.fromhex(color[1:])
+    else:
+        raw = color.encode('utf-8')
+        out.append(COLOR_NAME)
+        write_varint(out, len(raw))
+        out += raw
+
+def read_color(buf, pos):
+    tag = buf[pos]
+    pos += 1
+    if tag == COLOR_RGB:
+        return '#' + bytes(buf[pos:pos + 3]).hex(), pos + 3
+    if tag == COLOR_NAME:
+        length, pos = read_varint(buf, pos)
+        return bytes(buf[pos:pos + length]).decode('utf-8'), pos + length
+    return PALETTE[tag], pos
+
+
+# --- messages as (kind, fields) ---
+# DRAW/LINE/RECT/CIRCLE: (x1, y1, x2, y2, color, size)
+# TRI:                   (x1, y1, x2, y2, x3, y3, color, size)
+# STROKE:                (color, size, [x1, y1, x2, y2, ...])
+# CHAT:                  (username, text)
+# USER_LIST:             [names]
+# REDIRECT:              (host, port)   reconnect there; "" / 0 = the same server
+# ERASE:                 (x1, y1, x2, y2)   delete the drawings crossing the rectangle
+# SEQ:                   (seq, epoch)   operations up to 'seq' are applied; epoch may be ""
+# SLOW:                  (ms,)          over the rate limit: send less for about 'ms'
+# CLEAR:                 ()
+# ROOMS:                 [(code, users, operations, idle seconds), ...]   answer to LIST_ROOMS
+# ROOM:                  (code,)        answer to NEW_ROOM; "" if no code is free
+# SERVER:                (port, rooms, users, tls)   answer to DISCOVER
+
+#Parses one text line (without the newline) into (kind, fields)
+def parse_line(line):
+    if isinstance(line, (bytes, bytearray, memoryview)):
+        line = bytes(line).decode('utf-8')
+    cmd, _, rest = line.partition(',')
+    kind = cmd.encode('ascii', 'replace')
+    if kind in SHAPE_KINDS:
+        p = rest.split(',')
+        return kind, (int(p[0]), int(p[1]), int(p[2]), int(p[3]), p[4], int(p[5]))
+    if kind == b"TRI":
+        p = rest.split(',')
+        return kind, tuple(int(v) for v in p[:6]) + (p[6], int(p[7]))
+    if kind == b"STROKE":
+        p = rest.split(',')
+        return kind, (p[0], int(p[1]), [int(v) for v in p[2:]])
+    if kind == b"CHAT":
+        user, _, text = rest.partition(',')
+        return kind, (user, text)
+    if kind == b"USER_LIST":
+        return kind, rest.split(',') if rest else []
+    if kind == b"REDIRECT":
+        host, _, port = rest.partition(',')
+        return kind, (host, int(port or 0))
+    if kind == b"ERASE":
+        return kind, tuple(int(v) for v in rest.split(',')[:4])
+    if kind == b"SEQ":
+        seq, _, epoch = rest.partition(',')
+        return kind, (int(seq), epoch)
+    if kind == b"SLOW":
+        return kind, (int(rest),)
+    if kind == b"ROOMS":
+        p = rest.split(',') if rest else []
+        return kind, [(p[i], int(p[i + 1]), int(p[i + 2]), int(p[i + 3])) for i in range(0, len(p) - 3, 4)]
+    if kind == b"ROOM":
+        return kind, (rest,)
+    if kind == b"SERVER":
+        return kind, tuple(int(v) for v in rest.split(',')[:4])
+    return kind, ()
+
+#Formats (kind, fields) as a text line
+def format_line(kind, fields):
+    if kind == b"STROKE":
+        color, size, coords = fields
+        text = f"STROKE,{color},{size}," + ",".join(map(str, coords))
+    elif kind == b"USER_LIST":
+        text = "USER_LIST," + ",".join(fields)
+    elif kind == b"ROOMS":
+        text = "ROOMS" + "".join(f",{code},{users},{ops},{idle}" for code, users, ops, idle in fields)
+    elif kind == b"SEQ" and not fields[1]:
+        text = f"SEQ,{fields[0]}"
+    else:
+        text = ",".join([kind.decode('ascii')] + [str(f) for f in fields])
+    return (text + "\n").encode('utf-8')
+
+#Encodes (kind, fields) as a binary frame
+def encode_frame(kind, fields):
+    body = bytearray((OPCODES[kind],))
+    if kind in SHAPE_KINDS:
+        body += SHAPE.pack(*map(clamp16, fields[:4]))
+        write_color(body, fields[4])
+        write_varint(body, fields[5])
+    elif kind == b"TRI":
+        body += TRIANGLE.pack(*map(clamp16, fields[:6]))
+        write_color(body, fields[6])
+        write_varint(body, fields[7])
+    elif kind == b"STROKE":
+        color, size, coords = fields
+        write_color(body, color)
+        write_varint(body, size)
+        write_varint(body, len(coords) // 2)
+        px = py = 0
+        for i in range(0, len(coords) - 1, 2):
+            x, y = coords[i], coords[i + 1]
+            write_varint(body, zigzag(x - px))
+            write_varint(body, zigzag(y - py))
+            px, py = x, y
+    elif kind == b"CHAT":
+        user = fields[0].encode('utf-8')
+        write_varint(body, len(user))
+        body += user + fields[1].encode('utf-8')
+    elif kind == b"USER_LIST":
+        body += "\0".join(fields).encode('utf-8')
+    elif kind == b"REDIRECT":
+        write_varint(body, fields[1])
+        body += fields[0].encode('utf-8')
+    elif kind == b"ERASE":
+        body += SHAPE.pack(*map(clamp16, fields[:4]))
+    elif kind == b"SEQ":
+        write_varint(body, fields[0])
+        body += fields[1].encode('utf-8')
+    elif kind == b"SLOW":
+        write_varint(body, fields[0])
+    frame = bytearray()
+    write_varint(frame, len(body))
+    return bytes(frame + body)
+
+#Decodes a complete frame (length prefix included) into (kind, fields)
+def decode_frame(frame):
+    _, pos = read_varint(frame, 0)
+    kind = KINDS.get(frame[pos])
+    if kind is None:
+        raise ProtocolError(f"unknown opcode {frame[pos]}")
+    pos += 1
+    if kind in SHAPE_KINDS:
+        coords = SHAPE.unpack_from(frame, pos)
+        color, pos = read_color(frame, pos + SHAPE.size)
+        size, pos = read_varint(frame, pos)
+        return kind, coords + (color, size)
+    if kind == b"TRI":
+        coords = TRIANGLE.unpack_from(frame, pos)
+        color, pos = read_color(frame, pos + TRIANGLE.size)
+        size, pos = read_varint(frame, pos)
+        return kind, coords + (color, size)
+    if kind == b"STROKE":
+        color, pos = read_color(frame, pos)
+        size, pos = read_varint(frame, pos)
+        count, pos = read_varint(frame, pos)
+        coords = []
+        x = y = 0
+        for _ in range(count):
+            dx, pos = read_varint(frame, pos)
+            dy, pos = read_varint(frame, pos)
+            x += unzigzag(dx)
+            y += unzigzag(dy)
+            coords += (x, y)
+        return kind, (color, size, coords)
+    if kind == b"CHAT":
+        length, pos = read_varint(frame, pos)
+        user = bytes(frame[pos:pos + length]).decode('utf-8')
+        return kind, (user, bytes(frame[pos + length:]).decode('utf-8'))
+    if kind == b"USER_LIST":
+        names = bytes(frame[pos:]).decode('utf-8')
+        return kind, names.split("\0") if names else []
+    if kind == b"REDIRECT":
+        port, pos = read_varint(frame, pos)
+        return kind, (bytes(frame[pos:]).decode('utf-8'), port)
+    if kind == b"ERASE":
+        return kind, SHAPE.unpack_from(frame, pos)
+    if kind == b"SEQ":
+        seq, pos = read_varint(frame, pos)
+        return kind, (seq, bytes(frame[pos:]).decode('utf-8'))
+    if kind == b"SLOW":
+        return kind, (read_varint(frame, pos)[0],)
+    return kind, ()
+
+#A colour every client can draw: a plain name ('red') or #rgb / #rrggbb
+def valid_color(color):
+    if color.startswith('#'):
+        return len(color) in (4, 7) and all(c in '0123456789abcdefABCDEF' for c in color[1:])
+    return 0 < len(color) <= 32 and color.isascii() and color.isalpha()
+
+def valid_coords(coords):
+    return all(COORD_MIN <= v <= COORD_MAX for v in coords)
+
+#Checks a parsed drawing (or ERASE): field count, at least one STROKE point, integer
+#coordinates in the int16 range, a drawable colour and a sane pen size. The server
+#drops drawings that fail it.
+def valid_drawing(kind, fields):
+    if kind == b"ERASE":
+        return len(fields) == 4 and valid_coords(fields)
+    if kind == b"STROKE":
+        color, size, coords = fields
+        if not coords or len(coords) % 2:
+            return False
+    elif kind in SHAPE_KINDS or kind == b"TRI":
+        count = 4 if kind in SHAPE_KINDS else 6
+        if len(fields) != count + 2:
+            return False
+        coords, (color, size) = fields[:count], fields[count:]
+    else:
+        return False
+    return valid_color(color) and 0 < size <= MAX_PEN_SIZE and valid_coords(coords)
+
+#Parses a text line or binary frame and checks it with valid_drawing()
+def check_drawing(data, wire):
+    try:
+        kind, fields = decode_frame(data) if wire == WIRE_BINARY else parse_line(data)
+    except (ValueError, IndexError, KeyError, OverflowError, struct.error):
+        return False
+    return valid_drawing(kind, fields)
+
+#Preset dictionary for ZBLOCK: typical frames and text tokens, so that even short
+#blocks compress. Part of the "zlib1" format: changing it needs a new version string.
+def build_zdict():
+    parts = [",".join(kind.decode('ascii') for kind in OPCODES).encode('ascii')]
+    for color in PALETTE:
+        for size in (1, 2, 3, 5, 8):
+            parts.append(f"STROKE,{color},{size},DRAW,".encode('ascii'))
+            parts.append(encode_frame(b"DRAW", (0, 0, 1, 1, color, size)))
+            parts.append(encode_frame(b"STROKE", (color, size, [0, 0, 1, 1, 2, 2, 1, 0])))
+    return b"".join(parts)
+
+ZDICT = build_zdict()
+
+#Wraps a run of complete binary frames into ZBLOCK frames of at most ZBLOCK_CHUNK input each
+def compress_frames(data, chunk=ZBLOCK_CHUNK):
+    out = bytearray()
+    start = 0
+    while start < len(data):
+        end = start
+        while end < len(data) and (end == start or end - start < chunk):
+            end = frame_end(data, end)
+        packer = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, -15, zdict=ZDICT)
+        body = bytes((OPCODES[b"ZBLOCK"],)) + packer.compress(data[start:end]) + packer.flush()
+        write_varint(out, len(body))
+        out += body
+        start = end
+    return bytes(out)
+
+#Decodes a frame into a list of (kind, fields): one message, or everything inside a ZBLOCK
+def decode_frames(frame):
+    if frame_kind(frame) != b"ZBLOCK":
+        return [decode_frame(frame)]
+    _, pos = read_varint(frame, 0)
+    unpacker = zlib.decompressobj(-15, zdict=ZDICT)
+    try:
+        data = unpacker.decompress(bytes(frame[pos + 1:]), 4 * ZBLOCK_CHUNK)
+    except zlib.error as e:
+        raise ProtocolError(f"bad ZBLOCK: {e}")
+    if unpacker.unconsumed_tail:
+        raise ProtocolError("ZBLOCK too large")
+    messages = []
+    start = 0
+    while start < len(data):
+        end = frame_end(data, start)
+        if end is None:
+            raise ProtocolError("truncated frame in ZBLOCK")
+        messages.append(decode_frame(data[start:end]))
+        start = end
+    return messages
+
+def text_to_frame(line):
+    return encode_frame(*parse_line(line.rstrip(b"\n")))
+
+def frame_to_text(frame):
+    return format_line(*decode_frame(frame))
+
+#Rewrites a STROKE line as the DRAW segments it stands for; other lines are returned as they are
+def text_to_legacy(line):
+    if not line.startswith(b"STROKE,"):
+        return line
+    _, (color, size, coords) = parse_line(line.rstrip(b"\n"))
+    points = list(zip(coords[0::2], coords[1::2]))
+    if len(points) == 1:
+        points = points * 2
+    return b"".join(format_line(b"DRAW", (x1, y1, x2, y2, color, size))
+                    for (x1, y1), (x2, y2) in zip(points, points[1:]))
+
+#Returns where the frame starting at 'start' ends, or None if it is incomplete
+def frame_end(buf, start, limit=MAX_FRAME):
+    try:
+        length, pos = read_varint(buf, start)
+    except IndexError:
+        return None
+    if length == 0 or length > limit:
+        raise ProtocolError(f"bad frame length {length}")
+    end = pos + length
+    return end if end <= len(buf) else None
+
+#Returns (frame, end) for the frame starting at 'start', or (None, start) if incomplete
+def next_frame(buf, start):
+    end = frame_end(buf, start)
+    if end is None:
+        return None, start
+    return bytes(buf[start:end]), end
+
+#Returns the command name of an encoded text line, e.g. b"DRAW"
+def message_kind(data):
+    return data.partition(b',')[0].rstrip(b'\n')
+
+#Returns the command name of a binary frame without decoding its payload
+def frame_kind(frame):
+    _, pos = read_varint(frame, 0)
+    return KINDS.get(frame[pos], b"")
+
+
+class Packet:
+    """One message, encoded in each wire format only when a recipient needs it."""
+
+    __slots__ = ("kind", "text", "frame", "legacy")
+
+    def __init__(self, text=None, frame=None):
+        self.text = text
+        self.frame = frame
+        self.legacy = None
+        self.kind = message_kind(text) if text is not None else frame_kind(frame)
+
+    def encode(self, wire):
+        """Bytes for a peer using 'wire'; b"" if the message cannot be converted."""
+        if wire == WIRE_BINARY:
+            if self.frame is None:
+                self.frame = convert(text_to_frame, self.text)
+            return self.frame
+        if self.text is None:
+            self.text = convert(frame_to_text, self.frame)
+        if wire == WIRE_LEGACY and self.kind == b"STROKE":
+            if self.legacy is None:
+                self.legacy = convert(text_to_legacy, self.text)
+            return self.legacy
+        return self.text
+
+
+#Runs a format conversion; malformed input converts to b"" (nothing is sent)
+def convert(func, data):
+    try:
+        return func(data)
+    except (ValueError, IndexError, KeyError, OverflowError, struct.error):
+        return b""
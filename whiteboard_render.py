@@ -0,0 +1,163 @@
+# ROOM RENDERER (whiteboard_render.py)
+# -----------------------------------------------------------------------------
+# DESCRIPTION:
+# Draws a room on the server, without Tk, for PNG exports and lobby thumbnails
+# (served on the metrics endpoint: GET /render?room=1234[&thumb=200]).
+#
+#   - every room gets a cached raster (Pillow image) on its first export, together
+#     with the sequence number of the last operation it shows
+#   - the next export only draws the operations since then, taken from the room's
+#     resume ring; a CLEAR just blanks the image. An ERASE, or a gap the ring no
+#     longer covers, redraws the room from its compacted history
+#   - consecutive brush segments are merged into polylines first (the history's
+#     merge_strokes), so a stroke is one C-level line call, not one per segment
+#   - the encoded PNG and thumbnails are kept until the room changes
+#
+# Nothing is drawn on the message path: a room nobody exports costs nothing.
+# Pillow is optional; without it 'available' is False and exports are disabled.
+# -----------------------------------------------------------------------------
+import io
+import time
+import threading
+
+import whiteboard_metrics as metrics
+from whiteboard_history import Stroke, apply_erases, has_erase, merge_strokes
+from whiteboard_protocol import WIRE_TEXT, parse_line
+
+try:
+    from PIL import Image, ImageColor, ImageDraw
+except ImportError:  # Pillow is optional: the server runs without exports
+    Image = None
+
+available = Image is not None
+
+RENDER_WIDTH = 1600     # world area drawn, from (0, 0): a default client view plus margin
+RENDER_HEIGHT = 1000
+BACKGROUND = 'white'
+THUMB_MIN = 16          # smallest / largest thumbnail side accepted (px)
+THUMB_MAX = 800
+
+renders = metrics.Counter("whiteboard_renders_total", "Room exports, by how the raster was brought up to date",
+                          ("mode",))
+render_seconds = metrics.Histogram("whiteboard_render_seconds", "Time to bring a room's raster up to date")
+
+colors = {}
+
+
+#RGB of a colour name or #rrggbb; unknown names draw in black
+def rgb(color):
+    if color not in colors:
+        try:
+            colors[color] = ImageColor.getrgb(color)[:3]
+        except ValueError:
+            colors[color] = (0, 0, 0)
+    return colors[color]
+
+#Draws a polyline with round ends, like the client's brush
+def draw_polyline(draw, points, color, size):
+    fill = rgb(color)
+    if len(points) == 1:
+        points = points * 2
+    draw.line(points, fill=fill, width=size, joint='curve')
+    if size > 2:
+        r = size / 2
+        for x, y in (points[0], points[-1]):
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=fill)
+
+#Draws one parsed shape message (brush strokes come as Strokes)
+def draw_shape(draw, kind, fields):
+    if kind == b"TRI":
+        x1, y1, x2, y2, x3, y3, color, size = fields
+        draw.line([(x1, y1), (x2, y2), (x3, y3), (x1, y1)], fill=rgb(color), width=size, joint='curve')
+        return
+    x1, y1, x2, y2, color, size = fields
+    if kind == b"LINE":
+        draw.line([(x1, y1), (x2, y2)], fill=rgb(color), width=size)
+    elif kind in (b"RECT", b"CIRCLE"):
+        box = (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+        if kind == b"RECT":
+            draw.rectangle(box, outline=rgb(color), width=size)
+        else:
+            draw.ellipse(box, outline=rgb(color), width=size)
+
+
+class RoomRaster:
+    """The cached image of one room, the sequence number it is up to, and its PNGs."""
+
+    def __init__(self, size=(RENDER_WIDTH, RENDER_HEIGHT)):
+        self.image = Image.new('RGB', size, BACKGROUND)
+        self.draw = ImageDraw.Draw(self.image)
+        self.seq = None             # room.seq the image shows; None = never drawn
+        self.pngs = {}              # thumbnail side (None = full size) -> PNG bytes
+        self.lock = threading.Lock()
+
+    def clear(self):
+        self.draw.rectangle((0, 0) + self.image.size, fill=BACKGROUND)
+
+    def apply(self, lines):
+        """Draws text protocol lines (history entries) onto the image."""
+        ops = merge_strokes([], lines)
+        if has_erase(ops):
+            ops = apply_erases(ops)
+        for op in ops:
+            if isinstance(op, Stroke):
+                draw_polyline(self.draw, op.points, op.color, op.size)
+                continue
+            try:
+                kind, fields = parse_line(op.rstrip(b'\n'))
+            except (ValueError, IndexError):
+                continue
+            if kind == b"CLEAR":
+                self.clear()
+            elif kind in (b"LINE", b"RECT", b"CIRCLE", b"TRI"):
+                try:
+                    draw_shape(self.draw, kind, fields)
+                except (ValueError, TypeError):
+                    pass
+
+    def update(self, room):
+        """Brings the image up to the room's current state; returns how ('cached', 'incremental', 'full')."""
+        with room.lock:
+            missed = room.since(self.seq) if self.seq is not None else None
+            if missed is not None and not any(packet.kind == b"ERASE" for packet in missed):
+                if not missed:
+                    return "cached"
+                mode, lines = "incremental", [packet.encode(WIRE_TEXT) for packet in missed]
+            else:
+                mode, lines = "full", room.history.replay(WIRE_TEXT).splitlines(keepends=True)
+            self.seq = room.seq
+        # Drawing happens outside the room lock: the room keeps relaying meanwhile
+        if mode == "full":
+            self.clear()
+        self.apply(lines)
+        self.pngs = {}
+        return mode
+
+    def png(self, room, thumb=None):
+        """The room as PNG bytes; 'thumb' scales it to fit a square of that side."""
+        with self.lock:
+            started = time.perf_counter()
+            mode = self.update(room)
+            renders.inc(1, (mode,))
+            render_seconds.observe(time.perf_counter() - started)
+            data = self.pngs.get(thumb)
+            if data is None:
+                image = self.image
+                if thumb:
+                    image = image.copy()
+                    image.thumbnail((thumb, thumb))
+                out = io.BytesIO()
+                image.save(out, 'PNG')
+                data = self.pngs[thumb] = out.getvalue()
+            return data
+
+
+#PNG of a room (scaled to 'thumb' px if given), using and updating its cached raster
+def render_room(room, thumb=None):
+    if thumb is not None:
+        thumb = min(max(int(thumb), THUMB_MIN), THUMB_MAX)
+    with room.lock:
+        if room.raster is None:
+            room.raster = RoomRaster()
+        raster = room.raster
+    return raster.png(room, thumb)
@@ -0,0 +1,169 @@
+# ROOMS (whiteboard_rooms.py)
+# -----------------------------------------------------------------------------
+# DESCRIPTION:
+# Room state for the server. Rooms are fully isolated, so each Room has its own
+# lock and busy rooms never wait for each other.
+#
+#   - Looking a room up takes no lock (a single dict read).
+#   - Creating or deleting a room takes one of STRIPES locks, picked by room code.
+#   - Broadcasts read Room.members, an immutable tuple that is replaced on every
+#     join/leave, so fan-out needs no lock either.
+#   - Every drawing, ERASE and CLEAR gets the next sequence number of its room and
+#     is kept in a ring of the last RESUME_BUFFER, so a client that reconnects with
+#     "since=<seq>" only receives what it missed. These operations are sent under
+#     the room lock, so every client receives them in sequence order.
+#   - The lobby directory (code -> users, operations, last activity) is kept up to
+#     date by the rooms as they change, so listing rooms locks nothing.
+#   - allocate() hands out room codes that no room uses and nobody else was given.
+# -----------------------------------------------------------------------------
+import time
+import random
+import threading
+import collections
+
+from whiteboard_history import RoomHistory
+
+STRIPES = 64    # registry locks; rooms whose codes hash apart never contend
+RESUME_BUFFER = 4096    # recent operations kept per room for reconnect resume
+CODE_DIGITS = 4         # allocated room codes are this many digits
+CODE_RESERVE = 60       # seconds an allocated code is held for the client that asked
+
+
+class Room:
+    """State of one room. 'lock' guards clients, history, the sequence and empty_since.
+
+    The lock is re-entrant: operations are sent while it is held (so every client
+    sees them in sequence order), and a failed send may evict a client.
+    """
+
+    def __init__(self, code, history=None):
+        self.code = code
+        self.lock = threading.RLock()
+        self.clients = {}           # socket -> username
+        self.members = ()           # snapshot of the sockets, for lock-free broadcast
+        self.history = history or RoomHistory()
+        self.empty_since = None     # monotonic time the last client left
+        self.closed = False         # set once the room is removed from the registry
+        self.outbox = collections.deque()   # (sender, message) waiting for the next broadcast tick
+        self.scheduled = False      # room is in the scheduler's pending list
+        self.seq = 0                # sequence number of the last operation
+        self.epoch = f"{random.getrandbits(32):08x}"   # tells a recreated room from the old one
+        self.recent = collections.deque(maxlen=RESUME_BUFFER)   # (seq, Packet)
+        self.limit = None           # the room's RateLimit, set up by the server on first join
+        self.raster = None          # cached whiteboard_render.RoomRaster, made on the first export
+        self.listing = [0, 0, time.monotonic()]    # directory entry: users, operations, last activity
+
+    def record(self, packet):
+        """Numbers an operation and keeps it for resume; returns its sequence number."""
+        self.seq += 1
+        self.recent.append((self.seq, packet))
+        self.listing[1:] = self.seq, time.monotonic()
+        return self.seq
+
+    def since(self, seq):
+        """Operations after 'seq', or None if the ring no longer reaches back that far."""
+        if not 0 <= self.seq - seq <= len(self.recent):
+            return None
+        return [packet for number, packet in self.recent if number > seq]
+
+    def add_client(self, client_socket, username):
+        self.clients[client_socket] = username
+        self.members = tuple(self.clients)
+        self.empty_since = None
+        self.listing[0] = len(self.members)
+
+    def remove_client(self, client_socket):
+        username = self.clients.pop(client_socket)
+        self.members = tuple(self.clients)
+        self.listing[0] = len(self.members)
+        return username
+
+
+class RoomRegistry:
+    """room_code -> Room with lock-free lookups and striped locks for create/delete."""
+
+    def __init__(self, stripes=STRIPES):
+        self.rooms = {}
+        self.locks = [threading.Lock() for _ in range(stripes)]
+        self.directory = {}         # room_code -> the room's listing entry
+        self.reserved = {}          # allocated codes not joined yet -> monotonic expiry
+        self.reserve_lock = threading.Lock()
+
+    def stripe(self, room_code):
+        return self.locks[hash(room_code) % len(self.locks)]
+
+    def get(self, room_code):
+        return self.rooms.get(room_code)
+
+    def __contains__(self, room_code):
+        return room_code in self.rooms
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def values(self):
+        return list(self.rooms.values())
+
+    def add(self, room_code, history=None):
+        """Returns the room, creating it if needed."""
+        with self.stripe(room_code):
+            room = self.rooms.get(room_code)
+            if room is None:
+                room = self.rooms[room_code] = Room(room_code, history)
+                self.directory[room_code] = room.listing
+                self.reserved.pop(room_code, None)
+            return room
+
+    def join(self, room_code, client_socket, username, on_join=None):
+        """Adds a client to the room (created on demand) and returns the room.
+
+        on_join(room) runs under the room lock just before the client is added,
+        so nothing is broadcast to it before what on_join sends.
+        """
+        while True:
+            room = self.rooms.get(room_code) or self.add(room_code)
+            with room.lock:
+                # Lost a race with remove(): look the code up again
+                if not room.closed:
+                    if on_join:
+                        on_join(room)
+                    room.add_client(client_socket, username)
+                    return room
+
+    def remove(self, room):
+        """Deletes a room; call with room.lock held."""
+        room.closed = True
+        with self.stripe(room.code):
+            if self.rooms.get(room.code) is room:
+                del self.rooms[room.code]
+                del self.directory[room.code]
+
+    def listing(self):
+        """[(code, users, operations, idle seconds)] from the directory, busiest rooms first."""
+        now = time.monotonic()
+        entries = [(code, users, ops, int(now - active))
+                   for code, (users, ops, active) in list(self.directory.items())]
+        entries.sort(key=lambda entry: (-entry[1], entry[3]))
+        return entries
+
+    def allocate(self, digits=CODE_DIGITS, tries=100, replaces=None):
+        """A room code no room uses, held for CODE_RESERVE seconds; None if none is free.
+
+        replaces is the caller's previous reservation, given up for the new one."""
+        now = time.monotonic()
+        low, high = 10 ** (digits - 1), 10 ** digits - 1
+        with self.reserve_lock:
+            self.reserved.pop(replaces, None)
+            for code, expiry in list(self.reserved.items()):
+                if expiry < now:
+                    del self.reserved[code]
+            candidates = (str(random.randint(low, high)) for _ in range(tries))
+            # Nearly full: walk every code instead of guessing
+            if len(self.rooms) + len(self.reserved) > (high - low) // 2:
+                candidates = map(str, random.sample(range(low, high + 1), high - low + 1))
+            for code in candidates:
+                with self.stripe(code):     # add() takes it too: no room can appear meanwhile
+                    if code not in self.rooms and code not in self.reserved:
+                        self.reserved[code] = now + CODE_RESERVE
+                        return code
+        return None
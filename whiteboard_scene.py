@@ -0,0 +1,211 @@
+# SCENE MODEL (whiteboard_scene.py)
+# -----------------------------------------------------------------------------
+# DESCRIPTION:
+# What has been drawn, as objects rather than pixels: every drawing message
+# (DRAW, STROKE, LINE, RECT, CIRCLE, TRI) becomes one object with an id and a
+# bounding box, indexed by a uniform grid (same idea as the history's EraserGrid).
+#
+#   - region queries only visit the grid cells the region covers
+#   - ERASE,x1,y1,x2,y2 removes what crosses the rectangle: shapes as a whole,
+#     brush strokes only the segments inside it (a stroke can be split in two).
+#     Cutting segments gives the same picture whether a stroke arrived as DRAW
+#     segments or merged, so clients and the compacted server history agree.
+#   - the client draws only the objects inside its viewport (culling), so the
+#     cost of panning and zooming depends on what is visible, not on the history
+# -----------------------------------------------------------------------------
+import math
+
+GRID_CELL = 256         # world px per grid cell
+MAX_OBJECT_CELLS = 64   # objects whose box covers more cells go in one list returned by every query
+ELLIPSE_SEGMENTS = 32   # CIRCLE outlines are hit-tested as this many segments
+
+
+#Outline of a drawing as line segments (x1, y1, x2, y2), in drawing coordinates
+def op_segments(kind, fields):
+    if kind == b"STROKE":
+        coords = fields[2]
+        points = list(zip(coords[0::2], coords[1::2])) or [(0, 0)]
+        if len(points) == 1:
+            points *= 2
+        return [(ax, ay, bx, by) for (ax, ay), (bx, by) in zip(points, points[1:])]
+    if kind == b"TRI":
+        x1, y1, x2, y2, x3, y3 = fields[:6]
+        return [(x1, y1, x2, y2), (x2, y2, x3, y3), (x3, y3, x1, y1)]
+    x1, y1, x2, y2 = fields[:4]
+    if kind == b"RECT":
+        return [(x1, y1, x2, y1), (x2, y1, x2, y2), (x2, y2, x1, y2), (x1, y2, x1, y1)]
+    if kind == b"CIRCLE":
+        cx, cy, rx, ry = (x1 + x2) / 2, (y1 + y2) / 2, abs(x2 - x1) / 2, abs(y2 - y1) / 2
+        points = [(cx + rx * math.cos(2 * math.pi * i / ELLIPSE_SEGMENTS),
+                   cy + ry * math.sin(2 * math.pi * i / ELLIPSE_SEGMENTS)) for i in range(ELLIPSE_SEGMENTS + 1)]
+        return [(ax, ay, bx, by) for (ax, ay), (bx, by) in zip(points, points[1:])]
+    return [(x1, y1, x2, y2)]   # DRAW, LINE
+
+def op_size(kind, fields):
+    return fields[1] if kind == b"STROKE" else fields[-1]
+
+#Bounding box (left, top, right, bottom) including the pen width
+def op_bbox(kind, fields):
+    r = op_size(kind, fields) / 2
+    segments = op_segments(kind, fields)
+    xs = [v for s in segments for v in (s[0], s[2])]
+    ys = [v for s in segments for v in (s[1], s[3])]
+    return (min(xs) - r, min(ys) - r, max(xs) + r, max(ys) + r)
+
+def rects_overlap(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+#Liang-Barsky: does the segment cross the rectangle?
+def segment_hits_rect(x1, y1, x2, y2, rect):
+    t0, t1 = 0.0, 1.0
+    dx, dy = x2 - x1, y2 - y1
+    for p, q in ((-dx, x1 - rect[0]), (dx, rect[2] - x1), (-dy, y1 - rect[1]), (dy, rect[3] - y1)):
+        if p == 0:
+            if q < 0:
+                return False
+        elif p < 0:
+            t0 = max(t0, q / p)
+        else:
+            t1 = min(t1, q / p)
+        if t0 > t1:
+            return False
+    return True
+
+#True if the drawing's outline (with its pen width) passes through the rectangle
+def op_hits_rect(kind, fields, rect):
+    r = op_size(kind, fields) / 2
+    grown = (rect[0] - r, rect[1] - r, rect[2] + r, rect[3] + r)
+    return any(segment_hits_rect(*segment, grown) for segment in op_segments(kind, fields))
+
+def normalize_rect(x1, y1, x2, y2):
+    return (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+
+#What is left of a drawing after an ERASE of 'rect': None if untouched, otherwise
+#a list of (kind, fields) pieces (empty when it is gone completely)
+def erase_op(kind, fields, rect):
+    if not op_hits_rect(kind, fields, rect):
+        return None
+    if kind == b"DRAW":
+        kind, fields = b"STROKE", (fields[4], fields[5], list(fields[:4]))
+    if kind != b"STROKE":
+        return []
+    color, size, coords = fields
+    r = size / 2
+    grown = (rect[0] - r, rect[1] - r, rect[2] + r, rect[3] + r)
+    points = list(zip(coords[0::2], coords[1::2]))
+    pieces = []
+    run = points[:1]
+    for a, b in zip(points, points[1:]):
+        if segment_hits_rect(*a, *b, grown):
+            if len(run) > 1:
+                pieces.append(run)
+            run = [b]
+        else:
+            run.append(b)
+    if len(run) > 1:
+        pieces.append(run)
+    return [(b"STROKE", (color, size, [v for point in piece for v in point])) for piece in pieces]
+
+
+class SpatialGrid:
+    """Uniform grid: cell -> ids of the objects whose bounding box touches it."""
+
+    def __init__(self, cell=GRID_CELL):
+        self.cell = cell
+        self.cells = {}
+        self.large = set()  # ids of objects spanning more than MAX_OBJECT_CELLS cells
+
+    def cell_range(self, box):
+        c = self.cell
+        return (range(int(box[0] // c), int(box[2] // c) + 1),
+                range(int(box[1] // c), int(box[3] // c) + 1))
+
+    def insert(self, oid, box):
+        xs, ys = self.cell_range(box)
+        # A huge shape would fill thousands of cells: it is checked on every query instead
+        if len(xs) * len(ys) > MAX_OBJECT_CELLS:
+            self.large.add(oid)
+            return
+        for cx in xs:
+            for cy in ys:
+                self.cells.setdefault((cx, cy), set()).add(oid)
+
+    def remove(self, oid, box):
+        xs, ys = self.cell_range(box)
+        if len(xs) * len(ys) > MAX_OBJECT_CELLS:
+            self.large.discard(oid)
+            return
+        for cx in xs:
+            for cy in ys:
+                ids = self.cells.get((cx, cy))
+                if ids is not None:
+                    ids.discard(oid)
+                    if not ids:
+                        del self.cells[(cx, cy)]
+
+    def query(self, box):
+        """Ids of the objects that may touch 'box' (callers check the boxes themselves)."""
+        found = set(self.large)
+        xs, ys = self.cell_range(box)
+        if len(xs) * len(ys) > len(self.cells):
+            # A region bigger than the populated area: walk the cells instead
+            for (cx, cy), ids in self.cells.items():
+                if cx in xs and cy in ys:
+                    found |= ids
+            return found
+        for cx in xs:
+            for cy in ys:
+                ids = self.cells.get((cx, cy))
+                if ids:
+                    found |= ids
+        return found
+
+
+class Scene:
+    """Drawn objects by id, kept in drawing order (pieces of a cut stroke keep its place)."""
+
+    def __init__(self):
+        self.objects = {}   # id -> (kind, fields, bbox, order)
+        self.grid = SpatialGrid()
+        self.next_id = 1
+
+    def __len__(self):
+        return len(self.objects)
+
+    def add(self, kind, fields, order=None):
+        oid = self.next_id
+        self.next_id += 1
+        box = op_bbox(kind, fields)
+        self.objects[oid] = (kind, fields, box, oid if order is None else order)
+        self.grid.insert(oid, box)
+        return oid
+
+    def remove(self, oid):
+        box = self.objects.pop(oid)[2]
+        self.grid.remove(oid, box)
+
+    def clear(self):
+        self.objects = {}
+        self.grid = SpatialGrid(self.grid.cell)
+
+    def query(self, rect):
+        """Ids of the objects whose bounding box overlaps 'rect', in drawing order."""
+        found = [oid for oid in self.grid.query(rect) if rects_overlap(self.objects[oid][2], rect)]
+        return sorted(found, key=lambda oid: (self.objects[oid][3], oid))
+
+    def hits(self, rect):
+        """Ids of the objects whose outline passes through 'rect'."""
+        return [oid for oid in self.query(rect) if op_hits_rect(self.objects[oid][0], self.objects[oid][1], rect)]
+
+    def erase(self, rect):
+        """Applies an ERASE of 'rect'; returns (removed ids, ids of the pieces left)."""
+        removed, added = [], []
+        for oid in self.query(rect):
+            kind, fields, _, order = self.objects[oid]
+            pieces = erase_op(kind, fields, rect)
+            if pieces is None:
+                continue
+            self.remove(oid)
+            removed.append(oid)
+            added += [self.add(kind, fields, order) for kind, fields in pieces]
+        return removed, added
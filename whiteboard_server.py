@@ -4,252 +4,902 @@
 #
 # DESCRIPTION:
 # This program initializes a multi-threaded server acting as a central hub to manage users within isolated rooms. 
-# It utilizes a UDP socket method for automatic IP discovery.
-# It maintains a complete history of drawing commands to ensure state synchronization for new clients.
+# It can alternatively run every client on a single asyncio event loop ("async" mode, whiteboard_async.py) to hold thousands of connections.
+# It runs headless from the command line (systemd, containers); whiteboard_server_gui.py is the log window.
+# It maintains a compacted history of drawing commands (whiteboard_history.py) to ensure state synchronization for new clients.
+# Operations are numbered per room; a reconnecting client sends "since=<seq>" and gets only what it missed.
+# With --tls-cert/--tls-key both cores serve TLS (stdlib ssl); reconnecting clients resume their TLS session.
+# Before joining, clients can list the rooms (LIST_ROOMS) or ask for a free room code (NEW_ROOM), and a
+# UDP responder on the same port number lets clients find servers on the LAN (DISCOVER).
 #
 # -----------------------------------------------------------------------------
+import os
 import sys
+import time
+import queue
+import signal
 import socket
+import logging
+import argparse
 import threading
-import tkinter as tk
-from tkinter.scrolledtext import ScrolledText
+import collections
+import logging.handlers
+import whiteboard_metrics as metrics
+from whiteboard_framing import Framer
+from whiteboard_limits import RateLimit
+from whiteboard_journal import Journal
+from whiteboard_rooms import RoomRegistry
+from whiteboard_scheduler import BroadcastScheduler, flush_room
+from whiteboard_protocol import (Packet, WIRE_TEXT, WIRE_BINARY, WIRE_LEGACY, BINARY_VERSION, PROTO_LINE,
+                                 SEQ_OPTION, STROKE_OPTION, SLOW_OPTION, COMPRESS_VERSION, DRAWING_KINDS, compress_frames, OPCODES, decode_frame, format_line, frame_kind,
+                                 message_kind, check_drawing, LIST_ROOMS_LINE, NEW_ROOM_LINE, DISCOVER_QUERY)
 
 HOST = '0.0.0.0'
 PORT = 8000
+BACKLOG = 1024              # listen() backlog, so bursts of connects are not dropped
+SERVER_MODE = 'threaded'    # 'threaded' = one thread per client, 'async' = single event loop
+MAX_HANDSHAKE = 1024        # longest JOIN line accepted before the connection is dropped
+RECV_BUFFER = 16 * 1024     # per-client receive buffer (grows only for bigger messages)
 
-# 'rooms': maps room_code -> {"clients": {socket: username}, "history": [bytes]}
-rooms = {}
-rooms_lock = threading.Lock()
-log_widget = None
+# TLS: with a certificate and key the listening socket only speaks TLS ("make certs" creates test ones)
+TLS_CERT = None             # e.g. 'certs/server.crt'
+TLS_KEY = None              # e.g. 'certs/server.key'
+TLS_HANDSHAKE_TIMEOUT = 10  # seconds a new connection may take to complete the TLS handshake
+
+# Per-client outbound buffering: a slow reader only ever delays itself
+SEND_HIGH_WATER = 256 * 1024    # queued bytes before SEND_POLICY starts shedding load
+SEND_EVICT_LIMIT = 1024 * 1024  # queued bytes before the client is disconnected
+SEND_POLICY = 'coalesce'        # 'drop' = discard brush strokes, 'coalesce' = merge superseded messages
+TRANSPORT_BUFFER = 64 * 1024    # async mode: bytes handed to the transport before queueing
+BROADCAST_TICK = 0              # seconds; > 0 batches each room's messages per tick (e.g. 0.02)
+
+# Flood control (whiteboard_limits.py); a rate of 0 disables that limit. Drawings over
+# a limit are delayed (the client is not read until it is back in credit), chat is dropped
+CLIENT_MESSAGE_RATE = 200       # messages/s per connection
+CLIENT_BYTE_RATE = 256 * 1024   # bytes/s per connection
+ROOM_MESSAGE_RATE = 2000        # messages/s per room, all members together
+ROOM_BYTE_RATE = 2 * 1024 * 1024    # bytes/s per room
+MAX_MESSAGE = 64 * 1024         # longest line / frame a client may send; longer closes the connection
+MAX_HISTORY_BYTES = 8 * 1024 * 1024   # history size per room (after compaction); further drawings are refused
+NOTICE_INTERVAL = 1.0           # seconds between SLOW signals / notices to one client
+COMPRESS_MIN = 2048             # bulk transfers smaller than this are sent uncompressed
+
+# Lobby: room listing and LAN discovery
+DISCOVERY = True            # answer DISCOVER datagrams on UDP port PORT
+LIST_ROOMS_CACHE = 1.0      # seconds a LIST_ROOMS answer is reused
+LIST_ROOMS_MAX = 200        # rooms in a LIST_ROOMS answer, busiest first
+MAX_ROOM_CODE = 32          # longest room code accepted in JOIN, in UTF-8 bytes (it also names the journal directory)
+
+# Persistence: with a journal directory, rooms survive restarts
+JOURNAL_DIR = None          # e.g. 'journal'; None keeps rooms in memory only
+EMPTY_ROOM_TTL = 0          # seconds an empty room (and its journal) is kept; 0 = drop at once
+REAP_INTERVAL = 30          # seconds between checks for expired empty rooms
+
+# Observability: Prometheus text on http://127.0.0.1:METRICS_PORT/metrics (plus /profile,
+# and /render?room=CODE[&thumb=PX] room PNGs when Pillow is installed)
+METRICS_PORT = None         # e.g. 9100; None = no endpoint
+
+# 'rooms': maps room_code -> Room (clients {socket: username}, history, own lock)
+rooms = RoomRegistry()
+journal = None
+scheduler = None
+tls_context = None
+listing_cache = (0.0, b"")  # (monotonic expiry, encoded ROOMS line)
+
+# log() only enqueues; a listener thread (or the GUI loop) does the actual output
+log_queue = queue.SimpleQueue()
+logger = logging.getLogger("whiteboard")
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+logger.setLevel(logging.INFO)
+logger.propagate = False
+log_listener = None
+
+# --- metrics ---
+connections_total = metrics.Counter("whiteboard_connections_total", "Connections accepted")
+handshakes_failed = metrics.Counter("whiteboard_handshakes_failed_total", "Connections dropped before a valid JOIN")
+messages_in = metrics.Counter("whiteboard_messages_in_total", "Messages received, by opcode", ("kind",))
+bytes_in = metrics.Counter("whiteboard_bytes_in_total", "Bytes received, by opcode", ("kind",))
+messages_out = metrics.Counter("whiteboard_messages_out_total", "Messages sent (per recipient), by opcode", ("kind",))
+bytes_out = metrics.Counter("whiteboard_bytes_out_total", "Bytes sent (per recipient), by opcode", ("kind",))
+messages_dropped = metrics.Counter("whiteboard_messages_dropped_total", "Queued messages shed by SEND_POLICY")
+clients_evicted = metrics.Counter("whiteboard_clients_evicted_total", "Clients disconnected for falling behind")
+messages_rejected = metrics.Counter("whiteboard_messages_rejected_total", "Malformed drawings dropped at ingest",
+                                    ("kind",))
+rate_limited = metrics.Counter("whiteboard_rate_limited_total", "Messages over a rate or size limit, by action",
+                               ("action",))
+tls_handshakes = metrics.Counter("whiteboard_tls_handshakes_total", "Completed TLS handshakes, by session resumption",
+                                 ("resumed",))
+lobby_requests = metrics.Counter("whiteboard_lobby_requests_total", "LIST_ROOMS / NEW_ROOM / DISCOVER requests",
+                                 ("kind",))
+resumes = metrics.Counter("whiteboard_resumes_total", "Rejoins with since=<seq>, by how they were served", ("result",))
+broadcast_seconds = metrics.Histogram("whiteboard_broadcast_seconds", "Time to fan one message out to a room")
+broadcast_fanout = metrics.Histogram("whiteboard_broadcast_recipients", "Recipients per broadcast", metrics.SIZE_BUCKETS)
+metrics.Gauge("whiteboard_rooms", "Open rooms", lambda: len(rooms))
+metrics.Gauge("whiteboard_clients", "Clients in rooms", lambda: sum(len(room.members) for room in rooms.values()))
+metrics.Gauge("whiteboard_room_history_entries", "Snapshot ops plus tail messages per room",
+              lambda: {(room.code,): len(room.history) for room in rooms.values()}, ("room",))
+metrics.Gauge("whiteboard_room_history_bytes", "History size per room, as replayed to a text client",
+              lambda: {(room.code,): room.history.nbytes() for room in rooms.values()}, ("room",))
+metrics.Gauge("whiteboard_send_backlog_bytes", "Bytes queued for slow clients",
+              lambda: sum(send_backlog(client) for room in rooms.values() for client in room.members))
+metrics.Gauge("whiteboard_send_backlog_max_bytes", "Largest per-client send backlog",
+              lambda: max((send_backlog(client) for room in rooms.values() for client in room.members), default=0))
+
+#Metric label for a message kind; unknown commands share one label so clients cannot create series
+def kind_label(kind):
+    if kind in OPCODES:
+        return (kind.decode('ascii'),)
+    return ("bulk",) if kind == b"" else ("other",)
+
+#Bytes waiting to be written to a client (our queue plus, in async mode, the transport's buffer)
+def send_backlog(client):
+    backlog = client.queue.size
+    transport = getattr(client, "transport", None)
+    if transport is not None:
+        backlog += transport.get_write_buffer_size()
+    return backlog
 
 def broadcast(message, sender_socket, room_code):
-    with rooms_lock:
-        room = rooms.get(room_code)
-        if not room:
-            return
-        room_list = list(room["clients"].keys())
-    for client in room_list:
+    room = rooms.get(room_code)
+    if not room:
+        return
+    if scheduler:
+        scheduler.queue(room, message, sender_socket)
+        return
+    started = time.perf_counter()
+    members = room.members
+    for client in members:
         if client == sender_socket:
             continue
-        try:
-            client.send(message)
-
-        except:
-            client.close()
+        client.send(message)
+    broadcast_seconds.observe(time.perf_counter() - started)
+    broadcast_fanout.observe(len(members) - 1)
 
 #Updates the User List
 def send_user_list(room_code):
-    with rooms_lock:
-        room = rooms.get(room_code)
-        if not room:
-            return
-        users = list(room["clients"].values())
-        recipeients  = list(room["clients"].keys())
+    room = rooms.get(room_code)
+    if not room:
+        return
+    with room.lock:
+        users = list(room.clients.values())
+        recipeients  = room.members
     if not users:
         return
     msg = "USER_LIST," + ",".join(users) + "\n"
-    encoded_msg = msg.encode('utf-8')
+    packet = Packet(text=msg.encode('utf-8'))
     for client in recipeients:
+        client.send(packet)
+
+class OutboundQueue:
+    """Bounded buffer of messages waiting to be written to one client.
+
+    Above SEND_HIGH_WATER the policy sheds load: 'drop' discards new brush
+    segments and strokes, 'coalesce' removes queued messages that a new one supersedes
+    (older USER_LISTs, drawings before a CLEAR). put() returns False once the
+    client is more than SEND_EVICT_LIMIT bytes behind and should be evicted.
+    """
+
+    def __init__(self, high_water=None, evict_limit=None, policy=None):
+        self.high_water = SEND_HIGH_WATER if high_water is None else high_water
+        self.evict_limit = SEND_EVICT_LIMIT if evict_limit is None else evict_limit
+        self.policy = SEND_POLICY if policy is None else policy
+        self.items = collections.deque()   # (kind, data, bulk)
+        self.size = 0
+        self.bulk = 0               # queued bytes of bulk transfers, part of size
+        self.dropped = 0
+
+    def put(self, data, kind=b"", bulk=False):
+        # bulk transfers (history replay) are sized by the room, not by a slow reader,
+        # so only the live messages queued behind them count towards the limits
+        if not bulk:
+            live = self.size - self.bulk
+            if live + len(data) > self.evict_limit:
+                return False
+            if live >= self.high_water:
+                if self.policy == 'drop' and kind in (b"DRAW", b"STROKE"):
+                    self.dropped += 1
+                    messages_dropped.inc()
+                    return True
+                if self.policy == 'coalesce':
+                    self.coalesce(kind)
+        self.items.append((kind, data, bulk))
+        self.size += len(data)
+        if bulk:
+            self.bulk += len(data)
+        return True
+
+    def coalesce(self, kind):
+        if kind == b"USER_LIST":
+            superseded = (b"USER_LIST",)
+        elif kind == b"CLEAR":
+            superseded = DRAWING_KINDS + (b"ERASE",)
+        else:
+            return
+        kept = collections.deque(item for item in self.items if item[2] or item[0] not in superseded)
+        if len(kept) < len(self.items):
+            messages_dropped.inc(len(self.items) - len(kept))
+        self.dropped += len(self.items) - len(kept)
+        self.items = kept
+        self.size = sum(len(data) for _, data, _ in kept)
+
+    def take(self):
+        data = b"".join(data for _, data, _ in self.items)
+        self.items.clear()
+        self.size = self.bulk = 0
+        return data
+
+class ClientConnection:
+    """Threaded-mode client: the socket plus an OutboundQueue drained by a writer thread.
+
+    send() only queues, so broadcasting never blocks on a peer's TCP window.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.queue = OutboundQueue()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.room_code = None
+        self.wire = WIRE_TEXT       # format we send in
+        self.wire_in = WIRE_TEXT    # format we expect from the client
+        self.sequenced = False      # client asked for SEQ markers
+        self.slow = False           # client asked for SLOW signals
+        self.compressed = False     # client takes bulk transfers as ZBLOCKs
+        self.limit = RateLimit(CLIENT_MESSAGE_RATE, CLIENT_BYTE_RATE)
+        self.resume_at = 0.0        # monotonic time until which it is not read (rate limit debt)
+        self.notified_at = 0.0
+        self.reserved_code = None   # code from its last NEW_ROOM, one per connection
+        threading.Thread(target=self.writer, daemon=True).start()
+
+    def recv(self, size):
+        return self.sock.recv(size)
+
+    def recv_into(self, buffer):
+        return self.sock.recv_into(buffer)
+
+    def send(self, message, bulk=False):
+        kind, data = outgoing(message, self.wire)
+        if not data:
+            return 0
+        with self.cond:
+            if self.closed:
+                return 0
+            queued = self.queue.put(data, kind, bulk)
+            if queued:
+                self.cond.notify()
+        if not queued:
+            evict_client(self)
+            return 0
+        return len(data)
+
+    def writer(self):
+        while True:
+            with self.cond:
+                while not self.queue.size and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                data = self.queue.take()
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                self.close()
+                return
+
+    def close(self):
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify()
         try:
-            client.send(encoded_msg)
+            #shutdown wakes the reader thread blocked in recv()
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
 
-        except: #If failed to connect to client, close socket
-            log("Failed to send message to {client}. Disconnecting")
-            client.close()
+#Returns (kind, bytes) of a Packet or pre-encoded bytes for a client using 'wire'
+def outgoing(message, wire):
+    if isinstance(message, Packet):
+        kind, data = message.kind, message.encode(wire)
+    else:
+        kind, data = b"", message
+    label = kind_label(kind)
+    messages_out.inc(1, label)
+    bytes_out.inc(len(data), label)
+    return kind, data
+
+#Drops a client that fell too far behind or whose connection failed
+def evict_client(client):
+    room_code = getattr(client, "room_code", None)
+    clients_evicted.inc()
+    if room_code:
+        log(f"Evicting slow client from room {room_code}.")
+        leave_room(client, room_code)
+    client.close()
 
-def handle_client(client_socket):
+def handle_client(raw_socket):
     #JOIN,Name,RoomCode
     username = ""
     room_code = None
+    raw_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if tls_context:
+        raw_socket = tls_accept(raw_socket)
+        if raw_socket is None:
+            return
+    client_socket = ClientConnection(raw_socket)
+    framer = Framer(RECV_BUFFER, MAX_MESSAGE)
+    connections_total.inc()
     try:
-        parts = decode_message(client_socket)
+        parts = decode_message(client_socket, framer)
         if parts is None:
+            handshakes_failed.inc()
             log("Handshake failed")
             client_socket.close()
             return
         
-        username = parts[1].strip()
-        room_code = parts[2].strip()    
-        join_room(client_socket, username,room_code)
-        load_history(client_socket, username,room_code)
+        username, room_code, options = parts
+        client_socket.room_code = room_code
+        negotiate(client_socket, options)
+        join_room(client_socket, username,room_code, options)
+        load_history(client_socket, username,room_code, framer)
 
     except Exception as e:
         log(f"ERROR: {e}")
 
     finally:
         if room_code:
-            with rooms_lock:
-                room = rooms.get(room_code)
-                if room and client_socket in room["clients"]:
-                    username_removed = room["clients"][client_socket]
-                    log(f"Disconnected: {username_removed} left room {room_code}.")      
-                    #remove clients
-                    del room["clients"][client_socket]
-                    #delete room if empty
-                    if not room["clients"]:
-                        del rooms[room_code]
-                    else:
-                        users = list(room["clients"].values())
-                        recieve = list(room["clients"].keys())
-            if recieve:
-                msg = "USER_LIST," + ",".join(users) + "\n"
-                encoded_msg = msg.encode('utf-8')     
-            
-            for client in recieve:
-                try:
-                    #send a new user list to all clients
-                    client.send(encoded_msg)
-                except:
-                    client.close()
-                                
+            leave_room(client_socket, room_code)
         client_socket.close()
 
-#Decodes Handshake
-def decode_message(client_socket):
+#Runs the server side of the TLS handshake on a client's thread; None if it fails
+def tls_accept(raw_socket):
+    raw_socket.settimeout(TLS_HANDSHAKE_TIMEOUT)
     try:
-        data = client_socket.recv(1024)
-        if not data:
-            return None
-        
-        join_msg = data.decode('utf-8')
-        if not join_msg.startswith("JOIN,"): #Checks for protocol JOIN
-            return None
-        
-        parts = join_msg.split(',' , 2)#Checks for fields
-        if len(parts) < 3:
+        tls_socket = tls_context.wrap_socket(raw_socket, server_side=True)
+    except OSError as e:    # ssl.SSLError is an OSError
+        handshakes_failed.inc()
+        log(f"TLS handshake failed: {e}")
+        raw_socket.close()
+        return None
+    tls_socket.settimeout(None)
+    tls_handshakes.inc(1, (str(tls_socket.session_reused).lower(),))
+    return tls_socket
+
+#Removes a client from its room and sends the new user list to the others
+def leave_room(client_socket, room_code):
+    room = rooms.get(room_code)
+    if not room:
+        return
+    with room.lock:
+        if client_socket not in room.clients:
+            return
+        username_removed = room.remove_client(client_socket)
+        #delete room if empty (or keep it around for EMPTY_ROOM_TTL)
+        if not room.clients:
+            if EMPTY_ROOM_TTL > 0:
+                room.empty_since = time.monotonic()
+            else:
+                delete_room(room)
+    log(f"Disconnected: {username_removed} left room {room_code}.")
+    send_user_list(room_code)
+
+#Decodes Handshake; whatever follows the JOIN line stays in the framer
+def decode_message(client_socket, framer):
+    try:
+        while True:
+            line = framer.next_line()
+            while line is None:
+                if framer.pending() > MAX_HANDSHAKE or not framer.fill(client_socket):
+                    return None
+                line = framer.next_line()
+            if bytes(line) not in LOBBY_REQUESTS:
+                break
+            if not answer_lobby(client_socket, bytes(line)):
+                return None
+
+        parts = parse_join(bytes(line))
+        if parts is None:
             client_socket.close()
             return None
-        
         return parts
     except:
             return None
 
-#Client Join Manager
-def join_room(client_socket, username, room_code):
-    with rooms_lock:
-        if room_code not in rooms:
-            rooms[room_code] = {"clients": {}, "history": []}
-        rooms[room_code]["clients"][client_socket] = username
+LOBBY_REQUESTS = (LIST_ROOMS_LINE[:-1], NEW_ROOM_LINE[:-1])
+
+#Answers a LIST_ROOMS or NEW_ROOM line sent before JOIN; False (and closes) when over the rate limit
+def answer_lobby(client_socket, line):
+    if client_socket.limit.take(len(line), time.monotonic()) > 0:
+        client_socket.close()
+        return False
+    lobby_requests.inc(1, (line.decode('ascii'),))
+    if line == LIST_ROOMS_LINE[:-1]:
+        client_socket.send(room_listing(), bulk=True)
+    else:
+        client_socket.reserved_code = rooms.allocate(replaces=client_socket.reserved_code)
+        client_socket.send(format_line(b"ROOM", (client_socket.reserved_code or "",)), bulk=True)
+    return True
+
+#The ROOMS line for LIST_ROOMS, rebuilt from the room directory at most every LIST_ROOMS_CACHE seconds
+def room_listing():
+    global listing_cache
+    expiry, data = listing_cache
+    now = time.monotonic()
+    if now >= expiry:
+        data = format_line(b"ROOMS", rooms.listing()[:LIST_ROOMS_MAX])
+        listing_cache = (now + LIST_ROOMS_CACHE, data)
+    return data
+
+#Splits a JOIN,Name,RoomCode[,option...] line into (username, room_code, options)
+def parse_join(data):
+    try:
+        join_msg = data.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    if not join_msg.startswith("JOIN,"): #Checks for protocol JOIN
+        return None
+
+    parts = join_msg.strip().split(',')#Checks for fields
+    if len(parts) < 3 or len(parts[2].strip().encode('utf-8')) > MAX_ROOM_CODE:
+        return None
+    return parts[1].strip(), parts[2].strip(), parts[3:]
+
+#Agrees on the wire format: clients that offer "bin1" get binary frames from now on
+def negotiate(client_socket, options):
+    if BINARY_VERSION in options:
+        client_socket.send(PROTO_LINE, bulk=True)
+        client_socket.wire = WIRE_BINARY
+    elif STROKE_OPTION not in options:
+        client_socket.wire = WIRE_LEGACY    # an older text client: polylines go out as DRAW segments
+    client_socket.sequenced = SEQ_OPTION in options
+    client_socket.slow = SLOW_OPTION in options
+    # ZBLOCKs carry binary frames, so compression needs the binary wire
+    client_socket.compressed = COMPRESS_VERSION in options and client_socket.wire == WIRE_BINARY
+
+#Returns (seq, epoch) from the "since=<seq>" and "epoch=<id>" JOIN options, or None
+def resume_point(options):
+    values = dict(option.partition('=')[::2] for option in options)
+    try:
+        return int(values["since"]), values.get("epoch", "")
+    except (KeyError, ValueError):
+        return None
+
+def seq_marker(seq, epoch=""):
+    return Packet(text=format_line(b"SEQ", (seq, epoch)))
+
+#Deletes a room and its journal (called with room.lock held)
+def delete_room(room):
+    rooms.remove(room)
+    if journal:
+        journal.drop(room.code)
+
+#Client Join Manager: the history goes out before the client can receive any broadcast
+def join_room(client_socket, username, room_code, options=()):
+    def on_join(room):
+        if room.limit is None:
+            room.limit = RateLimit(ROOM_MESSAGE_RATE, ROOM_BYTE_RATE)
+        send_history(client_socket, room, options)
+    rooms.join(room_code, client_socket, username, on_join)
     log(f"New Connection: {username} joined room {room_code}.")
     send_user_list(room_code)
 
-#History Manager
-def load_history(client_socket, username, room_code):
-    with rooms_lock:
-        history_cp = list(rooms[room_code]["history"])
+#Reads the client's messages until it disconnects
+def load_history(client_socket, username, room_code, framer):
+    while True:
+        process_input(client_socket, username, room_code, framer)
+        wait = client_socket.resume_at - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)    # over its rate limit: not reading lets TCP push back on the client
+        elif not framer.fill(client_socket):
+            break
+
+#Sends a joining client the room's drawings as one bulk write (called with room.lock held):
+#only the operations it missed when it resumes with "since=<seq>", otherwise the whole history
+def send_history(client_socket, room, options=()):
+    if scheduler:
+        flush_room(room)    # queued operations belong to the members from before this join
+    wire = client_socket.wire
+    resume = resume_point(options)
+    missed = room.since(resume[0]) if resume and resume[1] == room.epoch else None
+    if missed is not None:
+        resumes.inc(1, ("delta",))
+        data = b"".join(packet.encode(wire) for packet in missed)
+        if client_socket.compressed and len(data) >= COMPRESS_MIN:
+            data = compress_frames(data)
+    else:
+        data = room.history.replay(wire, client_socket.compressed)
+        if resume:
+            # The client still shows its old canvas (or another room's)
+            resumes.inc(1, ("snapshot",))
+            data = Packet(text=b"CLEAR\n").encode(wire) + data
+    if client_socket.sequenced:
+        data += seq_marker(room.seq, room.epoch).encode(wire)
+    if data:
+        client_socket.send(data, bulk=True)
+
+#Handles every complete message waiting in the client's framer.
+#Text lines end in '\n'; once a client has confirmed "PROTO,bin1" it sends binary frames.
+def process_input(client_socket, username, room_code, framer):
+    while True:
+        # Over its rate limit: leave the rest in the framer until the client is back in credit
+        if client_socket.resume_at and client_socket.resume_at > time.monotonic():
+            break
+        # The wire format can change between two messages (PROTO ack)
+        binary = client_socket.wire_in == WIRE_BINARY
+        message = framer.next_message(client_socket.wire_in)
+        if message is None:
+            break
+        # Messages outlive the receive buffer (history, send queues): keep a copy of each
+        if binary:
+            handle_frame(client_socket, username, room_code, bytes(message))
+        else:
+            handle_message(client_socket, username, room_code, bytes(message))
 
-    for hist in history_cp:
+#Applies one protocol line from a client to its room (shared by both server cores)
+def handle_message(client_socket, username, room_code, raw_msg):
+    kind = message_kind(raw_msg)
+    label = kind_label(kind)
+    messages_in.inc(1, label)
+    bytes_in.inc(len(raw_msg) + 1, label)
+    if not admit(client_socket, room_code, kind, len(raw_msg) + 1):
+        return
+    if kind in DRAWING_KINDS or kind == b"ERASE":
+        # Peers parse what we relay: a malformed drawing is dropped here, not sent on
+        if raw_msg.isascii() and check_drawing(raw_msg, WIRE_TEXT):
+            relay(client_socket, room_code, Packet(text=raw_msg + b'\n'))
+        else:
+            messages_rejected.inc(1, label)
+    elif kind == b"CLEAR":
+        relay(client_socket, room_code, Packet(text=b"CLEAR\n"))
+    elif kind == b"CHAT":
         try:
-            client_socket.send(hist)
+            message = raw_msg.decode('utf-8')
+        except UnicodeDecodeError:
+            return
+        _, _, text = message.partition(',')
+        full = f"CHAT,{username},{text}\n"
+        broadcast(Packet(text=full.encode('utf-8')), client_socket, room_code)
+    elif raw_msg + b'\n' == PROTO_LINE and client_socket.wire == WIRE_BINARY:
+        client_socket.wire_in = WIRE_BINARY
 
-        except:
+#Applies one binary frame from a client; drawings are checked, then forwarded as received
+def handle_frame(client_socket, username, room_code, frame):
+    kind = frame_kind(frame)
+    label = kind_label(kind)
+    messages_in.inc(1, label)
+    bytes_in.inc(len(frame), label)
+    if not admit(client_socket, room_code, kind, len(frame)):
+        return
+    if kind == b"CLEAR":
+        relay(client_socket, room_code, Packet(frame=frame))
+    elif kind in DRAWING_KINDS or kind == b"ERASE":
+        if check_drawing(frame, WIRE_BINARY):
+            relay(client_socket, room_code, Packet(frame=frame))
+        else:
+            messages_rejected.inc(1, label)
+    elif kind == b"CHAT":
+        try:
+            _, (_, text) = decode_frame(frame)
+        except (ValueError, IndexError):
             return
+        full = f"CHAT,{username},{text}\n"
+        broadcast(Packet(text=full.encode('utf-8')), client_socket, room_code)
 
-    buffer = b""
-    while True:
-        data = client_socket.recv(1024)
-        if not data:
-            break
+#Charges one message to the client's and the room's rate limits. Chat over a limit is
+#dropped (False); anything else is let through, and the client is not read again until
+#the debt is paid back (process_input checks resume_at).
+def admit(client_socket, room_code, kind, size):
+    room = rooms.get(room_code)
+    limits = [client_socket.limit] + ([room.limit] if room and room.limit else [])
+    now = time.monotonic()
+    if kind == b"CHAT" and not all(limit.allows(size, now) for limit in limits):
+        rate_limited.inc(1, ("dropped",))
+        return False
+    wait = max(limit.take(size, now) for limit in limits)
+    if wait > 0:
+        rate_limited.inc(1, ("delayed",))
+        client_socket.resume_at = max(client_socket.resume_at, now + wait)
+        if client_socket.slow and now - client_socket.notified_at >= NOTICE_INTERVAL:
+            client_socket.notified_at = now
+            client_socket.send(Packet(text=format_line(b"SLOW", (max(1, round(wait * 1000)),))))
+    return True
+
+#Tells a client why its drawings are refused (a chat line from "server"), at most once per NOTICE_INTERVAL
+def notify(client_socket, text):
+    now = time.monotonic()
+    if now - client_socket.notified_at >= NOTICE_INTERVAL:
+        client_socket.notified_at = now
+        client_socket.send(Packet(text=format_line(b"CHAT", ("server", text))))
 
-        buffer += data
-        while b'\n' in buffer:
-            raw_msg, buffer = buffer.split(b'\n', 1)
+#Records a drawing (or CLEAR / ERASE) in the room history and journal, numbers it and
+#forwards it. The fan-out happens under the room lock, so everyone gets operations in order.
+def relay(client_socket, room_code, packet):
+    room = rooms.get(room_code)
+    if not room:
+        return
+    with room.lock:
+        history = room.history
+        if packet.kind in DRAWING_KINDS and history.nbytes() >= MAX_HISTORY_BYTES:
+            history.compact()
+            if history.nbytes() >= MAX_HISTORY_BYTES:
+                rate_limited.inc(1, ("refused",))
+                notify(client_socket, "The board is full: clear it to keep drawing.")
+                return
+        # Journal first: an operation the disk refused is not applied or sent anywhere,
+        # so the history, the peers and the journal never disagree
+        due = False
+        if journal:
             try:
-                message = raw_msg.decode('utf-8')
+                due = journal.append(room_code, packet)
+            except OSError as e:
+                log(f"Journal write failed in room {room_code}: {e}")
+                notify(client_socket, "The server could not save that: try again.")
+                return
+        if packet.kind == b"CLEAR":
+            history.clear()
+            # The CLEAR record covers recovery until the empty checkpoint is on disk
+            journal_checkpoint(room_code, b"")
+        else:
+            history.append(packet)
+            if due:
+                history.compact()
+                journal_checkpoint(room_code, history.replay(WIRE_TEXT))
+        seq = room.record(packet)
+        broadcast(packet, client_socket, room_code)
+        # The sender does not get its own operation back: tell it where it landed
+        # (with a scheduler, the tick's batch ends with a marker instead)
+        if client_socket.sequenced and not scheduler:
+            client_socket.send(seq_marker(seq))
 
-            except UnicodeDecodeError:
+#Starts a journal checkpoint; on a disk error the segments still hold every record
+def journal_checkpoint(room_code, state):
+    if not journal:
+        return
+    try:
+        journal.checkpoint(room_code, state)
+    except OSError as e:
+        log(f"Journal checkpoint failed in room {room_code}: {e}")
+
+#Opens the journal and rebuilds the rooms it holds
+def restore_rooms():
+    global journal
+    if EMPTY_ROOM_TTL > 0:
+        threading.Thread(target=reap_empty_rooms, daemon=True).start()
+    if not JOURNAL_DIR:
+        return
+    journal = Journal(JOURNAL_DIR)
+    for room_code, history in journal.recover().items():
+        rooms.add(room_code, history).empty_since = time.monotonic()
+        log(f"Restored room {room_code} ({len(history)} drawings).")
+
+#Deletes rooms that have been empty for longer than EMPTY_ROOM_TTL
+def reap_empty_rooms():
+    while True:
+        time.sleep(REAP_INTERVAL)
+        now = time.monotonic()
+        for room in rooms.values():
+            with room.lock:
+                if room.empty_since is None or now - room.empty_since <= EMPTY_ROOM_TTL:
+                    continue
+                delete_room(room)
+            log(f"Room {room.code} expired.")
+
+#Binds the UDP responder for LAN discovery (same port number as the TCP listener)
+def start_discovery():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        sock.bind((HOST, PORT))
+    except OSError as e:
+        log(f"LAN discovery disabled: {e}")
+        sock.close()
+        return
+    threading.Thread(target=answer_discovery, args=(sock,), daemon=True).start()
+
+#Answers every DISCOVER datagram with SERVER,port,rooms,users,tls
+def answer_discovery(sock):
+    while True:
+        try:
+            data, address = sock.recvfrom(64)
+            if data.strip() != DISCOVER_QUERY.strip():
                 continue
-                
-            msg_nl = message + '\n'
-            encoded = msg_nl.encode('utf-8')
-            if message.startswith(("DRAW,", "LINE,", "RECT,", "CIRCLE,", "TRI,")):
-                with rooms_lock:
-                    rooms[room_code]["history"].append(encoded)
-                broadcast(encoded, client_socket, room_code)
-            elif message.startswith("CLEAR"):
-                with rooms_lock:
-                    rooms[room_code]["history"].clear()
-                broadcast(encoded, client_socket, room_code)
-            elif message.startswith("CHAT,"):
-                _, _, text = message.partition(',')
-                full = f"CHAT,{username},{text}\n"
-                broadcast(full.encode('utf-8'), client_socket, room_code)
-
-#Gets the server's IP
+            lobby_requests.inc(1, ("DISCOVER",))
+            users = sum(entry[0] for entry in list(rooms.directory.values()))
+            sock.sendto(format_line(b"SERVER", (PORT, len(rooms), users, int(tls_context is not None))), address)
+        except OSError:
+            continue    # e.g. the sender is gone; keep serving the others
+
+#GET /render?room=CODE[&thumb=PX]: the room as a PNG (runs on an HTTP thread)
+def export_room(query):
+    room = rooms.get(query.get("room", [""])[0])
+    if room is None:
+        return None
+    try:
+        thumb = int(query["thumb"][0]) if "thumb" in query else None
+    except ValueError:
+        return None
+    import whiteboard_render as render
+    return render.render_room(room, thumb), "image/png"
+
+#The LAN address other machines reach this one at. Only for display (the GUI title):
+#connecting a UDP socket sends nothing, it just picks the outgoing interface
 def get_ip():
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
-        s.connect(('8.8.8.8',1))
-        log("Got IP")
+        s.connect(('10.255.255.255', 1))
         IP = s.getsockname()[0]
-    except Exception:
-        log("Failed to get IP")
+    except OSError:
         IP = '127.0.0.1'
     finally:
         s.close()
     return IP
 
-#Starts the Server
-def start_server():
+#Server-side TLS context from TLS_CERT / TLS_KEY. Session tickets (TLS 1.3) and the
+#session cache (TLS 1.2) are on by default, so a reconnecting client skips the full handshake
+def make_tls_context():
+    import ssl  # only TLS servers pay for loading OpenSSL
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(TLS_CERT, TLS_KEY)
+    return context
+
+#Starts the Server; returns False if it could not (certificate, busy port). With
+#log_to_stdout=False the caller drains log_queue itself (the GUI)
+def start_server(log_to_stdout=True):
+    global tls_context
+    if log_to_stdout:
+        start_logging()
+    if TLS_CERT:
+        try:
+            tls_context = make_tls_context()
+        except OSError as e:
+            log(f"Error: cannot load the TLS certificate: {e}")
+            return False
+        log(f"TLS enabled ({TLS_CERT})")
+    if METRICS_PORT:
+        import whiteboard_render as render  # Pillow is only loaded for the /render endpoint
+        if render.available:
+            metrics.ROUTES["/render"] = export_room
+        metrics.serve_metrics(METRICS_PORT)
+        log(f"Metrics on http://127.0.0.1:{METRICS_PORT}/metrics")
+    restore_rooms()
+    if DISCOVERY:
+        start_discovery()
+    if BROADCAST_TICK > 0 and SERVER_MODE != 'async':
+        start_scheduler()
+    if SERVER_MODE == 'async':
+        import whiteboard_async
+        return whiteboard_async.start_async_server()
+    return start_threaded_server()
+
+#Thread-per-client server core
+def start_threaded_server():
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     try:
         server_socket.bind((HOST, PORT))
     except OSError:
         log(f"Error: Port {PORT} is busy. Is the server already running?")
-        return
-    server_socket.listen(5)
-    lan_ip = get_ip()
+        return False
+    server_socket.listen(BACKLOG)
     log(f"Server listening on {HOST}:{PORT}")
-    log(f"IP: {lan_ip}")
     while True:
         try:
             client_socket, addr = server_socket.accept()
             threading.Thread(target=handle_client, args=(client_socket,), daemon=True).start()
         except OSError:
-            break
+            return True
+
 
-def stop_server():
-    if window:
-        window.destroy()
-    sys.exit()
-
-#Creates the GUI for the Server Log
-def server_gui():
-    global log_widget, window
-    window = tk.Tk()
-    window.geometry("500x400")
-    control_frame = tk.Frame(window)
-    control_frame.pack(side = tk.TOP, fill = tk.X, padx = 10, pady = 5)
-    
-    window.title(f"Whiteboard Server ({get_ip()})")
-
-    button_stop = tk.Button(
-        control_frame,
-        text = "Stop Server",
-        font = ("Consolas", 10),
-        command = stop_server
-    )
-    button_stop.pack(side = tk.RIGHT)
-
-    log_widget = ScrolledText(window, state = 'disabled', font =("Consolas", 10))
-    log_widget.pack(padx = 10, pady = 10, fill = tk.BOTH, expand = True)
-
-    
-    server_thread = threading.Thread(target = start_server, daemon = True)
-    server_thread.start()
-
-    window.mainloop()
-
-#Puts the Logs into the GUI
+#Switches broadcast() to per-room batches sent every BROADCAST_TICK seconds
+def start_scheduler(loop=None):
+    global scheduler
+    scheduler = BroadcastScheduler(BROADCAST_TICK, loop)
+    log(f"Broadcasting in {BROADCAST_TICK * 1000:g} ms ticks")
+
+#Lifts the open-file limit so the async core can hold thousands of sockets
+def raise_fd_limit():
+    try:
+        import resource
+    except ImportError: #Not available on Windows
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = 65536 if hard == resource.RLIM_INFINITY else hard
+    if soft < target:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        except (ValueError, OSError):
+            pass
+
+#Flushes the journal and the log; called on exit (SIGTERM, Ctrl+C, the GUI's Stop button)
+def shutdown():
+    global journal
+    if journal:
+        journal.close()
+        journal = None
+    if log_listener:
+        log_listener.stop()
+
+#Queues a log line; never blocks the thread or event loop that calls it
 def log(msg):
-    if log_widget:
-        log_widget.configure(state = "normal")
-        log_widget.insert(tk.END, msg + '\n')
-        log_widget.see(tk.END)
-        log_widget.configure(state = "disabled")
-    else:
-        print(msg)
+    logger.info(msg)
+
+#A background thread prints the queued log lines (the GUI drains the queue itself)
+def start_logging():
+    global log_listener
+    if log_listener is None:
+        log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+        log_listener.start()
+
+#Sets the options from the command line; returns the parsed arguments
+def configure(argv=None):
+    global HOST, PORT, BACKLOG, SERVER_MODE, METRICS_PORT, BROADCAST_TICK, JOURNAL_DIR, EMPTY_ROOM_TTL
+    global CLIENT_MESSAGE_RATE, ROOM_MESSAGE_RATE, DISCOVERY, TLS_CERT, TLS_KEY
+    parser = argparse.ArgumentParser(description="Whiteboard server (headless; whiteboard_server_gui.py shows a log window)")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--backlog", type=int, default=BACKLOG, help="listen() backlog")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="serve every client on one event loop")
+    parser.add_argument("--workers", type=int, default=1, help="> 1 runs the sharded cluster with this many processes")
+    parser.add_argument("--tick", type=float, default=BROADCAST_TICK * 1000, help="broadcast tick in ms (0 = send at once)")
+    parser.add_argument("--journal", default=JOURNAL_DIR, metavar="DIR", help="keep rooms across restarts")
+    parser.add_argument("--keep-empty", type=float, default=EMPTY_ROOM_TTL, metavar="SECONDS")
+    parser.add_argument("--metrics", type=int, metavar="PORT", help="Prometheus /metrics (and /render) port")
+    parser.add_argument("--client-rate", type=float, default=CLIENT_MESSAGE_RATE, help="messages/s per client, 0 = off")
+    parser.add_argument("--room-rate", type=float, default=ROOM_MESSAGE_RATE, help="messages/s per room, 0 = off")
+    parser.add_argument("--tls-cert", default=TLS_CERT)
+    parser.add_argument("--tls-key", default=TLS_KEY)
+    parser.add_argument("--no-discovery", action="store_true", help="do not answer LAN discovery broadcasts")
+    parser.add_argument("--headless", action="store_true", help=argparse.SUPPRESS)  # the default now; kept for old scripts
+    args = parser.parse_args(argv)
+    if args.workers > 1 and args.tls_cert:
+        parser.error("--tls-cert is not supported with --workers (the cluster front reads JOIN in plain text)")
+
+    HOST, PORT, BACKLOG = args.host, args.port, args.backlog
+    SERVER_MODE = 'async' if args.use_async else SERVER_MODE
+    METRICS_PORT = args.metrics
+    BROADCAST_TICK = args.tick / 1000
+    JOURNAL_DIR, EMPTY_ROOM_TTL = args.journal, args.keep_empty
+    CLIENT_MESSAGE_RATE, ROOM_MESSAGE_RATE = args.client_rate, args.room_rate
+    DISCOVERY = not args.no_discovery
+    TLS_CERT, TLS_KEY = args.tls_cert, args.tls_key
+    return args
+
+#--workers N: replaces this process with whiteboard_cluster.py (the front and N async
+#workers). Its spawned workers then import this file once, as whiteboard_server, and
+#not a second time as the main module. The cluster never answers DISCOVER, so
+#--no-discovery needs no forwarding.
+def run_cluster(args):
+    cluster_args = ["--port", str(args.port), "serve", "--host", args.host, "--workers", str(args.workers),
+                    "--backlog", str(args.backlog), "--keep-empty", str(args.keep_empty), "--tick", str(args.tick),
+                    "--client-rate", str(args.client_rate), "--room-rate", str(args.room_rate)]
+    if args.journal:
+        cluster_args += ["--journal", args.journal]
+    if args.metrics:
+        cluster_args += ["--metrics", str(args.metrics)]
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "whiteboard_cluster.py")
+    sys.stdout.flush()
+    os.execv(sys.executable, [sys.executable, script] + cluster_args)
+
+#Command line / daemon entry point: no GUI modules, no network lookups before listening
+def main(argv=None):
+    args = configure(argv)
+    if args.workers > 1:
+        run_cluster(args)
+        return
+    # SIGTERM (systemd, docker stop) exits like Ctrl+C, so the journal is flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        ok = start_server()
+    except KeyboardInterrupt:
+        ok = True
+    finally:
+        shutdown()
+    sys.exit(0 if ok else 1)
 
 if __name__ == "__main__":
-    server_gui()
+    # whiteboard_async and whiteboard_cluster import this file by name: give them these globals
+    sys.modules.setdefault("whiteboard_server", sys.modules["__main__"])
+    main()
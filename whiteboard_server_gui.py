@@ -0,0 +1,87 @@
+# SERVER LOG WINDOW (whiteboard_server_gui.py)
+# -----------------------------------------------------------------------------
+# Hoonhee Jang 21011676 & Ulmasov Muzaffar - 23013095
+#
+# DESCRIPTION:
+# Optional Tkinter front end for whiteboard_server.py: runs the server on a
+# background thread and shows its log. Only this file imports Tk, so the server
+# itself starts without a display. Log lines are queued by the server and moved
+# into the window by the Tk loop, the only thread allowed to touch the widgets.
+# The LAN address in the title is looked up off the Tk thread.
+#
+# Usage: python whiteboard_server_gui.py [same options as whiteboard_server.py]
+# -----------------------------------------------------------------------------
+import sys
+import queue
+import threading
+import tkinter as tk
+from tkinter.scrolledtext import ScrolledText
+
+import whiteboard_server as server
+
+LOG_POLL_MS = 100           # how often the queued log lines are moved into the window
+
+window = None
+log_widget = None
+lan_ip = None               # set by find_ip(), shown in the title by drain_log()
+
+
+def stop_server():
+    server.shutdown()
+    if window:
+        window.destroy()
+    sys.exit()
+
+#Looks up the LAN IP on a worker thread, so a slow lookup never delays the window
+def find_ip():
+    global lan_ip
+    lan_ip = server.get_ip()
+
+#Moves the queued log lines (and, once known, the LAN IP) into the window
+def drain_log():
+    if lan_ip and window.title() == "Whiteboard Server":
+        window.title(f"Whiteboard Server ({lan_ip}:{server.PORT})")
+    lines = []
+    while True:
+        try:
+            lines.append(server.log_queue.get_nowait().getMessage())
+        except queue.Empty:
+            break
+    if lines:
+        log_widget.configure(state = "normal")
+        log_widget.insert(tk.END, "\n".join(lines) + '\n')
+        log_widget.see(tk.END)
+        log_widget.configure(state = "disabled")
+    window.after(LOG_POLL_MS, drain_log)
+
+#Creates the GUI for the Server Log
+def server_gui():
+    global log_widget, window
+    window = tk.Tk()
+    window.geometry("500x400")
+    window.title("Whiteboard Server")
+    control_frame = tk.Frame(window)
+    control_frame.pack(side = tk.TOP, fill = tk.X, padx = 10, pady = 5)
+
+    button_stop = tk.Button(
+        control_frame,
+        text = "Stop Server",
+        font = ("Consolas", 10),
+        command = stop_server
+    )
+    button_stop.pack(side = tk.RIGHT)
+
+    log_widget = ScrolledText(window, state = 'disabled', font =("Consolas", 10))
+    log_widget.pack(padx = 10, pady = 10, fill = tk.BOTH, expand = True)
+    window.after(LOG_POLL_MS, drain_log)
+    window.protocol("WM_DELETE_WINDOW", stop_server)
+
+    threading.Thread(target = find_ip, daemon = True).start()
+    server_thread = threading.Thread(target = server.start_server, args = (False,), daemon = True)
+    server_thread.start()
+
+    window.mainloop()
+
+if __name__ == "__main__":
+    server.configure()
+    server_gui()